@@ -0,0 +1,158 @@
+"""Position analysis for the GUI, done off the UI thread.
+
+AnalysisWorker takes positions from the GUI and works them out on a background thread: the
+legal moves of every piece (for highlighting) and whether the game is over. An optional move
+chooser, e.g. an engine playing one side, runs in a separate process so a long search doesn't
+compete with the UI for the interpreter. With an opening book, positions in it get their book
+moves as hints and the chooser plays from the book before searching. Results come back as
+ANALYSIS_EVENT pygame events.
+
+Submitting a new position cancels whatever was still being worked out for the previous one,
+and events carry the generation they were computed for, so the GUI can drop stale ones.
+"""
+
+import logging
+import queue
+import threading
+
+import pygame
+
+from board import Board, Move, ONGOING
+from bitboard import SQUARE_NAMES
+
+ANALYSIS_EVENT = pygame.event.custom_type()
+logger = logging.getLogger(__name__)
+
+_engine = None  # One engine per chooser process, so its transposition table carries over between moves
+_book = None  # Likewise the chooser process's opening book, mapped once
+
+
+def engine_move_chooser(start_fen, moves=(), time_limit=1.0, book_path=None):
+    """Best move in UCI, according to the book or else the engine, for the position after playing moves (UCI)
+    from start_fen, or None if there is none. The game is replayed rather than set up from a FEN so the
+    search sees its repetitions."""
+    global _engine, _book
+    board = Board(start_fen)
+    for uci in moves:
+        board.make_move(Move.from_uci(uci))
+    if book_path is not None:
+        from book import OpeningBook
+
+        if _book is None:
+            _book = OpeningBook(book_path)
+        move = _book.choose(board)
+        if move is not None:
+            return move.uci()
+
+    from engine import Engine  # Imported in the chooser process only, the GUI never needs it
+
+    if _engine is None:
+        _engine = Engine()
+    result = _engine.search(board, time_limit=time_limit)
+    return result.best_move.uci() if result.best_move else None
+
+
+def analyse(board):
+    """Legal targets of every piece of the side to move, as {start: [end, ...]} square names, and the game status.
+
+    The status is one of Board.game_status's, or 'check' when the game goes on with the side to move in check.
+    """
+    targets = {}
+    for move in board.generate_legal_moves():
+        ends = targets.setdefault(SQUARE_NAMES[move.start], [])
+        if SQUARE_NAMES[move.end] not in ends:
+            ends.append(SQUARE_NAMES[move.end])
+
+    status = board.game_status().status
+    if status == ONGOING and board.is_in_check(board.turn):
+        status = 'check'
+
+    return targets, status
+
+
+class AnalysisWorker:
+    def __init__(self, move_chooser=None, chooser_colors=(), book=None):
+        """move_chooser, if given, is called in another process with the start FEN and UCI moves of the game
+        for every position where one of chooser_colors is to move, and returns a move in UCI. It must be picklable (a module level function
+        or a functools.partial of one). book is an OpeningBook to look every position up in.
+        """
+        self.move_chooser = move_chooser
+        self.chooser_colors = set(chooser_colors)
+        self.book = book
+        self.generation = 0
+        self._jobs = queue.Queue()
+        self._pool = None
+        if move_chooser is not None:
+            # Process support is only imported when there is something to run in another process
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(max_workers=1)
+        self._thread = threading.Thread(target=self._run, name='analysis', daemon=True)
+        self._thread.start()
+
+    def submit(self, board):
+        """Analyse a copy of the board's position, cancelling the previous request. Returns its generation."""
+        self.generation += 1
+        # The whole game rather than a FEN, so repetitions can be detected
+        self._jobs.put((self.generation, board.start_fen, board.move_history()))
+        return self.generation
+
+    def cancel(self):
+        """Drop whatever is queued or running; its results will not be posted."""
+        self.generation += 1
+
+    def stop(self):
+        self.cancel()
+        self._jobs.put(None)
+        self._thread.join()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _is_current(self, generation):
+        return generation == self.generation
+
+    def _post(self, generation, kind, **data):
+        # pygame.event.post is safe to call from other threads
+        if self._is_current(generation):
+            pygame.event.post(pygame.event.Event(ANALYSIS_EVENT, kind=kind, generation=generation, **data))
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            generation, start_fen, moves = job
+            if not self._is_current(generation):
+                continue  # A newer position is already queued
+
+            board = Board(start_fen)
+            for move in moves:
+                board.make_move(move)
+            targets, status = analyse(board)
+            # Book moves as (uci, weight), heaviest first
+            book = []
+            if self.book is not None:
+                book = sorted(((entry.move.uci(), entry.weight) for entry in self.book.entries(board)),
+                              key=lambda hint: -hint[1])
+            self._post(generation, 'analysis', targets=targets, status=status, book=book)
+
+            if self._pool is not None and status in ('check', ONGOING) and board.turn in self.chooser_colors:
+                self._choose_move(generation, start_fen, [move.uci() for move in moves])
+
+    def _choose_move(self, generation, start_fen, moves):
+        from concurrent.futures import wait
+
+        future = self._pool.submit(self.move_chooser, start_fen, moves)
+        # Wake up now and then to give up on a position the GUI has moved on from
+        while not future.done():
+            if not self._is_current(generation):
+                future.cancel()  # A search that already started finishes in the background and is ignored
+                return
+            wait([future], timeout=0.05)
+
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error("Move chooser failed: %r", future.exception())
+            return
+        self._post(generation, 'move', move=future.result())
@@ -0,0 +1,154 @@
+"""Bitboard helpers and precomputed attack tables.
+
+Squares are numbered the same way Board.board is indexed: square = row * 8 + col,
+so a8 is 0, h8 is 7 and h1 is 63. Bit n of a bitboard is set when square n is in the set.
+"""
+
+WHITE, BLACK = 0, 1
+COLOR_INDEX = {'white': WHITE, 'black': BLACK}
+COLORS = ('white', 'black')
+
+# Piece type order used to index per-piece bitboards: color * 6 + type
+PIECE_TYPES = 'PNBRQK'
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+FULL = (1 << 64) - 1
+FILE_A = sum(1 << (row * 8) for row in range(8))
+FILE_H = FILE_A << 7
+
+# Move directions as (row step, col step). Sliders repeat them, knights and kings take a single step
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KING_OFFSETS = QUEEN_DIRECTIONS
+KNIGHT_OFFSETS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+
+SQUARE_NAMES = [f"{chr(sq % 8 + ord('a'))}{8 - sq // 8}" for sq in range(64)]
+SQUARE_INDEX = {name: sq for sq, name in enumerate(SQUARE_NAMES)}
+
+
+# Castling rights bits
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+ALL_CASTLING = 15
+
+# Per color: king home square, then (right, king target, rook start, rook target, squares that must be empty,
+# squares the king crosses) for the king side and queen side
+CASTLING = [
+    (60, [(WHITE_KINGSIDE, 62, 63, 61, (1 << 61) | (1 << 62), (1 << 61) | (1 << 62)),
+          (WHITE_QUEENSIDE, 58, 56, 59, (1 << 57) | (1 << 58) | (1 << 59), (1 << 58) | (1 << 59))]),
+    (4, [(BLACK_KINGSIDE, 6, 7, 5, (1 << 5) | (1 << 6), (1 << 5) | (1 << 6)),
+         (BLACK_QUEENSIDE, 2, 0, 3, (1 << 1) | (1 << 2) | (1 << 3), (1 << 2) | (1 << 3))]),
+]
+
+# Rights kept after any move touching the square (king and rook home squares lose theirs)
+CASTLING_MASK = [ALL_CASTLING] * 64
+CASTLING_MASK[60] &= ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[63] &= ~WHITE_KINGSIDE
+CASTLING_MASK[56] &= ~WHITE_QUEENSIDE
+CASTLING_MASK[4] &= ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[7] &= ~BLACK_KINGSIDE
+CASTLING_MASK[0] &= ~BLACK_QUEENSIDE
+
+# Rows pawns promote on: row 0 (rank 8) for white, row 7 (rank 1) for black
+PROMOTION_RANKS = 0xFF | (0xFF << 56)
+LIGHT_SQUARES = sum(1 << sq for sq in range(64) if ((sq >> 3) + (sq & 7)) % 2 == 0)  # a8 is light
+DARK_SQUARES = FULL ^ LIGHT_SQUARES
+
+
+def iter_bits(bb):
+    """Yield the square of every set bit, lowest first."""
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+
+def lsb_square(bb):
+    return (bb & -bb).bit_length() - 1
+
+
+def _step_table(offsets):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        bb = 0
+        for row_step, col_step in offsets:
+            r, c = row + row_step, col + col_step
+            if 0 <= r < 8 and 0 <= c < 8:
+                bb |= 1 << (r * 8 + c)
+        table.append(bb)
+
+    return table
+
+
+KNIGHT_ATTACKS = _step_table(KNIGHT_OFFSETS)
+KING_ATTACKS = _step_table(KING_OFFSETS)
+# Squares attacked by a pawn of the given color standing on the square
+PAWN_ATTACKS = [_step_table([(-1, -1), (-1, 1)]), _step_table([(1, -1), (1, 1)])]
+
+
+def pawn_attacks(pawns, color_index):
+    """Every square attacked by a set of pawns, computed with shifts instead of per-pawn lookups."""
+    if color_index == WHITE:
+        # White pawns attack towards row 0, i.e. lower square numbers
+        return ((pawns >> 9) & ~FILE_H) | ((pawns >> 7) & ~FILE_A)
+
+    return (((pawns << 7) & ~FILE_H) | ((pawns << 9) & ~FILE_A)) & FULL
+
+
+def _ray_table(row_step, col_step):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        bb = 0
+        r, c = row + row_step, col + col_step
+        while 0 <= r < 8 and 0 <= c < 8:
+            bb |= 1 << (r * 8 + c)
+            r += row_step
+            c += col_step
+        table.append(bb)
+
+    return table
+
+
+# Rays split by whether they run towards higher square numbers (first blocker is the lowest bit)
+# or towards lower ones (first blocker is the highest bit)
+def _rays(directions):
+    positive = [_ray_table(*d) for d in directions if d[0] * 8 + d[1] > 0]
+    negative = [_ray_table(*d) for d in directions if d[0] * 8 + d[1] < 0]
+    return positive, negative
+
+
+ROOK_RAYS = _rays(ROOK_DIRECTIONS)
+BISHOP_RAYS = _rays(BISHOP_DIRECTIONS)
+
+
+def _slider_attacks(rays, sq, occupied):
+    positive, negative = rays
+    attacks = 0
+    for table in positive:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= table[(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for table in negative:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= table[blockers.bit_length() - 1]
+        attacks |= ray
+
+    return attacks
+
+
+def rook_attacks(sq, occupied):
+    return _slider_attacks(ROOK_RAYS, sq, occupied)
+
+
+def bishop_attacks(sq, occupied):
+    return _slider_attacks(BISHOP_RAYS, sq, occupied)
+
+
+def queen_attacks(sq, occupied):
+    return _slider_attacks(ROOK_RAYS, sq, occupied) | _slider_attacks(BISHOP_RAYS, sq, occupied)
@@ -1,65 +1,142 @@
-from typing import List, Union, Optional
-
-import pygame
-from pygame.examples.midi import NullKey
+from collections import namedtuple
 
 from piece import *
+from zobrist import PIECE_KEYS, SIDE_KEY, CASTLING_KEYS, en_passant_key, compute_hash
+from evaluation import PSQ_SCORES, PIECE_PHASES
+
+
+NO_ATTACK_MAPS = (None, None)
+CASTLING_LETTERS = (('K', WHITE_KINGSIDE), ('Q', WHITE_QUEENSIDE), ('k', BLACK_KINGSIDE), ('q', BLACK_QUEENSIDE))
+CASTLING_RIGHTS = dict(CASTLING_LETTERS)
+
+# Game states reported by Board.game_status
+ONGOING = 'ongoing'
+CHECKMATE = 'checkmate'
+STALEMATE = 'stalemate'
+REPETITION = 'threefold repetition'
+FIFTY_MOVES = 'fifty-move rule'
+INSUFFICIENT_MATERIAL = 'insufficient material'
+GameStatus = namedtuple('GameStatus', ('status', 'result'))  # result is the PGN result, e.g. '1-0' or '*'
+
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
 
+# FEN letter -> (piece class, color)
+FEN_PIECES = {symbol: (piece_class, 'white') for symbol, piece_class in PIECE_CLASSES.items()}
+FEN_PIECES.update({symbol.lower(): (piece_class, 'black') for symbol, piece_class in PIECE_CLASSES.items()})
 
-def scale_image(image, square_size, margin=5):
-    # Calculate effective size by subtracting the margin
-    effective_size = square_size - 2 * margin
+# Parsed FEN rows by their text. The same rows come up again and again when loading many
+# positions, so parsing each one once makes bulk loading much cheaper.
+_FEN_ROW_CACHE = {}
+_FEN_ROW_CACHE_LIMIT = 100_000
 
-    # Get original image dimensions
-    original_width, original_height = image.get_size()
+_logger = None
 
-    # Determine scaling factor to fit the image within the effective size
-    scaling_factor = min(effective_size / original_width, effective_size / original_height)
 
-    # Calculate new dimensions
-    new_width = int(original_width * scaling_factor)
-    new_height = int(original_height * scaling_factor)
+def _log():
+    """The rules' logger. logging is only imported on first use, it would add a third to the cost of importing the rules."""
+    global _logger
+    if _logger is None:
+        import logging
+
+        _logger = logging.getLogger(__name__)
+    return _logger
+
+
+def _parse_fen_row(text):
+    """The (column, FEN letter) of every piece in one row of a FEN placement."""
+    squares = _FEN_ROW_CACHE.get(text)
+    if squares is not None:
+        return squares
+
+    squares = []
+    col = 0
+    for char in text:
+        if char in '12345678':
+            col += int(char)
+        elif char in FEN_PIECES and col < 8:
+            squares.append((col, char))
+            col += 1
+        else:
+            raise ValueError(f"Invalid FEN row {text!r}")
+    if col != 8:
+        raise ValueError(f"Invalid FEN row {text!r}")
 
-    # Scale the image
-    return pygame.transform.scale(image, (new_width, new_height)), margin
+    if len(_FEN_ROW_CACHE) >= _FEN_ROW_CACHE_LIMIT:
+        _FEN_ROW_CACHE.clear()
+    squares = _FEN_ROW_CACHE[text] = tuple(squares)
+    return squares
+
+
+# typing.NamedTuple would do the same, but importing typing costs more than the rest of the rules together
+class Move(namedtuple('Move', ('start', 'end', 'promotion'), defaults=(None,))):
+    """start and end are square numbers (see bitboard.py), promotion is 'Q', 'R', 'B' or 'N' when a pawn promotes."""
+    __slots__ = ()
+
+    def uci(self):
+        """The move in long algebraic form, e.g. "e2e4" or "e7e8q"."""
+        return SQUARE_NAMES[self.start] + SQUARE_NAMES[self.end] + (self.promotion.lower() if self.promotion else '')
+
+    @classmethod
+    def from_uci(cls, text):
+        promotion = text[4].upper() if len(text) > 4 else None
+        return cls(SQUARE_INDEX[text[:2]], SQUARE_INDEX[text[2:4]], promotion)
+
+    def __str__(self):
+        return self.uci()
 
 
 class Board:
-    def __init__(self):
-        # Use Union to specify that each board cell can contain a string or a piece
-        self.board: List[List[Optional[Union[str, Rook, Knight, Bishop, Queen, King, Pawn]]]] = [
+    # Endgame tablebases (a tablebase.Tablebases) that is_in_checkmate answers from in the endings they cover.
+    # Set on the class to share one set between every board, or on a single board.
+    tablebases = None
+
+    def __init__(self, fen=None):
+        # Each board cell holds a piece (Rook, Knight, Bishop, Queen, King or Pawn) or ' ' when empty
+        self.board = [
             [' ' for _ in range(8)] for _ in range(8)
         ]
-        self.setup_pieces()
+        # One bitboard per piece type and color (indexed by Piece.index) plus occupancy per color
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0]
+
+        # King square per color and lazily computed attack maps, invalidated whenever a piece moves
+        self.king_squares = [None, None]
+        self._attack_maps = NO_ATTACK_MAPS
+        self._king_danger_maps = NO_ATTACK_MAPS
+
         self.turn = 'white'
         self.en_passant_target = None  # Square available for en passant capture
-        self.square_size = 100
-        self.colors = [(240, 217, 181), (181, 136, 99)]
-        self.selected_piece = None
-        self.highlighted_moves = []
+        self.castling_rights = 0  # WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+        self.halfmove_clock = 0  # Moves since the last capture or pawn move
+        self.fullmove_number = 1
+        self.zobrist_key = 0  # Hash of the position, see zobrist.py
+        # Material and piece-square score (packed middlegame and endgame, positive for white) and game phase,
+        # kept up to date as pieces are put on and taken off squares, see evaluation.py
+        self.psq_score = 0
+        self.phase = 0
+        # How many times each position (by zobrist key) has occurred in the game, for repetition draws
+        self.position_counts = {}
+
+        # One record per move made, holding everything unmake_move needs to restore the position
+        self._undo_stack = []
+        self.start_fen = STARTING_FEN  # Position the moves on the undo stack were played from
+
+        if fen is None:
+            self.setup_pieces()
+        else:
+            self.set_fen(fen)
 
-        # For blinking animation when king is checked
+        # Set when a move is rejected because it would leave the king in check
         self.king_in_check = False
         self.king_in_check_position = None
-        self.check_start_time = None
-
-        # Popup state for checkmate popup
-        self.running = True
-        self.draw_popup = False
-        self.resign_popup = False
-        self.checkmate_popup = False
-        self.popup_message = ""
-        self.game_over = False
-
-        # Popup start for promoting
-        self.promotion_popup = False
-        self.promotion_position = None
-        self.promotion_piece = None
 
+        # Game result, set when a move delivers checkmate
+        self.game_over = False
+        self.result_message = ""
 
     def setup_pieces(self):
         self.board[0] = [
-            ' ', Knight('black', 'b8'), Bishop('black', 'c8'),
+            Rook('black', 'a8'), Knight('black', 'b8'), Bishop('black', 'c8'),
             Queen('black', 'd8'), King('black', 'e8'),
             Bishop('black', 'f8'), Knight('black', 'g8'), Rook('black', 'h8')
         ]
@@ -68,265 +145,522 @@ class Board:
         # White pieces
         self.board[6] = [Pawn('white', f'{chr(97 + col)}2') for col in range(8)]
         self.board[7] = [
-            Rook('white', 'a1'), ' ', ' ',
-            ' ', King('white', 'e1'),
-            ' ', ' ', Rook('white', 'h1')
+            Rook('white', 'a1'), Knight('white', 'b1'), Bishop('white', 'c1'),
+            Queen('white', 'd1'), King('white', 'e1'),
+            Bishop('white', 'f1'), Knight('white', 'g1'), Rook('white', 'h1')
         ]
-
-    def draw_board(self, screen):
+        self.rebuild_bitboards()
+
+        # Castling is allowed on every side that still has its king and rook at home
+        self.castling_rights = 0
+        for color_index, (home, sides) in enumerate(CASTLING):
+            if self.king_squares[color_index] == home:
+                for right, _, rook_start, _, _, _ in sides:
+                    if self.bitboards[color_index * 6 + ROOK] >> rook_start & 1:
+                        self.castling_rights |= right
+        self.zobrist_key = compute_hash(self)
+        self.position_counts = {self.zobrist_key: 1}
+
+    @classmethod
+    def from_fen(cls, fen):
+        """Create a board from a FEN string."""
+        return cls(fen)
+
+    def set_fen(self, fen):
+        """Replace the position with the one described by a FEN string.
+
+        The bitboards and zobrist key are filled in while the placement is read, so loading a
+        position costs one pass over its pieces.
+        """
+        fields = fen.split()
+        if not 4 <= len(fields) <= 6:
+            raise ValueError(f"Invalid FEN, expected 4 to 6 fields: {fen!r}")
+        placement, turn, castling, en_passant = fields[:4]
+        rows = placement.split('/')
+        if len(rows) != 8:
+            raise ValueError(f"Invalid FEN, expected 8 rows: {fen!r}")
+        if turn not in ('w', 'b'):
+            raise ValueError(f"Invalid FEN side to move {turn!r}")
+        if en_passant != '-' and (en_passant not in SQUARE_INDEX or en_passant[1] not in '36'):
+            raise ValueError(f"Invalid FEN en passant square {en_passant!r}")
+
+        board = []
+        bitboards = [0] * 12
+        occupancy = [0, 0]
+        king_squares = [None, None]
+        key = psq_score = phase = 0
+        for row, text in enumerate(rows):
+            board_row = [' '] * 8
+            for col, letter in _parse_fen_row(text):
+                sq = row * 8 + col
+                piece_class, color = FEN_PIECES[letter]
+                piece = board_row[col] = piece_class(color, SQUARE_NAMES[sq])
+                bitboards[piece.index] |= 1 << sq
+                occupancy[piece.color_index] |= 1 << sq
+                key ^= PIECE_KEYS[piece.index][sq]
+                psq_score += PSQ_SCORES[piece.index][sq]
+                phase += PIECE_PHASES[piece.index]
+                if piece_class is King:
+                    king_squares[piece.color_index] = sq
+            board.append(board_row)
+
+        self.board = board
+        self.bitboards = bitboards
+        self.occupancy = occupancy
+        self.king_squares = king_squares
+        self.psq_score = psq_score
+        self.phase = phase
+        self._attack_maps = NO_ATTACK_MAPS
+        self._king_danger_maps = NO_ATTACK_MAPS
+
+        self.turn = 'white' if turn == 'w' else 'black'
+        self.castling_rights = 0
+        if castling != '-':
+            for letter in castling:
+                if letter not in CASTLING_RIGHTS:
+                    raise ValueError(f"Invalid FEN castling field {castling!r}")
+                self.castling_rights |= CASTLING_RIGHTS[letter]
+        self.en_passant_target = None if en_passant == '-' else en_passant
+        try:
+            self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+            self.fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError(f"Invalid FEN move counters: {fen!r}") from None
+        self._undo_stack = []
+        self.start_fen = fen
+
+        key ^= CASTLING_KEYS[self.castling_rights] ^ en_passant_key(self)
+        self.zobrist_key = key ^ SIDE_KEY if turn == 'b' else key
+        self.position_counts = {self.zobrist_key: 1}
+
+    def to_fen(self):
+        """Describe the position as a FEN string."""
+        rows = []
+        for row in self.board:
+            text = ''
+            empty = 0
+            for piece in row:
+                if piece == ' ':
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += piece.symbol if piece.color == 'white' else piece.symbol.lower()
+            if empty:
+                text += str(empty)
+            rows.append(text)
+
+        castling = ''.join(letter for letter, right in CASTLING_LETTERS if self.castling_rights & right) or '-'
+        return (f"{'/'.join(rows)} {'w' if self.turn == 'white' else 'b'} {castling} "
+                f"{self.en_passant_target or '-'} {self.halfmove_clock} {self.fullmove_number}")
+
+    def rebuild_bitboards(self):
+        """Recompute every bitboard from the pieces on self.board."""
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0]
+        self.king_squares = [None, None]
+        self.psq_score = 0
+        self.phase = 0
         for row in range(8):
             for col in range(8):
-                pos = cords_to_pos(row, col)
-
-                # Alter square colors
-                color = self.colors[(row + col) % 2]
-
-                # Blinking animation
-                if pos == self.king_in_check_position and self.king_in_check:
-                    elapsed_time = pygame.time.get_ticks() - self.check_start_time
-                    if elapsed_time < 500:  # Blink for 500ms
-                        color = (255, 0, 0)  # Red
-                    else:
-                        # Stop blinking after 500ms
-                        self.king_in_check = False
-                        self.king_in_check_position = None
-
-                pygame.draw.rect(
-                    screen,
-                    color,
-                    (col * self.square_size, row * self.square_size, self.square_size, self.square_size)
-                )
-
-                # Highlight moves
-                if cords_to_pos(row, col) in self.highlighted_moves:
-                    pygame.draw.rect(
-                        screen,
-                        (255, 255, 0),  # Yellow border
-                        (col * self.square_size, row * self.square_size, self.square_size, self.square_size),
-                        5  # Border thickness
-                    )
-
                 piece = self.board[row][col]
-                if piece != " ":
-                    self.draw_piece(screen, piece, col, row)
+                if piece != ' ':
+                    bit = 1 << (row * 8 + col)
+                    self.bitboards[piece.index] |= bit
+                    self.occupancy[piece.color_index] |= bit
+                    piece.square = row * 8 + col
+                    self.psq_score += PSQ_SCORES[piece.index][row * 8 + col]
+                    self.phase += PIECE_PHASES[piece.index]
+                    if piece.piece_type == KING:
+                        self.king_squares[piece.color_index] = row * 8 + col
+        self._attack_maps = NO_ATTACK_MAPS
+        self._king_danger_maps = NO_ATTACK_MAPS
+
+    def _put_piece(self, piece, sq):
+        """Place a piece on an empty square, keeping the bitboards in sync."""
+        bit = 1 << sq
+        self.board[sq >> 3][sq & 7] = piece
+        self.bitboards[piece.index] |= bit
+        self.occupancy[piece.color_index] |= bit
+        piece.square = sq
+        piece.position = SQUARE_NAMES[sq]
+        self.zobrist_key ^= PIECE_KEYS[piece.index][sq]
+        self.psq_score += PSQ_SCORES[piece.index][sq]
+        self.phase += PIECE_PHASES[piece.index]
+        if piece.piece_type == KING:
+            self.king_squares[piece.color_index] = sq
+        self._attack_maps = NO_ATTACK_MAPS
+        self._king_danger_maps = NO_ATTACK_MAPS
+
+    def _remove_piece(self, sq):
+        """Take the piece off a square and return it (or ' ' if the square was empty)."""
+        piece = self.board[sq >> 3][sq & 7]
+        if piece != ' ':
+            mask = ~(1 << sq)
+            self.board[sq >> 3][sq & 7] = ' '
+            self.bitboards[piece.index] &= mask
+            self.occupancy[piece.color_index] &= mask
+            self.zobrist_key ^= PIECE_KEYS[piece.index][sq]
+            self.psq_score -= PSQ_SCORES[piece.index][sq]
+            self.phase -= PIECE_PHASES[piece.index]
+            if piece.piece_type == KING:
+                self.king_squares[piece.color_index] = None
+            self._attack_maps = NO_ATTACK_MAPS
+            self._king_danger_maps = NO_ATTACK_MAPS
+
+        return piece
+
+    def _compute_attacks(self, color_index, occupied):
+        bitboards = self.bitboards
+        base = color_index * 6
+
+        attacks = pawn_attacks(bitboards[base + PAWN], color_index)
+        for sq in iter_bits(bitboards[base + KNIGHT]):
+            attacks |= KNIGHT_ATTACKS[sq]
+        for sq in iter_bits(bitboards[base + KING]):
+            attacks |= KING_ATTACKS[sq]
+
+        queens = bitboards[base + QUEEN]
+        for sq in iter_bits(bitboards[base + ROOK] | queens):
+            attacks |= rook_attacks(sq, occupied)
+        for sq in iter_bits(bitboards[base + BISHOP] | queens):
+            attacks |= bishop_attacks(sq, occupied)
+
+        return attacks
+
+    def attacked_squares(self, color_index):
+        """Bitboard of every square attacked by the given color."""
+        maps = self._attack_maps
+        attacks = maps[color_index]
+        if attacks is None:
+            attacks = self._compute_attacks(color_index, self.occupancy[0] | self.occupancy[1])
+            self._attack_maps = (attacks, maps[1]) if color_index == WHITE else (maps[0], attacks)
+
+        return attacks
+
+    def king_danger_squares(self, color_index):
+        """Squares the given color's king may not step to.
+
+        Enemy attacks are computed with the king taken off the board, so sliders see through
+        the square it is leaving.
+        """
+        maps = self._king_danger_maps
+        danger = maps[color_index]
+        if danger is None:
+            occupied = (self.occupancy[0] | self.occupancy[1]) & ~self.bitboards[color_index * 6 + KING]
+            danger = self._compute_attacks(1 - color_index, occupied)
+            self._king_danger_maps = (danger, maps[1]) if color_index == WHITE else (maps[0], danger)
+
+        return danger
+
+    def is_square_attacked(self, sq, by_color_index):
+        """Check if any piece of the given color attacks the square."""
+        attacks = self._attack_maps[by_color_index]
+        if attacks is not None:
+            return attacks >> sq & 1 == 1
+
+        # Without a cached map a reverse lookup from the square is cheaper than building one
+        bitboards = self.bitboards
+        base = by_color_index * 6
+
+        if KNIGHT_ATTACKS[sq] & bitboards[base + KNIGHT]:
+            return True
+        if KING_ATTACKS[sq] & bitboards[base + KING]:
+            return True
+        # A pawn of ours on the square would attack exactly the squares the enemy pawns attack it from
+        if PAWN_ATTACKS[1 - by_color_index][sq] & bitboards[base + PAWN]:
+            return True
+
+        occupied = self.occupancy[0] | self.occupancy[1]
+        queens = bitboards[base + QUEEN]
+        if rook_attacks(sq, occupied) & (bitboards[base + ROOK] | queens):
+            return True
+        if bishop_attacks(sq, occupied) & (bitboards[base + BISHOP] | queens):
+            return True
 
-    def handle_click(self, mouse_x, mouse_y):
-        col = mouse_x // self.square_size
-        row = mouse_y // self.square_size
+        return False
 
-        if 0 <= row < 8 and 0 <= col < 8:  # Ensure click is within bounds
-            clicked_piece = self.board[row][col]
+    def is_in_check(self, color):
+        color_index = COLOR_INDEX[color]
+        king_sq = self.king_squares[color_index]
+        if king_sq is None:
+            return False
 
-            # If a piece is clicked
-            if clicked_piece != " " and clicked_piece.color == self.turn:
-                self.selected_piece = clicked_piece
-                self.highlighted_moves = self.get_all_possible_moves(clicked_piece)
+        return self.is_square_attacked(king_sq, 1 - color_index)
 
-            # If clicking on an empty square or deselecting
-            elif self.selected_piece and cords_to_pos(row, col) in self.highlighted_moves:
-                self.move_piece(self.selected_piece.position, cords_to_pos(row, col))
-                self.selected_piece = None
-                self.highlighted_moves = []
+    def is_in_checkmate(self, color):
+        _log().debug("is_in_checkmate(%s)", color)
+        if self.tablebases is not None and color == self.turn:
+            result = self.tablebases.probe(self)
+            if result is not None:
+                return result.wdl < 0 and result.dtm == 0
+        if not self.is_in_check(color):
+            return False
 
-            else:
-                # Clear selection
-                self.selected_piece = None
-                self.highlighted_moves = []
+        return not self.has_legal_move(color)
 
-    def draw_piece(self, screen, piece, col, row):
-        # Scale the image with margin
-        image, margin = scale_image(piece.image, self.square_size, margin=10)
+    def is_stalemate(self):
+        return not self.is_in_check(self.turn) and not self.has_legal_move()
 
-        # Calculate the position to center the image within the square
-        x = col * self.square_size + (self.square_size - image.get_width()) // 2
-        y = row * self.square_size + (self.square_size - image.get_height()) // 2
+    def is_repetition(self, count=3):
+        """Check if the current position has occurred at least count times in the game."""
+        return self.position_counts.get(self.zobrist_key, 0) >= count
 
-        # Blit the image on the screen
-        screen.blit(image, (x, y))
+    def is_fifty_moves(self):
+        """Check if fifty moves by each side have passed without a capture or pawn move."""
+        return self.halfmove_clock >= 100
 
-    def is_in_check(self, color):
-        king_pos = self.find_king(color)
-        opponent_color = 'black' if color == 'white' else 'white'
+    def is_insufficient_material(self):
+        """Check if neither side can ever checkmate: bare kings plus one knight, or bishops all on one square color."""
+        bitboards = self.bitboards
+        if bitboards[PAWN] | bitboards[ROOK] | bitboards[QUEEN] | bitboards[6 + PAWN] | bitboards[6 + ROOK] | bitboards[6 + QUEEN]:
+            return False
 
-        for row in self.board:
-            for piece in row:
-                if piece != ' ' and piece.color == opponent_color:
-                    if piece.is_valid_move(piece.position, king_pos, self.board, self):
-                        return True
+        knights = bitboards[KNIGHT] | bitboards[6 + KNIGHT]
+        bishops = bitboards[BISHOP] | bitboards[6 + BISHOP]
+        if not bishops:
+            return knights & (knights - 1) == 0  # At most one knight
+        if knights:
+            return False
 
-        return False
+        return not bishops & LIGHT_SQUARES or not bishops & DARK_SQUARES
 
-    def is_in_checkmate(self, color):
-        print('checkmate fun is running')
-        if not self.is_in_check(color):
-            return False
+    def game_status(self):
+        """Whether and how the game has ended, as a GameStatus of one of the states above and the PGN result."""
+        if self.is_insufficient_material():
+            return GameStatus(INSUFFICIENT_MATERIAL, '1/2-1/2')
+        if self.is_repetition():
+            return GameStatus(REPETITION, '1/2-1/2')
 
-        for row in self.board:
-            for piece in row:
-                if piece != ' ' and piece.color == color:
-                    possible_moves = self.get_all_possible_moves(piece)
-                    for move in possible_moves:
-                        # Simulate move
-                        start_pos = piece.position
-                        end_pos = move
-                        start_row, start_col = pos_to_cords(start_pos)
-                        end_row, end_col = pos_to_cords(end_pos)
-                        captured_piece = self.board[end_row][end_col]
-
-                        self.board[end_row][end_col] = piece
-                        self.board[start_row][start_col] = ' '
-                        piece.position = end_pos
-
-                        if not self.is_in_check(color):
-                            # Revert move
-                            self.board[start_row][start_col] = piece
-                            self.board[end_row][end_col] = captured_piece
-                            piece.position = start_pos
-                            return False
-
-                        # Revert move
-                        self.board[start_row][start_col] = piece
-                        self.board[end_row][end_col] = captured_piece
-                        piece.position = start_pos
-        return True # No valid moves were found, It's checkmate
+        # Checkmate takes precedence over the fifty-move rule
+        if not self.has_legal_move():
+            if self.is_in_check(self.turn):
+                return GameStatus(CHECKMATE, '0-1' if self.turn == 'white' else '1-0')
+            return GameStatus(STALEMATE, '1/2-1/2')
+        if self.is_fifty_moves():
+            return GameStatus(FIFTY_MOVES, '1/2-1/2')
+
+        return GameStatus(ONGOING, '*')
+
+    def is_game_over(self):
+        return self.game_status().status != ONGOING
 
     def get_all_possible_moves(self, piece):
-        possible_moves = []
-        for row in range(8):
-            for col in range(8):
-                end_pos = cords_to_pos(row, col)
-                if piece.is_valid_move(piece.position, end_pos, self.board, self):
-                    possible_moves.append(end_pos)
-        print(piece, possible_moves)
-        return possible_moves
+        return piece.get_possible_moves(self.board, self)
+
+    def generate_moves(self, color=None, captures_only=False):
+        """Every move for the color (side to move by default), ignoring whether it leaves its king in check.
+
+        With captures_only, only captures (en passant included) and pawn promotions are generated.
+        """
+        color_index = COLOR_INDEX[color or self.turn]
+        board = self.board
+        moves = []
+
+        mask = pawn_mask = FULL
+        if captures_only:
+            mask = self.occupancy[1 - color_index]
+            pawn_mask = mask | PROMOTION_RANKS
+            if self.en_passant_target is not None:
+                pawn_mask |= 1 << SQUARE_INDEX[self.en_passant_target]
+
+        for index in range(color_index * 6, color_index * 6 + 6):
+            for sq in iter_bits(self.bitboards[index]):
+                piece = board[sq >> 3][sq & 7]
+                if index == color_index * 6 + PAWN:
+                    targets = piece.targets(self) & pawn_mask
+                    if targets & PROMOTION_RANKS:
+                        for end in iter_bits(targets):
+                            if PROMOTION_RANKS >> end & 1:
+                                moves.extend(Move(sq, end, promotion) for promotion in 'QRBN')
+                            else:
+                                moves.append(Move(sq, end))
+                        continue
+                else:
+                    targets = piece.targets(self) & mask
+                moves.extend(Move(sq, end) for end in iter_bits(targets))
+
+        return moves
+
+    def is_legal(self, move):
+        """Check that a generated move does not leave the mover's king in check."""
+        piece = self.board[move.start >> 3][move.start & 7]
+        self.make_move(move)
+        king_sq = self.king_squares[piece.color_index]
+        legal = king_sq is None or not self.is_square_attacked(king_sq, 1 - piece.color_index)
+        self.unmake_move()
+
+        return legal
+
+    def generate_legal_moves(self, color=None):
+        return [move for move in self.generate_moves(color) if self.is_legal(move)]
+
+    def has_legal_move(self, color=None):
+        for move in self.generate_moves(color):
+            if self.is_legal(move):
+                return True
+
+        return False
+
+    def move_history(self):
+        """The moves played since start_fen, oldest first."""
+        return [record[0] for record in self._undo_stack]
 
     def find_king(self, color):
-        for row in self.board:
-            for piece in row:
-                if piece != ' ' and isinstance(piece, King) and piece.color == color:
-                    return piece.position
+        king_sq = self.king_squares[COLOR_INDEX[color]]
+        if king_sq is None:
+            return None
+
+        return SQUARE_NAMES[king_sq]
+
+    def make_move(self, move):
+        """Play a move produced by generate_moves, recording how to take it back on the undo stack.
+
+        The move is not validated; check it with is_legal first if it may leave the king in check.
+        """
+        start, end, promotion = move
+        piece = self.board[start >> 3][start & 7]
+        record = (move, piece, self.castling_rights, self.en_passant_target, self.halfmove_clock,
+                  piece.has_moved, self._attack_maps, self._king_danger_maps, self.zobrist_key)
+        # Take the old castling and en passant state out of the hash before it changes
+        state_key = CASTLING_KEYS[self.castling_rights] ^ en_passant_key(self)
+
+        # En passant captures the pawn beside the start square, not on the target square
+        capture_sq = end
+        if piece.piece_type == PAWN and self.board[end >> 3][end & 7] == ' ' and (end - start) & 7:
+            capture_sq = (start & ~7) | (end & 7)
+        captured = self._remove_piece(capture_sq)
+
+        self._remove_piece(start)
+        if promotion:
+            promoted_piece = PROMOTION_PIECES[promotion](piece.color, SQUARE_NAMES[end])
+            promoted_piece.has_moved = True
+            self._put_piece(promoted_piece, end)
+        else:
+            self._put_piece(piece, end)
+        piece.has_moved = True
+
+        # Castling also moves the rook next to the king
+        if piece.piece_type == KING and abs(end - start) == 2:
+            rook_start, rook_end = (start + 3, start + 1) if end > start else (start - 4, start - 1)
+            rook = self._remove_piece(rook_start)
+            self._put_piece(rook, rook_end)
+            rook.has_moved = True
+
+        self._undo_stack.append(record + (captured, capture_sq))
 
-        return None
+        self.castling_rights &= CASTLING_MASK[start] & CASTLING_MASK[end]
+        if piece.piece_type == PAWN and abs(end - start) == 16:
+            self.en_passant_target = SQUARE_NAMES[(start + end) >> 1]
+        else:
+            self.en_passant_target = None
+        if piece.piece_type == PAWN or captured != ' ':
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if self.turn == 'black':
+            self.fullmove_number += 1
+        self.switch_turn()
+        self.zobrist_key ^= state_key ^ CASTLING_KEYS[self.castling_rights] ^ en_passant_key(self) ^ SIDE_KEY
+        self.position_counts[self.zobrist_key] = self.position_counts.get(self.zobrist_key, 0) + 1
+
+    def unmake_move(self):
+        """Take back the last move made with make_move."""
+        (move, piece, castling_rights, en_passant_target, halfmove_clock, has_moved, attack_maps,
+         king_danger_maps, zobrist_key, captured, capture_sq) = self._undo_stack.pop()
+        start, end, promotion = move
+
+        count = self.position_counts[self.zobrist_key]
+        if count == 1:
+            del self.position_counts[self.zobrist_key]
+        else:
+            self.position_counts[self.zobrist_key] = count - 1
+
+        # Castling, put the rook back in the corner
+        if piece.piece_type == KING and abs(end - start) == 2:
+            rook_start, rook_end = (start + 3, start + 1) if end > start else (start - 4, start - 1)
+            rook = self._remove_piece(rook_end)
+            self._put_piece(rook, rook_start)
+            rook.has_moved = False
+
+        self._remove_piece(end)
+        self._put_piece(piece, start)
+        piece.has_moved = has_moved
+        if captured != ' ':
+            self._put_piece(captured, capture_sq)
+
+        self.switch_turn()
+        if self.turn == 'black':
+            self.fullmove_number -= 1
+        self.castling_rights = castling_rights
+        self.en_passant_target = en_passant_target
+        self.halfmove_clock = halfmove_clock
+        # The position is back to what it was, so are its attack maps
+        self._attack_maps = attack_maps
+        self._king_danger_maps = king_danger_maps
+        self.zobrist_key = zobrist_key
+
+    def is_promotion_move(self, start, end):
+        """Check if moving the piece on start to end would promote a pawn."""
+        start_row, start_col = pos_to_cords(start)
+        end_row, _ = pos_to_cords(end)
+        piece = self.board[start_row][start_col]
 
-    def move_piece(self, start, end):
+        return isinstance(piece, Pawn) and piece.is_promotion_square(end_row)
 
-        """Move a piece from start to end if the move is valid."""
+    def move_piece(self, start, end, promotion='Q', detect_game_over=True):
+        """Move a piece from start to end if the move is valid.
+
+        promotion is the piece letter ('Q', 'R', 'B' or 'N') a pawn reaching the last rank turns into.
+        Pass detect_game_over=False to leave the checkmate and draw tests (and game_over) to the caller.
+        Returns True if the move was made.
+        """
         start_row, start_col = pos_to_cords(start)
         end_row, end_col = pos_to_cords(end)
 
         piece = self.board[start_row][start_col]
 
         # Check if there's a piece at the start position and if the move is valid
-        if piece != " " and piece.color == self.turn and hasattr(piece, 'is_valid_move') and piece.is_valid_move(start, end, self.board, self):
-            # Handle castling - Put the Rook in place after castling
-            if isinstance(piece, King) and abs(start_col - end_col) == 2:  # Castling move
-                rook_start_col = 0 if end_col < start_col else 7
-                rook_end_col = 3 if end_col < start_col else 5  # New rook position after castling
-
-                rook = self.board[start_row][rook_start_col]
-                if not isinstance(rook, Rook):
-                    raise ValueError("Invalid rook position for castling.")
-
-                # Move the rook
-                self.board[start_row][rook_end_col] = rook
-                self.board[start_row][rook_start_col] = ' '
-                rook.position = cords_to_pos(start_row, rook_end_col)
-                rook.has_moved = True
-
-                # Mark the king as moved
-                piece.has_moved = True
-
-            # Handle en passant
-            if isinstance(piece, Pawn) and abs(start_row - end_row) == 2:
-                # Set en passant target if pawn moves two squares
-                self.en_passant_target = cords_to_pos((start_row + end_row) // 2, start_col)
-
-            # En passant capture handling
-            if isinstance(piece, Pawn) and end == self.en_passant_target:
-                capture_row, capture_col = start_row, end_col
-                captured_piece = self.board[capture_row][capture_col]
-                self.board[capture_row][capture_col] = ' '  # Remove the captured pawn
-            else:
-                captured_piece = self.board[end_row][end_col]
-
-            # Move piece
-            self.board[end_row][end_col] = piece
-            self.board[start_row][start_col] = ' '
-            piece.position = end
+        if piece != " " and piece.color == self.turn and piece.targets(self) >> (end_row * 8 + end_col) & 1:
+            if not self.is_promotion_move(start, end):
+                promotion = None
+            elif promotion not in PROMOTION_PIECES:
+                promotion = 'Q'  # Default to Queen
 
-            # Handle promotion
-            if isinstance(piece, Pawn) and piece.is_promotion_square(end_row):
-                self.promotion_popup = True
-                self.promotion_position = (end_row, end_col)
-                self.promotion_piece = piece
+            self.make_move(Move(start_row * 8 + start_col, end_row * 8 + end_col, promotion))
 
             # Check if king is in check after the move
-            if self.is_in_check(self.turn):
-                # Revert move
-                self.board[start_row][start_col] = piece
-                self.board[end_row][end_col] = captured_piece
-                piece.position = start
+            if self.is_in_check(piece.color):
+                self.unmake_move()
 
-                # Set check state and start time
+                # Set check state
                 self.king_in_check = True
                 self.king_in_check_position = self.find_king(self.turn)
-                self.check_start_time = pygame.time.get_ticks()
 
-                print("Invalid move: your King would be in check.")
-            # Check for checkmate after the opponent's move
-            else:
-                move_sound = pygame.mixer.Sound(
-                    './assets/sound_effects/move-self.mp3')  # Replace with your sound file path
-
-                piece.has_moved = True
-                piece.position = end
-
-                # Set check state and start time
-                self.king_in_check = False
-                self.king_in_check_position = None
-                self.check_start_time = None
-
-                opponent_color = 'black' if self.turn == 'white' else 'white'
-                if self.is_in_checkmate(opponent_color):
-                    print(f"Checkmate! {self.turn.capitalize()} wins!")
-
-                    self.game_over = True
-                    self.popup_message = f"Checkmate! {self.turn.capitalize()} wins!"
-                    self.draw_popup = True  # Use draw_popup to display the end-game popup
-                    self.resign_popup = True
-                move_sound.play()
-                self.switch_turn()
-        else:
-            print("Invalid move: either it's not your turn or the move is invalid.")
-
-
-    def promote_pawn_to(self, piece_type):
-        """Finalize the pawn promotion based on the player's choice."""
-        row, col = self.promotion_position
-        color = self.promotion_piece.color
-        position = self.promotion_piece.position
-
-        # Create the new piece
-        if piece_type == "Q":
-            self.board[row][col] = Queen(color, position)
-        elif piece_type == "R":
-            self.board[row][col] = Rook(color, position)
-        elif piece_type == "B":
-            self.board[row][col] = Bishop(color, position)
-        elif piece_type == "N":
-            self.board[row][col] = Knight(color, position)
-        else:
-            self.board[row][col] = Queen(color, position)  # Default to Queen
+                _log().info("Invalid move: your King would be in check.")
+                return False
 
-        # Reset promotion state
-        self.promotion_popup = False
-        self.promotion_position = None
-        self.promotion_piece = None
+            # Clear check state
+            self.king_in_check = False
+            self.king_in_check_position = None
 
+            # Check for checkmate or a draw after the opponent's move
+            status = self.game_status() if detect_game_over else None
+            if status is None or status.status == ONGOING:
+                return True
+
+            if status.status == CHECKMATE:
+                self.result_message = f"Checkmate! {piece.color.capitalize()} wins!"
+            else:
+                self.result_message = f"Draw by {status.status}!"
+            _log().info(self.result_message)
+            self.game_over = True
+            return True
+
+        _log().info("Invalid move: either it's not your turn or the move is invalid.")
+        return False
 
     def switch_turn(self):
         # Toggle turn between white and black
         self.turn = "black" if self.turn == "white" else "white"
-
-
-
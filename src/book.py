@@ -0,0 +1,183 @@
+"""Opening book lookup in the Polyglot .bin format.
+
+A Polyglot book is a sorted array of 16-byte big-endian entries (position key, move, weight,
+learn data). OpeningBook memory-maps the file instead of reading it, so opening even a large
+book is instant, only the pages a lookup touches are read, and every process using the same
+book on a machine shares one copy through the page cache. Lookups binary search the keys.
+
+    python book.py performance.bin
+    python book.py performance.bin --moves e2e4 e7e5 --pick
+"""
+
+import argparse
+import mmap
+import random
+import struct
+import sys
+from collections import namedtuple
+
+from board import Board, Move, CASTLING_LETTERS
+from bitboard import *
+from polyglot_random import POLYGLOT_RANDOM
+
+ENTRY = struct.Struct('>QHHI')  # key, move, weight, learn
+KEY = struct.Struct('>Q')
+
+PROMOTION_CODES = (None, 'N', 'B', 'R', 'Q')  # Bits 12-14 of a book move
+
+# King moves as books store castling, king takes own rook -> our king move two squares
+CASTLING_MOVES = {(60, 63): 62, (60, 56): 58, (4, 7): 6, (4, 0): 2}
+
+BookEntry = namedtuple('BookEntry', ('move', 'weight', 'learn'))
+
+
+def polyglot_key(board):
+    """The position's key as Polyglot books index it. Not the same as board.zobrist_key, which uses our own numbers."""
+    key = 0
+    for index, bb in enumerate(board.bitboards):
+        # Polyglot counts black pawn, white pawn, black knight, ... and squares from a1
+        offset = 64 * (2 * (index % 6) + (index < 6))
+        for sq in iter_bits(bb):
+            key ^= POLYGLOT_RANDOM[offset + (sq ^ 56)]
+
+    for i, (_, right) in enumerate(CASTLING_LETTERS):
+        if board.castling_rights & right:
+            key ^= POLYGLOT_RANDOM[768 + i]
+
+    # Like our own keys, en passant only counts when a pawn of the side to move is there to capture
+    if board.en_passant_target is not None:
+        sq = SQUARE_INDEX[board.en_passant_target]
+        color_index = COLOR_INDEX[board.turn]
+        if PAWN_ATTACKS[1 - color_index][sq] & board.bitboards[color_index * 6 + PAWN]:
+            key ^= POLYGLOT_RANDOM[772 + (sq & 7)]
+
+    if board.turn == 'white':
+        key ^= POLYGLOT_RANDOM[780]
+
+    return key
+
+
+def decode_move(board, raw):
+    """Turn a book move into a Move for the position, or None if it can't be one."""
+    # Rows count from rank 1 in books and from rank 8 on our board
+    start = (7 - (raw >> 9 & 7)) * 8 + (raw >> 6 & 7)
+    end = (7 - (raw >> 3 & 7)) * 8 + (raw & 7)
+    code = raw >> 12 & 7
+    if code >= len(PROMOTION_CODES):
+        return None
+    promotion = PROMOTION_CODES[code]
+
+    piece = board.board[start >> 3][start & 7]
+    if piece != ' ' and piece.piece_type == KING and (start, end) in CASTLING_MOVES:
+        target = board.board[end >> 3][end & 7]
+        if target != ' ' and target.piece_type == ROOK and target.color == piece.color:
+            end = CASTLING_MOVES[start, end]
+
+    return Move(start, end, promotion)
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            # mmap refuses empty files, and an empty book has nothing to map anyway
+            if file.seek(0, 2) == 0:
+                self._data = b''
+            else:
+                self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._data) % ENTRY.size:
+            self.close()
+            raise ValueError(f"{path} is not a Polyglot book: its size is not a multiple of {ENTRY.size} bytes")
+
+    def __len__(self):
+        return len(self._data) // ENTRY.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = b''
+
+    def _first_index(self, key):
+        """Index of the first entry with a key not less than key."""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) >> 1
+            if KEY.unpack_from(self._data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def entries(self, board):
+        """The book's BookEntry for every legal move it has for the position, in the book's order."""
+        key = polyglot_key(board)
+        found = []
+        legal = None
+        for index in range(self._first_index(key), len(self)):
+            entry_key, raw, weight, learn = ENTRY.unpack_from(self._data, index * ENTRY.size)
+            if entry_key != key:
+                break
+            if legal is None:
+                legal = set(board.generate_legal_moves())
+            # A bad book or a key collision can hold moves that aren't legal here
+            move = decode_move(board, raw)
+            if move in legal:
+                found.append(BookEntry(move, weight, learn))
+
+        return found
+
+    def moves(self, board):
+        """The book moves for the position."""
+        return [entry.move for entry in self.entries(board)]
+
+    def choose(self, board, rng=random):
+        """A book move picked at random in proportion to the weights, or None when the position isn't in the book."""
+        entries = self.entries(board)
+        if not entries:
+            return None
+        weights = [entry.weight for entry in entries]
+        if not any(weights):
+            weights = None  # All zero, pick any of them
+
+        return rng.choices(entries, weights)[0].move
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Look up a position in a Polyglot opening book.")
+    parser.add_argument('path', help="Polyglot .bin book")
+    parser.add_argument('--fen', help="position to look up (default: the starting position)")
+    parser.add_argument('--moves', nargs='*', default=[], help="UCI moves to play from the position first")
+    parser.add_argument('--pick', action='store_true', help="also pick a move the way an automated player would")
+    args = parser.parse_args(argv)
+
+    board = Board(args.fen)
+    for text in args.moves:
+        move = Move.from_uci(text)
+        if move not in board.generate_legal_moves():
+            print(f"Illegal move {text!r}")
+            return 2
+        board.make_move(move)
+
+    with OpeningBook(args.path) as book:
+        entries = book.entries(board)
+        total = sum(entry.weight for entry in entries)
+        print(f"{len(book)} entries in book, {len(entries)} for {board.to_fen()}")
+        for entry in entries:
+            share = entry.weight / total if total else 0.0
+            print(f"  {entry.move.uci():<6} weight {entry.weight:>6} {share:6.1%}")
+        if args.pick:
+            move = book.choose(board)
+            print(f"picked {move.uci() if move else 'nothing'}")
+
+    return 0 if entries else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
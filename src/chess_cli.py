@@ -1,101 +1,209 @@
-import pygame
-
-from board import Board, scale_image
-
-
-def main():
-    pygame.init()
-    pygame.mixer.init()
-
-    screen = pygame.display.set_mode((800, 900))
-
-    pygame.display.set_caption('Chess Game')
-
-    board = Board()
-
-    # Fonts
-    font = pygame.font.Font(None, 36)  # Font for text
-    button_font = pygame.font.Font(None, 28)  # Font for buttons
+import time
 
+_IMPORT_START = time.perf_counter()  # The imports below are timed for --profile-startup
 
-    while board.running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                board.running = False
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                mouse_x, mouse_y = event.pos
+import argparse
+import logging
+import sys
+from functools import partial
 
-                if board.draw_popup or board.resign_popup:
-                    if board.game_over:
-                        # Handle popup buttons
-                        if 270 <= mouse_x <= 390 and 400 <= mouse_y <= 440:  # Accept button
-                            print("Restarting...!")
-                            board = Board()
-                            board.game_over = False
-                            board.draw_popup = False
-                            board.resign_popup = False
-                            board.popup_message = ''
-                        elif 410 <= mouse_x <= 530 and 400 <= mouse_y <= 440:  # Reject button
-                            print("Exiting game!")
-                            board.running = False
-                    else:
-                        # Handle draw popup buttons
-                        if board.draw_popup:
-                            if 290 <= mouse_x <= 390 and 400 <= mouse_y <= 440:  # Accept button
-                                print("Draw accepted!")
-                                board.game_over = True
-                                board.popup_message = "Game Over: Draw"
-                            elif 410 <= mouse_x <= 510 and 400 <= mouse_y <= 440:  # Reject button
-                                print("Draw rejected!")
-                                board.draw_popup = False  # Close popup
-                        # Handle resign popup buttons
-                        if board.resign_popup:
-                            if 290 <= mouse_x <= 390 and 400 <= mouse_y <= 440:  # Confirm resign
-                                print(f"{board.turn.capitalize()} player resigned!")
-                                board.game_over = True  # Mark game as over
-                                board.popup_message = f"Game Over: {board.turn.capitalize()} Resigned"
-                            elif 410 <= mouse_x <= 510 and 400 <= mouse_y <= 440:  # Cancel resign
-                                print("Resign canceled!")
-                                board.resign_popup = False  # Close popup
+import pygame
 
-                else:
-                    # Handle main buttons
-                    if 650 <= mouse_x <= 780 and 815 <= mouse_y <= 845:  # Resign button
-                        print(f"{board.turn} player resigned!")
-                        board.popup_message = 'Confirm Resign'
-                        board.resign_popup = True  # Show resign popup
-                    elif 650 <= mouse_x <= 780 and 855 <= mouse_y <= 885:  # Draw button
-                        board.popup_message = 'Player has offered a draw'
-                        print("Draw offer made!")
-                        board.draw_popup = True  # Show draw popup
+_PYGAME_IMPORTED = time.perf_counter()
 
-                if board.promotion_popup:
+from analysis import AnalysisWorker, ANALYSIS_EVENT, engine_move_chooser
+from board import Board, Move, CHECKMATE, ONGOING
+from piece import cords_to_pos, SQUARE_NAMES
+from sprites import SpriteCache
+
+_MODULES_IMPORTED = time.perf_counter()
 
-                    if 170 <= mouse_x <= 270 and 185 <= mouse_y <= 285:
-                        board.promote_pawn_to('R')
 
-                    if 290 <= mouse_x <= 390 and 185 <= mouse_y <= 285:
-                        board.promote_pawn_to('N')
+logger = logging.getLogger(__name__)
+
+FPS = 60
+BLINK_MS = 500  # How long the king flashes red after a move into check
+
+
+def ticks():
+    """Milliseconds on a monotonic clock. pygame.time.get_ticks only counts after the full pygame.init, which we skip."""
+    return int(time.monotonic() * 1000)
+
+
+class SoundEffect:
+    """A sound loaded on first use and played on its own reserved mixer channel.
+
+    The mixer is only started when the first sound plays, so startup doesn't wait for the audio device.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._sound = None
+        self._channel = None
+
+    def play(self):
+        if self._sound is None:
+            try:
+                if not pygame.mixer.get_init():
+                    pygame.mixer.init()
+                self._sound = pygame.mixer.Sound(self.path)
+                pygame.mixer.set_reserved(1)
+                self._channel = pygame.mixer.Channel(0)
+            except pygame.error as error:
+                logger.warning("Sound disabled: %s", error)
+                self._sound = False  # Don't try again on every move
+        if self._sound:
+            # Restarts the sound if the previous move's is still playing
+            self._channel.play(self._sound)
+
+
+class StartupProfile:
+    """How long each step of starting the GUI took, printed with --profile-startup."""
+
+    def __init__(self):
+        self.steps = [('import pygame', _PYGAME_IMPORTED - _IMPORT_START),
+                      ('import rules and UI modules', _MODULES_IMPORTED - _PYGAME_IMPORTED)]
+        self._last = _MODULES_IMPORTED
+
+    def mark(self, step):
+        """Record the time since the previous mark as the given step."""
+        now = time.perf_counter()
+        self.steps.append((step, now - self._last))
+        self._last = now
+
+    def report(self, out=sys.stdout):
+        total = sum(seconds for _, seconds in self.steps)
+        print("Startup profile:", file=out)
+        for step, seconds in self.steps:
+            print(f"  {step:<30} {seconds * 1000:8.1f} ms {seconds / total:6.1%}", file=out)
+        print(f"  {'total':<30} {total * 1000:8.1f} ms", file=out)
+
+
+class BoardView:
+    """Pygame renderer and input state on top of a headless Board."""
+
+    def __init__(self, board, sprites, worker=None, move_sound=None):
+        self.board = board
+        self.sprites = sprites
+        self.move_sound = move_sound  # SoundEffect played after every move
+        self.worker = worker  # AnalysisWorker, or None to work everything out on the UI thread
+        self.square_size = 100
+        self.colors = [(240, 217, 181), (181, 136, 99)]
+        self.selected_piece = None
+        self.highlighted_moves = []
+
+        # For blinking animation when king is checked
+        self.check_start_time = None
+
+        # Popup state for checkmate popup
+        self.running = True
+        self.draw_popup = False
+        self.resign_popup = False
+        self.checkmate_popup = False
+        self.popup_message = ""
+        self.game_over = False
+
+        # Popup state for promoting, holds the (start, end) of the pawn move waiting for a piece choice
+        self.promotion_popup = False
+        self.promotion_move = None
+
+        # What is on screen, so render only repaints what changed
+        self._drawn_squares = [None] * 64
+        self._drawn_status = None
+        self._drawn_popups = None
+
+        # Latest results from the worker: legal targets per square name (None until they arrive)
+        self.legal_targets = None
+        self.book_hints = []  # (uci, weight) of the opening book's moves for the position
+        self.analysis_generation = None
+        self.request_analysis()
+
+    def blinking_position(self):
+        """Square of the king flashing red after a move that would leave it in check, None once the blink is over."""
+        if not self.board.king_in_check:
+            return None
+
+        if ticks() - self.check_start_time >= BLINK_MS:
+            # Stop blinking after 500ms
+            self.board.king_in_check = False
+            self.board.king_in_check_position = None
+            return None
+
+        return self.board.king_in_check_position
+
+    def is_animating(self):
+        """Whether the next frames differ without any input, so the loop can't sleep until the next event."""
+        return self.board.king_in_check
+
+    def square_state(self, row, col, blinking):
+        """Everything a square's appearance depends on; the square needs repainting when this changes."""
+        pos = cords_to_pos(row, col)
+        piece = self.board.board[row][col]
+        return piece if piece == ' ' else (piece.color, piece.symbol), pos in self.highlighted_moves, pos == blinking
+
+    def draw_board(self, screen, squares=None):
+        """Draw the given (row, col) squares, or all of them, and return their rectangles."""
+        blinking = self.blinking_position()
+        if squares is None:
+            squares = [(row, col) for row in range(8) for col in range(8)]
+
+        rects = []
+        for row, col in squares:
+            pos = cords_to_pos(row, col)
+
+            # Alter square colors
+            color = self.colors[(row + col) % 2]
+
+            # Blinking animation
+            if pos == blinking:
+                color = (255, 0, 0)  # Red
+
+            rect = pygame.draw.rect(
+                screen,
+                color,
+                (col * self.square_size, row * self.square_size, self.square_size, self.square_size)
+            )
+
+            # Highlight moves
+            if pos in self.highlighted_moves:
+                pygame.draw.rect(
+                    screen,
+                    (255, 255, 0),  # Yellow border
+                    (col * self.square_size, row * self.square_size, self.square_size, self.square_size),
+                    5  # Border thickness
+                )
 
-                    if 410 <= mouse_x <= 510 and 185 <= mouse_y <= 285:
-                        board.promote_pawn_to('B')
+            piece = self.board.board[row][col]
+            if piece != " ":
+                self.draw_piece(screen, piece, col, row)
+            rects.append(rect)
 
-                    if 530 <= mouse_x <= 630 and 185 <= mouse_y <= 285:
-                        board.promote_pawn_to('Q')
+        return rects
 
-                if mouse_y <= 800 and not board.draw_popup or not board.resign_popup or not board.promotion_popup or not board.checkmate_popup:  # Ensure the click is on the board, not the UI
-                    board.handle_click(mouse_x, mouse_y)
+    def draw_piece(self, screen, piece, col, row):
+        image = self.sprites.get(piece.color, piece.symbol, self.square_size)
 
-                # if board.promotion_popup:
+        # Calculate the position to center the image within the square
+        x = col * self.square_size + (self.square_size - image.get_width()) // 2
+        y = row * self.square_size + (self.square_size - image.get_height()) // 2
 
+        # Blit the image on the screen
+        screen.blit(image, (x, y))
 
-        screen.fill((0, 0, 0))
-        board.draw_board(screen)
+    def draw_status(self, screen, font, button_font):
+        """Draw the bar below the board and return its rectangle."""
+        rect = pygame.draw.rect(screen, (0, 0, 0), (0, 800, 800, 100))
 
         # Draw current player's turn
-        turn_text = font.render(f"Turn: {board.turn.capitalize()}", True, (255, 255, 255))
+        turn_text = font.render(f"Turn: {self.board.turn.capitalize()}", True, (255, 255, 255))
         screen.blit(turn_text, (30, 832))  # Position just below the board
 
+        if self.book_hints:
+            total = sum(weight for _, weight in self.book_hints) or 1
+            hints = '  '.join(f"{uci} {weight / total:.0%}" for uci, weight in self.book_hints[:4])
+            book_text = button_font.render(f"Book: {hints}", True, (200, 200, 200))
+            screen.blit(book_text, (30, 865))
+
         # Draw buttons
         pygame.draw.rect(screen, (200, 0, 0), (650, 815, 130, 30))  # Resign button
         pygame.draw.rect(screen, (0, 200, 0), (650, 855, 130, 30))  # Draw button
@@ -106,16 +214,22 @@ def main():
         screen.blit(resign_text, (660, 820))
         screen.blit(draw_text, (660, 860))
 
+        return rect
+
+    def draw_popups(self, screen, button_font):
+        """Draw whichever popups are open and return their rectangles."""
+        rects = []
+
         # Draw popup if draw is offered
-        if board.draw_popup or board.resign_popup or board.checkmate_popup:
-            pygame.draw.rect(screen, (50, 50, 50), (200, 300, 400, 200))  # Popup background
+        if self.draw_popup or self.resign_popup or self.checkmate_popup:
+            rects.append(pygame.draw.rect(screen, (50, 50, 50), (200, 300, 400, 200)))  # Popup background
             pygame.draw.rect(screen, (255, 255, 255), (200, 300, 400, 200), 2)  # Popup border
 
-            popup_text = button_font.render(board.popup_message, True, (255, 255, 255))
+            popup_text = button_font.render(self.popup_message, True, (255, 255, 255))
             text_width = popup_text.get_width()
             screen.blit(popup_text, ((800-text_width)/2, 330))
 
-            if board.game_over:
+            if self.game_over:
                 # Draw "Play Again" button
                 pygame.draw.rect(screen, (0, 200, 0), (270, 400, 120, 40))
                 play_again_text = button_font.render("Play Again", True, (255, 255, 255))
@@ -136,8 +250,8 @@ def main():
                 reject_text = button_font.render("Reject", True, (255, 255, 255))
                 screen.blit(reject_text, (425, 410))
 
-        if board.promotion_popup:
-            pygame.draw.rect(screen, (0, 200, 0), (150, 150, 500, 160))
+        if self.promotion_popup:
+            rects.append(pygame.draw.rect(screen, (0, 200, 0), (150, 150, 500, 160)))
             pygame.draw.rect(screen, (255, 255, 255), (150, 150, 500, 160), 2)  # Popup border
 
             popup_text = button_font.render('Chose a piece to promote', True, (255, 255, 255))
@@ -145,43 +259,324 @@ def main():
             screen.blit(popup_text, ((800 - text_width) / 2, 160))
 
             x = 170
-            b_piece_images = [pygame.image.load('./assets/chess-pieces/b_rook_png_128px.png'),
-                            pygame.image.load('./assets/chess-pieces/b_knight_png_128px.png'),
-                            pygame.image.load('./assets/chess-pieces/b_bishop_png_128px.png'),
-                            pygame.image.load('./assets/chess-pieces/b_queen_png_128px.png')]
-
-            w_piece_images = [pygame.image.load('./assets/chess-pieces/w_rook_png_128px.png'),
-                              pygame.image.load('./assets/chess-pieces/w_knight_png_128px.png'),
-                              pygame.image.load('./assets/chess-pieces/w_bishop_png_128px.png'),
-                              pygame.image.load('./assets/chess-pieces/w_queen_png_128px.png')]
-
-            for i in range(4):
-                color = board.colors[i % 2]
+            for i, symbol in enumerate(('R', 'N', 'B', 'Q')):
+                color = self.colors[i % 2]
 
                 pygame.draw.rect(
                     screen,
                     color,
-                    (x, 185, board.square_size, board.square_size)
+                    (x, 185, self.square_size, self.square_size)
                 )
 
-                # Scale the image with margin | turn is inverted because it is already opponents move from move_piece()
-                image, margin = scale_image( w_piece_images[i] if board.turn == 'black' else b_piece_images[i], board.square_size, margin=10)
+                # The promoting side is still the one to move
+                image = self.sprites.get(self.board.turn, symbol, self.square_size)
 
                 # Calculate the position to center the image within the square
-                img_x = x + (board.square_size - image.get_width()) // 2
-                img_y = 185 + (board.square_size - image.get_height()) // 2
+                img_x = x + (self.square_size - image.get_width()) // 2
+                img_y = 185 + (self.square_size - image.get_height()) // 2
 
                 # Blit the image on the screen
                 screen.blit(image, (img_x, img_y))
 
                 x += 120
 
+        return rects
+
+    def render(self, screen, font, button_font, full=False):
+        """Repaint what changed since the last call, or everything if full, and return the rectangles to update."""
+        popup_state = (self.draw_popup, self.resign_popup, self.checkmate_popup, self.popup_message, self.game_over,
+                       self.promotion_popup, self.promotion_popup and self.board.turn)
+        if popup_state != self._drawn_popups:
+            # A popup opened, closed or changed, so the squares it covered or covers need repainting too
+            full = True
+            self._drawn_popups = popup_state
+        if full:
+            screen.fill((0, 0, 0))
+            self._drawn_squares = [None] * 64
+            self._drawn_status = None
+
+        blinking = self.blinking_position()
+        changed = []
+        for row in range(8):
+            for col in range(8):
+                state = self.square_state(row, col, blinking)
+                if state != self._drawn_squares[row * 8 + col]:
+                    self._drawn_squares[row * 8 + col] = state
+                    changed.append((row, col))
+        rects = self.draw_board(screen, changed) if changed else []
+
+        status = (self.board.turn, self.book_hints)
+        if status != self._drawn_status:
+            self._drawn_status = status
+            rects.append(self.draw_status(screen, font, button_font))
+
+        # Popups sit on top of the board, so anything repainted beneath them hides them again
+        if rects:
+            rects.extend(self.draw_popups(screen, button_font))
+
+        return [screen.get_rect()] if full else rects
+
+    def handle_click(self, mouse_x, mouse_y):
+        if self.promotion_popup:
+            return  # Wait for the promotion choice
+
+        col = mouse_x // self.square_size
+        row = mouse_y // self.square_size
+
+        if 0 <= row < 8 and 0 <= col < 8:  # Ensure click is within bounds
+            clicked_piece = self.board.board[row][col]
+
+            if self.worker is not None and self.board.turn in self.worker.chooser_colors:
+                return  # The move chooser plays this side
+
+            # If a piece is clicked
+            if clicked_piece != " " and clicked_piece.color == self.board.turn:
+                self.selected_piece = clicked_piece
+                if self.legal_targets is not None:
+                    self.highlighted_moves = self.legal_targets.get(clicked_piece.position, [])
+                else:
+                    # The worker hasn't answered yet
+                    self.highlighted_moves = self.board.get_all_possible_moves(clicked_piece)
+
+            # If clicking on an empty square or deselecting
+            elif self.selected_piece and cords_to_pos(row, col) in self.highlighted_moves:
+                start, end = self.selected_piece.position, cords_to_pos(row, col)
+                if self.board.is_promotion_move(start, end):
+                    # Ask which piece to promote to before making the move
+                    self.promotion_popup = True
+                    self.promotion_move = (start, end)
+                else:
+                    self.move_piece(start, end)
+                self.selected_piece = None
+                self.highlighted_moves = []
+
+            else:
+                # Clear selection
+                self.selected_piece = None
+                self.highlighted_moves = []
+
+    def move_piece(self, start, end, promotion='Q'):
+        # With a worker the checkmate test runs in the background, see handle_analysis
+        if self.board.move_piece(start, end, promotion, detect_game_over=self.worker is None):
+            self.request_analysis()
+            if self.move_sound is not None:
+                self.move_sound.play()
+
+            self.check_start_time = None
+            if self.board.game_over:
+                self.game_over = True
+                self.popup_message = self.board.result_message
+                self.draw_popup = True  # Use draw_popup to display the end-game popup
+                self.resign_popup = True
+        elif self.board.king_in_check:
+            # Start blinking the king that would be left in check
+            self.check_start_time = ticks()
+
+    def request_analysis(self):
+        """Hand the current position to the worker, dropping the results for the previous one."""
+        self.legal_targets = None
+        self.book_hints = []
+        if self.worker is not None:
+            self.analysis_generation = self.worker.submit(self.board)
+
+    def handle_analysis(self, event):
+        """Apply an ANALYSIS_EVENT posted by the worker."""
+        if event.generation != self.analysis_generation or self.game_over:
+            return  # Computed for a position that is no longer on the board
+
+        if event.kind == 'move':
+            if event.move is not None and not self.promotion_popup:
+                move = Move.from_uci(event.move)
+                self.move_piece(SQUARE_NAMES[move.start], SQUARE_NAMES[move.end], move.promotion)
+            return
+
+        self.legal_targets = event.targets
+        self.book_hints = event.book
+        if event.status == CHECKMATE:
+            winner = 'White' if self.board.turn == 'black' else 'Black'
+            self.board.game_over = True
+            self.board.result_message = f"Checkmate! {winner} wins!"
+        elif event.status not in (ONGOING, 'check'):
+            self.board.game_over = True
+            self.board.result_message = f"Draw by {event.status}!"
+        if self.board.game_over:
+            self.game_over = True
+            self.popup_message = self.board.result_message
+            self.draw_popup = True  # Use draw_popup to display the end-game popup
+            self.resign_popup = True
+
+    def promote_pawn_to(self, piece_type):
+        """Finalize the pawn promotion based on the player's choice."""
+        start, end = self.promotion_move
+
+        # Reset promotion state
+        self.promotion_popup = False
+        self.promotion_move = None
+
+        self.move_piece(start, end, piece_type)
+
+
+def wait_for_events(animating):
+    """The pending events, sleeping until one arrives unless an animation needs the next frame."""
+    if animating:
+        return pygame.event.get()
+
+    return [pygame.event.wait()] + pygame.event.get()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play chess against another person on this computer.")
+    parser.add_argument('--full-redraw', action='store_true', help="repaint the whole window every frame")
+    parser.add_argument('--engine', choices=('white', 'black'), help="let the engine play this side")
+    parser.add_argument('--engine-time', type=float, default=1.0, help="engine thinking time per move in seconds")
+    parser.add_argument('--book', help="Polyglot opening book (.bin) for move hints and the engine's opening moves")
+    parser.add_argument('--profile-startup', action='store_true', help="print how long each startup step took")
+    parser.add_argument('--log-level', default='info', choices=('debug', 'info', 'warning', 'error'),
+                        help="how much to log to the console")
+    parser.add_argument('--stats', metavar='PATH',
+                        help="count calls and time of the rules functions and every move, written to PATH as JSON")
+    parser.add_argument('--stats-interval', type=float, default=10.0, help="seconds between --stats writes")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format='%(message)s')
+    full_redraw = args.full_redraw
+    profile = StartupProfile() if args.profile_startup else None
+    if profile:
+        profile.mark('parse arguments')
+
+    # Only what the first frame needs; the mixer starts with the first move sound
+    pygame.display.init()
+    pygame.font.init()
+
+    screen = pygame.display.set_mode((800, 900))
 
-        # Update the game
-        pygame.display.flip()
+    pygame.display.set_caption('Chess Game')
+
+    # Fonts
+    font = pygame.font.Font(None, 36)  # Font for text
+    button_font = pygame.font.Font(None, 28)  # Font for buttons
+    if profile:
+        profile.mark('open window, load fonts')
+
+    dumper = None
+    if args.stats:
+        import instrumentation
+
+        dumper = instrumentation.StatsDumper(instrumentation.enable(), args.stats, args.stats_interval)
+
+    sprites = SpriteCache()
+    book = None
+    if args.book:
+        from book import OpeningBook  # Only imported when asked for, like the mixer
+
+        # Memory-mapped, so opening even a large book costs nothing; the engine process maps the same file
+        book = OpeningBook(args.book)
+    if args.engine:
+        chooser = partial(engine_move_chooser, time_limit=args.engine_time, book_path=args.book)
+        worker = AnalysisWorker(chooser, [args.engine], book)
+    else:
+        worker = AnalysisWorker(book=book)
+    move_sound = SoundEffect('./assets/sound_effects/move-self.mp3')
+    view = BoardView(Board(), sprites, worker, move_sound)
+    if profile:
+        profile.mark('set up board and worker')
+
+    sprites.preload(view.square_size)
+    if profile:
+        profile.mark('load sprites')
+
+    # Mouse motion changes nothing on screen, don't wake up for it
+    pygame.event.set_blocked(pygame.MOUSEMOTION)
+    clock = pygame.time.Clock()
+
+    exposed = True  # The window contents were lost, e.g. it was just opened or uncovered
+    while view.running:
+        rects = view.render(screen, font, button_font, full=full_redraw or exposed)
+        if full_redraw or exposed:
+            pygame.display.flip()
+        elif rects:
+            pygame.display.update(rects)
+        exposed = False
+        if profile:
+            profile.mark('draw first frame')
+            profile.report()
+            profile = None
+
+        # Cap the frame rate while something animates; otherwise the wait below sleeps until input
+        clock.tick(FPS)
+
+        for event in wait_for_events(view.is_animating()):
+            if event.type == pygame.QUIT:
+                view.running = False
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                exposed = True
+            elif event.type == ANALYSIS_EVENT:
+                view.handle_analysis(event)
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                mouse_x, mouse_y = event.pos
 
+                if view.draw_popup or view.resign_popup:
+                    if view.game_over:
+                        # Handle popup buttons
+                        if 270 <= mouse_x <= 390 and 400 <= mouse_y <= 440:  # Accept button
+                            logger.info("Restarting...!")
+                            view = BoardView(Board(), sprites, worker, move_sound)
+                        elif 410 <= mouse_x <= 530 and 400 <= mouse_y <= 440:  # Reject button
+                            logger.info("Exiting game!")
+                            view.running = False
+                    else:
+                        # Handle draw popup buttons
+                        if view.draw_popup:
+                            if 290 <= mouse_x <= 390 and 400 <= mouse_y <= 440:  # Accept button
+                                logger.info("Draw accepted!")
+                                view.game_over = True
+                                view.popup_message = "Game Over: Draw"
+                            elif 410 <= mouse_x <= 510 and 400 <= mouse_y <= 440:  # Reject button
+                                logger.info("Draw rejected!")
+                                view.draw_popup = False  # Close popup
+                        # Handle resign popup buttons
+                        if view.resign_popup:
+                            if 290 <= mouse_x <= 390 and 400 <= mouse_y <= 440:  # Confirm resign
+                                logger.info("%s player resigned!", view.board.turn.capitalize())
+                                view.game_over = True  # Mark game as over
+                                view.popup_message = f"Game Over: {view.board.turn.capitalize()} Resigned"
+                            elif 410 <= mouse_x <= 510 and 400 <= mouse_y <= 440:  # Cancel resign
+                                logger.info("Resign canceled!")
+                                view.resign_popup = False  # Close popup
+
+                else:
+                    # Handle main buttons
+                    if 650 <= mouse_x <= 780 and 815 <= mouse_y <= 845:  # Resign button
+                        logger.info("%s player resigned!", view.board.turn)
+                        view.popup_message = 'Confirm Resign'
+                        view.resign_popup = True  # Show resign popup
+                    elif 650 <= mouse_x <= 780 and 855 <= mouse_y <= 885:  # Draw button
+                        view.popup_message = 'Player has offered a draw'
+                        logger.info("Draw offer made!")
+                        view.draw_popup = True  # Show draw popup
+
+                if view.promotion_popup:
+
+                    if 170 <= mouse_x <= 270 and 185 <= mouse_y <= 285:
+                        view.promote_pawn_to('R')
+
+                    elif 290 <= mouse_x <= 390 and 185 <= mouse_y <= 285:
+                        view.promote_pawn_to('N')
+
+                    elif 410 <= mouse_x <= 510 and 185 <= mouse_y <= 285:
+                        view.promote_pawn_to('B')
+
+                    elif 530 <= mouse_x <= 630 and 185 <= mouse_y <= 285:
+                        view.promote_pawn_to('Q')
+
+                elif mouse_y <= 800 and not view.draw_popup or not view.resign_popup or not view.checkmate_popup:  # Ensure the click is on the board, not the UI
+                    view.handle_click(mouse_x, mouse_y)
+
+    worker.stop()
+    if dumper is not None:
+        dumper.stop()
+    if book is not None:
+        book.close()
     pygame.quit()
 
 if __name__ == "__main__":
     main()
-
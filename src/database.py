@@ -0,0 +1,376 @@
+"""Position database over game archives: which games reached a position, and which positions have
+some material and pattern, answered from indexes on disk without replaying any games.
+
+update() replays the games of a PGN file through Board once, in parallel over worker processes,
+and stores every position packed (positions.py) with two indexes: Zobrist key -> positions,
+sorted and binary searched through a memory map like an opening book, and material signature
+(e.g. "KRPPvKBPP") -> positions. Position numbers map back to (game, ply) through the first
+position of every game. Running update() again on a file that has grown only reads the new
+games, which are indexed as a new segment next to the existing ones.
+
+The directory holds:
+
+    index.json         games, positions, sources and segments indexed so far
+    positions.pos      every position, packed, in game order
+    games.bin          first position of every game (uint32)
+    seg-NNNN.keys      (key, position) pairs sorted by key
+    seg-NNNN.material  positions grouped by material signature (uint32), the groups listed in index.json
+
+    python database.py games.db --add games.pgn --workers 4
+    python database.py games.db --fen "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2"
+    python database.py games.db --material "KRP*vKBP*" --pattern opposed-pawns
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from collections import deque, namedtuple
+from fnmatch import fnmatchcase
+from itertools import islice
+
+from board import Board
+from bitboard import *
+from pgn import read_games, push_san
+from positions import PositionStore, encode, encode_placement, unpack_bitboards, PLACEMENT
+
+MANIFEST = 'index.json'
+POSITIONS = 'positions.pos'
+GAMES = 'games.bin'
+KEY_ENTRY = struct.Struct('<QI')  # Zobrist key, position
+KEY = struct.Struct('<Q')
+CHUNK = 100  # Games per worker task
+
+MATERIAL_ORDER = 'KQRBNP'
+PositionRef = namedtuple('PositionRef', ('game', 'ply', 'position'))  # ply 0 is the game's starting position
+
+FILES = [FILE_A << col for col in range(8)]
+
+
+def material_signature(bitboards):
+    """White's then black's pieces, strongest first, e.g. "KRPPvKBPP"."""
+    sides = []
+    for color_index in (WHITE, BLACK):
+        sides.append(''.join(symbol * bitboards[color_index * 6 + PIECE_TYPES.index(symbol)].bit_count()
+                             for symbol in MATERIAL_ORDER))
+    return 'v'.join(sides)
+
+
+def opposed_pawns(bitboards):
+    """A white and a black pawn on the same file."""
+    white, black = bitboards[PAWN], bitboards[6 + PAWN]
+    return any(white & file and black & file for file in FILES)
+
+
+def doubled_pawns(bitboards):
+    """Two pawns of one side on the same file."""
+    return any((bitboards[pawns] & file).bit_count() > 1 for pawns in (PAWN, 6 + PAWN) for file in FILES)
+
+
+def opposite_bishops(bitboards):
+    """One bishop each, on squares of different colors."""
+    white, black = bitboards[BISHOP], bitboards[6 + BISHOP]
+    if white.bit_count() != 1 or black.bit_count() != 1:
+        return False
+    return bool(white & LIGHT_SQUARES) != bool(black & LIGHT_SQUARES)
+
+
+PATTERNS = {'opposed-pawns': opposed_pawns, 'doubled-pawns': doubled_pawns, 'opposite-bishops': opposite_bishops}
+
+
+def _index_games(games):
+    """Replay games and return their packed positions, keys, material signatures and positions per game.
+
+    Runs in the worker processes. A game stops at its first bad move, like in pgn.py, or at the first
+    position that can't be packed (move counters too large).
+    """
+    records = []
+    keys = array('Q')
+    signatures = []
+    lengths = []
+    seen = {}  # One string object per signature, so each is pickled once
+    for game in games:
+        try:
+            board = Board(game.fen)
+        except ValueError:
+            lengths.append(0)
+            continue
+        plies = 0
+        while True:
+            try:
+                records.append(encode(board))
+            except ValueError:
+                plies -= 1  # The game ends with the position before
+                break
+            keys.append(board.zobrist_key)
+            signature = material_signature(board.bitboards)
+            signatures.append(seen.setdefault(signature, signature))
+            if plies == len(game.moves):
+                break
+            try:
+                push_san(board, game.moves[plies])
+            except ValueError:
+                break
+            plies += 1
+        lengths.append(plies + 1)
+
+    return b''.join(records), keys, signatures, lengths
+
+
+def _imap(function, items, workers):
+    """map over worker processes, in order, with only a few items handed out ahead of the results."""
+    if workers <= 1:
+        yield from map(function, items)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(function, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _load_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {'games': 0, 'positions': 0, 'sources': [], 'segments': []}
+    with open(path) as file:
+        return json.load(file)
+
+
+def _write_manifest(directory, manifest):
+    """Replace the manifest in one step; until then the database is as it was before the update."""
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.replace(path + '.tmp', path)
+
+
+def update(directory, pgn_path, workers=None, limit=None):
+    """Index the games of a PGN file that aren't in the database yet, at most limit of them.
+
+    Returns the number of games added.
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(directory, exist_ok=True)
+    manifest = _load_manifest(directory)
+    source = os.path.abspath(pgn_path)
+    done = sum(entry['games'] for entry in manifest['sources'] if entry['path'] == source)
+
+    keys = array('Q')
+    material = {}  # Signature -> positions
+    game_starts = array('I')
+    with PositionStore(os.path.join(directory, POSITIONS), writable=True) as store, \
+            open(pgn_path, encoding='utf-8', errors='replace') as stream:
+        store.truncate(manifest['positions'])  # Positions of an update that didn't finish
+        first = position = manifest['positions']
+        games = islice(read_games(stream), done, None if limit is None else done + limit)
+        for records, chunk_keys, signatures, lengths in _imap(_index_games, _chunks(games, CHUNK), workers):
+            store.extend_packed(records)
+            keys.extend(chunk_keys)
+            for offset, signature in enumerate(signatures):
+                material.setdefault(signature, array('I')).append(position + offset)
+            for length in lengths:
+                game_starts.append(position)
+                position += length
+
+    if not game_starts:
+        return 0
+
+    name = f"seg-{len(manifest['segments']):04d}"
+    with open(os.path.join(directory, name + '.keys'), 'wb') as file:
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        file.write(b''.join(KEY_ENTRY.pack(keys[i], first + i) for i in order))
+    groups = {}
+    with open(os.path.join(directory, name + '.material'), 'wb') as file:
+        start = 0
+        for signature in sorted(material):
+            material[signature].tofile(file)
+            groups[signature] = [start, len(material[signature])]
+            start += len(material[signature])
+    with open(os.path.join(directory, GAMES), 'r+b' if os.path.exists(os.path.join(directory, GAMES)) else 'wb') as file:
+        file.truncate(manifest['games'] * game_starts.itemsize)
+        file.seek(0, os.SEEK_END)
+        game_starts.tofile(file)
+
+    manifest['segments'].append({'name': name, 'first': first, 'positions': position - first, 'material': groups})
+    manifest['sources'].append({'path': source, 'first_game': manifest['games'], 'skipped': done,
+                                'games': len(game_starts)})
+    manifest['games'] += len(game_starts)
+    manifest['positions'] = position
+    _write_manifest(directory, manifest)
+    return len(game_starts)
+
+
+class _Segment:
+    def __init__(self, directory, entry):
+        self.name = entry['name']
+        self.material = entry['material']
+        with open(os.path.join(directory, self.name + '.keys'), 'rb') as file:
+            self.keys = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(os.path.join(directory, self.name + '.material'), 'rb') as file:
+            self.positions = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def find_key(self, key):
+        """Positions with the key, in game order."""
+        low, high = 0, len(self.keys) // KEY_ENTRY.size
+        while low < high:
+            middle = (low + high) >> 1
+            if KEY.unpack_from(self.keys, middle * KEY_ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        found = []
+        for offset in range(low * KEY_ENTRY.size, len(self.keys), KEY_ENTRY.size):
+            entry_key, position = KEY_ENTRY.unpack_from(self.keys, offset)
+            if entry_key != key:
+                break
+            found.append(position)
+        return sorted(found)
+
+    def find_material(self, pattern):
+        """Positions whose signature matches the fnmatch-style pattern, in game order."""
+        found = array('I')
+        for signature, (start, count) in self.material.items():
+            if fnmatchcase(signature, pattern):
+                found.frombytes(self.positions[start * found.itemsize:(start + count) * found.itemsize])
+        return sorted(found)
+
+    def close(self):
+        self.keys.close()
+        self.positions.close()
+
+
+class PositionDatabase:
+    """Read access to a database built by update()."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = _load_manifest(directory)
+        if not self.manifest['games']:
+            raise FileNotFoundError(f"No games indexed in {directory}")
+        self.positions = PositionStore(os.path.join(directory, POSITIONS))
+        self._game_starts = array('I')
+        with open(os.path.join(directory, GAMES), 'rb') as file:
+            self._game_starts.fromfile(file, self.manifest['games'])
+        self._segments = [_Segment(directory, entry) for entry in self.manifest['segments']]
+
+    def __len__(self):
+        """Positions indexed."""
+        return self.manifest['positions']
+
+    @property
+    def games(self):
+        return self.manifest['games']
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+        self.positions.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def ref(self, position):
+        """The PositionRef of a position number."""
+        game = bisect_right(self._game_starts, position) - 1
+        return PositionRef(game, position - self._game_starts[game], position)
+
+    def source(self, game):
+        """(PGN path, number of the game in that file counting from 0) of a game."""
+        for entry in self.manifest['sources']:
+            if entry['first_game'] <= game < entry['first_game'] + entry['games']:
+                return entry['path'], entry['skipped'] + game - entry['first_game']
+        raise IndexError(f"game {game} out of range")
+
+    def fen(self, ref):
+        return self.positions.fen(ref.position)
+
+    def find_position(self, board):
+        """Every occurrence of the board's position (placement, side to move and castling rights)."""
+        try:
+            placement = encode_placement(board)
+        except ValueError:
+            return []  # Too many pieces to pack, so never indexed
+        refs = []
+        for segment in self._segments:
+            for position in segment.find_key(board.zobrist_key):
+                # Rule out the rare key collision
+                if self.positions[position][:PLACEMENT.size] == placement:
+                    refs.append(self.ref(position))
+        return refs
+
+    def games_with_position(self, board):
+        """The games that reached the board's position."""
+        return sorted({ref.game for ref in self.find_position(board)})
+
+    def query(self, material='*', where=None, limit=None):
+        """Yield the PositionRef of every position whose material signature matches material (an exact
+        signature or a pattern with * and ?) and, if given, for whose piece bitboards where returns True."""
+        found = 0
+        for segment in self._segments:
+            for position in segment.find_material(material):
+                if where is None or where(unpack_bitboards(self.positions[position])):
+                    yield self.ref(position)
+                    found += 1
+                    if found == limit:
+                        return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index the positions of PGN games and look positions up.")
+    parser.add_argument('directory', help="database directory, created by --add")
+    parser.add_argument('--add', metavar='PGN', help="index the games of this file not indexed yet")
+    parser.add_argument('--limit', type=int, help="games to add at most")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes for --add")
+    parser.add_argument('--fen', help="list the games that reached this position")
+    parser.add_argument('--material', help='material signature or pattern, e.g. "KRP*vKBP*"')
+    parser.add_argument('--pattern', choices=sorted(PATTERNS), help="only positions with this pattern")
+    parser.add_argument('--show', type=int, default=10, help="matches to print")
+    args = parser.parse_args(argv)
+
+    if args.add:
+        start = time.perf_counter()
+        added = update(args.directory, args.add, args.workers, args.limit)
+        print(f"added {added} games in {time.perf_counter() - start:.2f}s with {args.workers} workers")
+    if not (args.fen or args.material or args.pattern):
+        return 0
+
+    with PositionDatabase(args.directory) as database:
+        start = time.perf_counter()
+        if args.fen:
+            refs = database.find_position(Board(args.fen))
+        else:
+            refs = list(database.query(args.material or '*', PATTERNS.get(args.pattern)))
+        elapsed = time.perf_counter() - start
+        games = len({ref.game for ref in refs})
+        print(f"{len(refs)} positions in {games} games of {database.games} ({elapsed * 1000:.1f} ms)")
+        for ref in refs[:args.show]:
+            path, number = database.source(ref.game)
+            print(f"  game {number} of {os.path.basename(path)}, ply {ref.ply}: {database.fen(ref)}")
+
+    return 0 if refs else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""Computer opponent: alpha-beta search over Board.
+
+Negamax with iterative deepening, a transposition table, quiescence search on captures and
+move ordering by TT move, MVV-LVA, killer moves and the history heuristic. Leaves are scored by
+evaluation.evaluate. A search stops at whichever comes first of its depth, time or node budget.
+
+    python engine.py --time 2
+    python engine.py --fen "<fen>" --depth 5
+"""
+
+import argparse
+import sys
+import time
+from collections import namedtuple
+
+from board import Board
+from bitboard import *
+from evaluation import evaluate, PawnHashTable, PIECE_VALUES
+from transposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+
+MATE_SCORE = 100000
+MATE_BOUND = MATE_SCORE - 1000  # Scores beyond this are mates, stored relative to the node in the TT
+INFINITY = MATE_SCORE + 1
+MAX_PLY = 128
+
+
+# score is in centipawns from the side to move's point of view, depth the last fully completed iteration,
+# elapsed in seconds and pv a list of Moves; best_move is None when there is no legal move
+SearchResult = namedtuple('SearchResult', ('best_move', 'score', 'depth', 'nodes', 'elapsed', 'nps', 'pv'))
+
+
+class Engine:
+    def __init__(self, tt_size_mb=16):
+        self.tt = TranspositionTable(tt_size_mb)
+        self.pawns = PawnHashTable()  # Kept between searches like the TT, the pawns change little from move to move
+        self.nodes = 0
+        self.stopped = False
+
+    def search(self, board, max_depth=64, time_limit=None, node_limit=None, report=None):
+        """Find the best move for the side to move.
+
+        time_limit is in seconds. report, if given, is called with a SearchResult after every
+        completed iteration.
+        """
+        self._start(time_limit, node_limit)
+
+        if board.tablebases is not None:
+            # Endings in the tablebases are known exactly, there is nothing to search
+            found = board.tablebases.best_move(board)
+            if found is not None and found[0] is not None:
+                move, known = found
+                score = (MATE_SCORE - known.dtm) * known.wdl
+                result = SearchResult(move, score, 0, 0, time.perf_counter() - self.start_time, 0.0, [move])
+                if report is not None:
+                    report(result)
+                return result
+
+        result = SearchResult(None, 0, 0, 0, 0.0, 0.0, [])
+        for depth in range(1, max_depth + 1):
+            score = self._negamax(board, depth, -INFINITY, INFINITY, 0)
+            if self.stopped:
+                break
+
+            elapsed = time.perf_counter() - self.start_time
+            pv = self._principal_variation(board, depth)
+            result = SearchResult(pv[0] if pv else None, score, depth, self.nodes, elapsed,
+                                  self.nodes / elapsed if elapsed > 0 else 0.0, pv)
+            if report is not None:
+                report(result)
+
+            if abs(score) > MATE_BOUND:
+                break  # Found a forced mate, deeper searches won't change the move
+            # Don't start an iteration we are unlikely to finish
+            if self.deadline is not None and time.perf_counter() - self.start_time > (self.deadline - self.start_time) / 2:
+                break
+
+        if result.best_move is None:
+            # Not even depth 1 finished, fall back to any legal move
+            legal_moves = board.generate_legal_moves()
+            best_move = legal_moves[0] if legal_moves else None
+            elapsed = time.perf_counter() - self.start_time
+            result = SearchResult(best_move, 0, 0, self.nodes, elapsed, self.nodes / elapsed if elapsed > 0 else 0.0,
+                                  [best_move] if best_move else [])
+
+        # Report the totals of the whole search, not just the last completed iteration
+        elapsed = time.perf_counter() - self.start_time
+        return result._replace(nodes=self.nodes, elapsed=elapsed, nps=self.nodes / elapsed if elapsed > 0 else 0.0)
+
+    def search_depth(self, board, depth, alpha=-INFINITY, beta=INFINITY):
+        """Score the position to a fixed depth within the (alpha, beta) window.
+
+        Shallower iterations run first with a full window to fill the TT and move ordering tables.
+        """
+        self._start(None, None)
+
+        for iteration_depth in range(1, depth):
+            self._negamax(board, iteration_depth, -INFINITY, INFINITY, 0)
+
+        return self._negamax(board, depth, alpha, beta, 0)
+
+    def _start(self, time_limit, node_limit):
+        self.nodes = 0
+        self.stopped = False
+        self.node_limit = node_limit
+        self.start_time = time.perf_counter()
+        self.deadline = self.start_time + time_limit if time_limit is not None else None
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [[0] * 64 for _ in range(12)]
+
+    def _check_limits(self):
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            self.stopped = True
+        elif self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.stopped = True
+
+    def _negamax(self, board, depth, alpha, beta, ply):
+        if depth <= 0:
+            return self._quiescence(board, alpha, beta, ply)
+
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self._check_limits()
+        if self.stopped:
+            return 0
+
+        key = board.zobrist_key
+        # A position seen before in the game or on this line is a draw: repeating it can't gain anything
+        if ply > 0 and (board.position_counts[key] > 1 or board.halfmove_clock >= 100):
+            return 0
+
+        entry = self.tt.probe(key)
+        tt_move = None
+        if entry is not None:
+            tt_move = entry.move
+            if ply > 0 and entry.depth >= depth:
+                score = _score_from_tt(entry.score, ply)
+                if entry.bound == EXACT:
+                    return score
+                if entry.bound == LOWER_BOUND and score >= beta:
+                    return score
+                if entry.bound == UPPER_BOUND and score <= alpha:
+                    return score
+
+        color_index = COLOR_INDEX[board.turn]
+        in_check = board.is_square_attacked(board.king_squares[color_index], 1 - color_index)
+        if in_check:
+            depth += 1  # Check extension
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        legal_moves = 0
+
+        for move in self._ordered_moves(board, board.generate_moves(), tt_move, ply):
+            board.make_move(move)
+            if board.is_square_attacked(board.king_squares[color_index], 1 - color_index):
+                board.unmake_move()
+                continue
+
+            legal_moves += 1
+            score = -self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if self.stopped:
+                return 0
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if board.board[move.end >> 3][move.end & 7] == ' ' and not move.promotion:
+                            self._update_quiet_cutoff(board, move, depth, ply)
+                        break
+
+        if legal_moves == 0:
+            return -MATE_SCORE + ply if in_check else 0  # Checkmate or stalemate
+
+        if best_score <= original_alpha:
+            bound = UPPER_BOUND
+        elif best_score >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, _score_to_tt(best_score, ply), bound, best_move)
+
+        return best_score
+
+    def _quiescence(self, board, alpha, beta, ply):
+        """Resolve captures until the position is quiet, so the static score isn't taken mid-exchange."""
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self._check_limits()
+        if self.stopped:
+            return 0
+
+        stand_pat = evaluate(board, self.pawns)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        if ply >= MAX_PLY - 1:
+            return stand_pat
+
+        color_index = COLOR_INDEX[board.turn]
+        for move in self._ordered_moves(board, board.generate_moves(captures_only=True), None, ply):
+            board.make_move(move)
+            if board.is_square_attacked(board.king_squares[color_index], 1 - color_index):
+                board.unmake_move()
+                continue
+
+            score = -self._quiescence(board, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if self.stopped:
+                return 0
+
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+
+        return alpha
+
+    def _ordered_moves(self, board, moves, tt_move, ply):
+        squares = board.board
+        killers = self.killers[ply] if ply < MAX_PLY else (None, None)
+        history = self.history
+
+        def move_order(move):
+            if move == tt_move:
+                return 1000000
+            attacker = squares[move.start >> 3][move.start & 7]
+            victim = squares[move.end >> 3][move.end & 7]
+            if victim != ' ':
+                # Most valuable victim, least valuable attacker
+                return 100000 + 10 * PIECE_VALUES[victim.piece_type] - PIECE_VALUES[attacker.piece_type]
+            if move.promotion:
+                return 90000
+            if move == killers[0]:
+                return 80000
+            if move == killers[1]:
+                return 79000
+            return history[attacker.index][move.end]
+
+        return sorted(moves, key=move_order, reverse=True)
+
+    def _update_quiet_cutoff(self, board, move, depth, ply):
+        if ply < MAX_PLY and self.killers[ply][0] != move:
+            self.killers[ply][1] = self.killers[ply][0]
+            self.killers[ply][0] = move
+        piece = board.board[move.start >> 3][move.start & 7]
+        self.history[piece.index][move.end] += depth * depth
+
+    def _principal_variation(self, board, depth):
+        """Follow TT moves from the root to recover the expected line of play."""
+        pv = []
+        seen = set()
+        while len(pv) < depth:
+            entry = self.tt.probe(board.zobrist_key)
+            if entry is None or entry.move is None or board.zobrist_key in seen:
+                break
+            if entry.move not in board.generate_legal_moves():
+                break
+            seen.add(board.zobrist_key)
+            pv.append(entry.move)
+            board.make_move(entry.move)
+        for _ in pv:
+            board.unmake_move()
+
+        return pv
+
+
+def _score_to_tt(score, ply):
+    """Mate scores are stored as distance from this node rather than from the root."""
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def _score_from_tt(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def print_report(result):
+    pv = ' '.join(move.uci() for move in result.pv)
+    print(f"depth {result.depth} score {result.score} nodes {result.nodes} "
+          f"nps {result.nps:,.0f} time {result.elapsed:.2f}s pv {pv}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a position for the best move.")
+    parser.add_argument('--fen', help="position to search (default: start position)")
+    parser.add_argument('--depth', type=int, default=64)
+    parser.add_argument('--time', type=float, help="time budget in seconds")
+    parser.add_argument('--nodes', type=int, help="node budget")
+    parser.add_argument('--hash', type=int, default=16, help="transposition table size in MB")
+    parser.add_argument('--tablebases', metavar='DIRECTORY', help="play endings found in these tablebases perfectly")
+    args = parser.parse_args(argv)
+
+    if args.tablebases:
+        from tablebase import Tablebases
+        Board.tablebases = Tablebases(args.tablebases)
+
+    if args.time is None and args.nodes is None and args.depth == 64:
+        args.time = 5.0
+    board = Board.from_fen(args.fen) if args.fen else Board()
+    result = Engine(args.hash).search(board, args.depth, args.time, args.nodes, report=print_report)
+    print(f"bestmove {result.best_move.uci() if result.best_move else '(none)'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,391 @@
+"""Static evaluation: how good a position is for the side to move, in centipawns.
+
+Material and piece-square tables are kept up to date by Board itself as pieces are put on and
+taken off squares (board.psq_score and board.phase), so they cost nothing to read. The rest is
+worked out per call: pawn structure (cached by pawn placement in a PawnHashTable, since the pawns
+rarely change between the positions a search looks at), king safety and mobility.
+
+Every term has a middlegame and an endgame value, and the two are blended by how much material
+is left on the board ("tapered" evaluation), so e.g. the king is told to hide early and to come
+out once the queens are gone.
+
+    python evaluation.py
+    python evaluation.py --fen "<fen>"
+    python evaluation.py games.pgn --limit 2000
+"""
+
+import sys
+import time
+
+from bitboard import *
+
+
+def make_score(mg, eg):
+    """A middlegame and an endgame value packed into one int, so adding scores adds both at once."""
+    return (eg << 32) + mg
+
+
+def eg_value(score):
+    return (score + (1 << 31)) >> 32
+
+
+def mg_value(score):
+    return score - (eg_value(score) << 32)
+
+
+MG_VALUES = [100, 320, 330, 500, 900, 0]  # Indexed by piece type, PNBRQK
+EG_VALUES = [120, 290, 320, 520, 940, 0]
+PIECE_VALUES = MG_VALUES  # The usual values, e.g. for ordering captures
+
+# How much each piece counts towards the middlegame; the start position has MAX_PHASE
+PHASE_WEIGHTS = [0, 1, 1, 2, 4, 0]
+MAX_PHASE = 24
+
+# Piece-square bonuses from white's point of view, square 0 is a8. Black uses the mirrored square (sq ^ 56)
+PAWN_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+PAWN_ENDGAME_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    80, 80, 80, 80, 80, 80, 80, 80,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    30, 30, 30, 30, 30, 30, 30, 30,
+    15, 15, 15, 15, 15, 15, 15, 15,
+    5, 5, 5, 5, 5, 5, 5, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+KNIGHT_TABLE = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+]
+BISHOP_TABLE = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+]
+ROOK_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0,
+]
+QUEEN_TABLE = [
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20,
+]
+KING_TABLE = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20,
+]
+KING_ENDGAME_TABLE = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+]
+MG_TABLES = [PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_TABLE]
+EG_TABLES = [PAWN_ENDGAME_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_ENDGAME_TABLE]
+
+# Value plus table bonus of every piece on every square, by Piece.index, positive for white.
+# Board adds and subtracts these as pieces move, see Board._put_piece.
+PSQ_SCORES = [[make_score(MG_VALUES[piece_type] + MG_TABLES[piece_type][sq],
+                          EG_VALUES[piece_type] + EG_TABLES[piece_type][sq]) for sq in range(64)]
+              for piece_type in range(6)]
+PSQ_SCORES += [[-scores[sq ^ 56] for sq in range(64)] for scores in PSQ_SCORES]
+PIECE_PHASES = PHASE_WEIGHTS * 2  # By Piece.index
+
+# Pawn structure
+DOUBLED_PAWN = make_score(-10, -20)  # For each pawn behind another on its file
+ISOLATED_PAWN = make_score(-10, -15)  # No friendly pawn on either neighbouring file
+PASSED_PAWN = [make_score(mg, eg) for mg, eg in  # By rows still to go for white, i.e. the pawn's row
+               [(0, 0), (60, 120), (40, 80), (25, 50), (15, 30), (10, 15), (5, 10), (0, 0)]]
+
+# King safety, middlegame only: own pawns in front of the king, enemy attacks around it
+SHIELD_PAWN = make_score(10, 0)
+KING_ZONE_ATTACK = make_score(-8, 0)  # For each square next to the king an enemy piece attacks
+
+# Per square a piece can move to
+MOBILITY = [make_score(0, 0), make_score(4, 4), make_score(5, 5), make_score(2, 4), make_score(1, 2)]
+
+FILES = [FILE_A << col for col in range(8)]
+NEIGHBOUR_FILES = [(FILES[col - 1] if col > 0 else 0) | (FILES[col + 1] if col < 7 else 0) for col in range(8)]
+
+
+def _ahead(sq, color_index):
+    """Squares in front of sq on its file and the files next to it, as seen by the color."""
+    row, col = divmod(sq, 8)
+    rows = range(row) if color_index == WHITE else range(row + 1, 8)
+    mask = 0
+    for r in rows:
+        for c in (col - 1, col, col + 1):
+            if 0 <= c < 8:
+                mask |= 1 << (r * 8 + c)
+    return mask
+
+
+def _shield(sq, color_index):
+    """The squares one and two rows in front of a king on sq, where its pawn shield stands."""
+    row, col = divmod(sq, 8)
+    step = -1 if color_index == WHITE else 1
+    mask = 0
+    for r in (row + step, row + 2 * step):
+        for c in (col - 1, col, col + 1):
+            if 0 <= r < 8 and 0 <= c < 8:
+                mask |= 1 << (r * 8 + c)
+    return mask
+
+
+PASSED_MASKS = [[_ahead(sq, color_index) for sq in range(64)] for color_index in (WHITE, BLACK)]
+SHIELD_MASKS = [[_shield(sq, color_index) for sq in range(64)] for color_index in (WHITE, BLACK)]
+
+
+def psq_score(board):
+    """Material and piece-square score and game phase worked out from scratch, as Board keeps them."""
+    score = phase = 0
+    for index, bb in enumerate(board.bitboards):
+        for sq in iter_bits(bb):
+            score += PSQ_SCORES[index][sq]
+            phase += PIECE_PHASES[index]
+
+    return score, phase
+
+
+def pawn_structure(white_pawns, black_pawns):
+    """Packed score of the pawns alone, positive for white."""
+    score = 0
+    for color_index, own, other, sign in ((WHITE, white_pawns, black_pawns, 1), (BLACK, black_pawns, white_pawns, -1)):
+        side = 0
+        for col in range(8):
+            on_file = (own & FILES[col]).bit_count()
+            if on_file > 1:
+                side += DOUBLED_PAWN * (on_file - 1)
+            if on_file and not own & NEIGHBOUR_FILES[col]:
+                side += ISOLATED_PAWN * on_file
+        for sq in iter_bits(own):
+            if not other & PASSED_MASKS[color_index][sq]:
+                side += PASSED_PAWN[sq >> 3 if color_index == WHITE else 7 - (sq >> 3)]
+        score += sign * side
+
+    return score
+
+
+class PawnHashTable:
+    """Pawn structure scores by pawn placement, in a fixed number of slots.
+
+    The pawns are the same in most positions a search visits, so almost every lookup is a hit.
+    """
+
+    def __init__(self, size=1 << 14):
+        self.size = 1 << (size.bit_length() - 1)  # A power of two, so the slot is the top bits of the hash
+        self._shift = 64 - (self.size.bit_length() - 1)
+        self.hits = self.misses = 0
+        self.clear()
+
+    def clear(self):
+        self._white = [None] * self.size
+        self._black = [None] * self.size
+        self._scores = [0] * self.size
+
+    def score(self, white_pawns, black_pawns):
+        # Multiplying spreads every pawn over the top bits, which pick the slot
+        slot = ((white_pawns * 0x9E3779B97F4A7C15 + black_pawns * 0xC2B2AE3D27D4EB4F) & FULL) >> self._shift
+        if self._white[slot] == white_pawns and self._black[slot] == black_pawns:
+            self.hits += 1
+            return self._scores[slot]
+
+        self.misses += 1
+        score = self._scores[slot] = pawn_structure(white_pawns, black_pawns)
+        self._white[slot] = white_pawns
+        self._black[slot] = black_pawns
+        return score
+
+
+pawn_table = PawnHashTable()  # Shared by every caller that doesn't bring its own
+
+
+def _pieces(board, color_index):
+    """Packed mobility and king safety score of one side's pieces, positive for that side."""
+    bitboards = board.bitboards
+    base = color_index * 6
+    own = board.occupancy[color_index]
+    occupied = own | board.occupancy[1 - color_index]
+    enemy_king = board.king_squares[1 - color_index]
+    enemy_zone = KING_ATTACKS[enemy_king] if enemy_king is not None else 0
+
+    score = 0
+    attacks_near_king = 0
+    for sq in iter_bits(bitboards[base + KNIGHT]):
+        attacks = KNIGHT_ATTACKS[sq]
+        score += MOBILITY[KNIGHT] * (attacks & ~own).bit_count()
+        attacks_near_king |= attacks
+    for sq in iter_bits(bitboards[base + BISHOP]):
+        attacks = bishop_attacks(sq, occupied)
+        score += MOBILITY[BISHOP] * (attacks & ~own).bit_count()
+        attacks_near_king |= attacks
+    for sq in iter_bits(bitboards[base + ROOK]):
+        attacks = rook_attacks(sq, occupied)
+        score += MOBILITY[ROOK] * (attacks & ~own).bit_count()
+        attacks_near_king |= attacks
+    for sq in iter_bits(bitboards[base + QUEEN]):
+        attacks = queen_attacks(sq, occupied)
+        score += MOBILITY[QUEEN] * (attacks & ~own).bit_count()
+        attacks_near_king |= attacks
+    # Reported against the enemy king's owner, hence the minus
+    score -= KING_ZONE_ATTACK * (attacks_near_king & enemy_zone).bit_count()
+
+    king = board.king_squares[color_index]
+    if king is not None:
+        score += SHIELD_PAWN * (bitboards[base + PAWN] & SHIELD_MASKS[color_index][king]).bit_count()
+
+    return score
+
+
+def taper(score, phase):
+    """Blend the middlegame and endgame halves of a packed score by the game phase."""
+    phase = min(phase, MAX_PHASE)
+    blend = mg_value(score) * phase + eg_value(score) * (MAX_PHASE - phase)
+    # Round towards zero, so a position and its mirror image get opposite scores
+    return blend // MAX_PHASE if blend >= 0 else -(-blend // MAX_PHASE)
+
+
+def evaluate(board, pawns=None):
+    """Static score of the position in centipawns from the side to move's point of view.
+
+    pawns is the PawnHashTable to use, by default the shared pawn_table.
+    """
+    bitboards = board.bitboards
+    score = board.psq_score + (pawns or pawn_table).score(bitboards[PAWN], bitboards[6 + PAWN])
+    score += _pieces(board, WHITE) - _pieces(board, BLACK)
+
+    score = taper(score, board.phase)
+    return score if board.turn == 'white' else -score
+
+
+def explain(board):
+    """Every term of the evaluation as (middlegame, endgame, tapered) centipawns for white, e.g. for analytics."""
+    material = sum(make_score(MG_VALUES[index % 6], EG_VALUES[index % 6]) * bb.bit_count() * (1 if index < 6 else -1)
+                   for index, bb in enumerate(board.bitboards))
+    terms = {
+        'material': material,
+        'piece-square tables': board.psq_score - material,
+        'pawn structure': pawn_structure(board.bitboards[PAWN], board.bitboards[6 + PAWN]),
+        'pieces (mobility and king safety)': _pieces(board, WHITE) - _pieces(board, BLACK),
+    }
+    terms['total'] = sum(terms.values())
+
+    return {name: (mg_value(score), eg_value(score), taper(score, board.phase)) for name, score in terms.items()}
+
+
+def _walk(boards, score, repeat):
+    """Call score on every position one move away from each board, repeat times; return the calls and seconds."""
+    calls = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for board in boards:
+            for move in board.generate_moves():
+                board.make_move(move)
+                score(board)
+                board.unmake_move()
+                calls += 1
+
+    return calls, time.perf_counter() - start
+
+
+def benchmark(fens, repeat=3, out=sys.stdout):
+    """Time evaluate on every position reached by one move from each FEN, the way a search uses it.
+
+    Making and taking back the moves is timed on its own and left out of the rates.
+    """
+    from board import Board
+
+    boards = [Board(fen) for fen in fens]
+    pawns = PawnHashTable()
+    _, moving = _walk(boards, lambda board: None, repeat)
+    evaluations, elapsed = _walk(boards, lambda board: evaluate(board, pawns), repeat)
+    scans, scanning = _walk(boards, psq_score, repeat)
+    elapsed, scanning = max(elapsed - moving, 1e-9), max(scanning - moving, 1e-9)
+
+    lookups = pawns.hits + pawns.misses
+    print(f"{evaluations} evaluations of {len(boards)} positions: {evaluations / elapsed:,.0f} evals/s "
+          f"({elapsed / evaluations * 1e6:.1f} us each)", file=out)
+    print(f"pawn hash hits {pawns.hits / lookups:.1%} of {lookups}", file=out)
+    print(f"material and piece-square tables: incremental, from scratch they would take "
+          f"{scanning / scans * 1e6:.1f} us each", file=out)
+    return evaluations / elapsed
+
+
+def main(argv=None):
+    import argparse  # Not at the top: Board imports this module, and argparse would double its import time
+
+    parser = argparse.ArgumentParser(description="Show the evaluation of a position or measure evaluations per second.")
+    parser.add_argument('path', nargs='?', help="PGN or FEN file to benchmark on (default: the perft positions)")
+    parser.add_argument('--fen', help="print the evaluation terms of this position")
+    parser.add_argument('--limit', type=int, default=2000, help="positions to take from the file")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        from board import Board
+
+        board = Board(args.fen)
+        print(f"phase {min(board.phase, MAX_PHASE)}/{MAX_PHASE}, for white:")
+        for name, (mg, eg, tapered) in explain(board).items():
+            print(f"  {name:<34} mg {mg:6} eg {eg:6} -> {tapered:6}")
+        print(f"side to move: {evaluate(board)}")
+        return 0
+
+    if args.path:
+        from itertools import islice
+        from tensors import fens_from_file, fens_from_pgn
+
+        source = fens_from_pgn(args.path) if args.path.lower().endswith('.pgn') else fens_from_file(args.path)
+        fens = list(islice(source, args.limit))
+    else:
+        from perft import REFERENCE_POSITIONS
+
+        fens = [fen for _, fen, _ in REFERENCE_POSITIONS]
+    benchmark(fens, args.repeat)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""Opt-in call counters and timers for the rules, to find out what made a move slow.
+
+enable() swaps the rules functions in INSTRUMENTED for wrappers that count their calls and add
+up their wall time, and times every move played through Board.move_piece along with the rules
+calls it made. disable() puts the original functions back, so when instrumentation is off
+nothing at all stands between a caller and the rules. Times include the calls a function makes
+itself, e.g. has_legal_move's include the is_legal calls under it.
+
+    stats = instrumentation.enable()
+    ...
+    print(stats.report())
+    instrumentation.disable()
+
+StatsDumper writes the stats as JSON to a file every few seconds while a program runs.
+
+    python instrumentation.py games.pgn --limit 200
+    python instrumentation.py games.pgn --json stats.json
+"""
+
+import argparse
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from board import Board
+from piece import King, Pawn, Knight, Bishop, Rook, Queen
+
+# (class, method name) of every function that is counted while instrumentation is on
+INSTRUMENTED = [
+    (Board, 'is_in_checkmate'),
+    (Board, 'is_in_check'),
+    (Board, 'is_square_attacked'),
+    (Board, 'attacked_squares'),
+    (Board, 'king_danger_squares'),
+    (Board, 'generate_moves'),
+    (Board, 'generate_legal_moves'),
+    (Board, 'has_legal_move'),
+    (Board, 'is_legal'),
+    (Board, 'make_move'),
+    (Board, 'unmake_move'),
+    (Board, 'game_status'),
+    (Board, 'get_all_possible_moves'),
+    (King, '_castling_targets'),
+] + [(piece_class, 'targets') for piece_class in (King, Pawn, Knight, Bishop, Rook, Queen)]
+
+RECENT_MOVES = 50  # Moves whose own breakdown is kept
+
+
+class FunctionStats:
+    """Calls and wall time of one function."""
+
+    __slots__ = ('calls', 'total', 'max')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self):
+        mean = self.total / self.calls if self.calls else 0.0
+        return {'calls': self.calls, 'total_s': self.total, 'mean_us': mean * 1e6, 'max_us': self.max * 1e6}
+
+
+class Stats:
+    """Everything counted since enable() or the last reset().
+
+    functions maps 'Board.is_in_check' style names to FunctionStats, moves is the FunctionStats of
+    Board.move_piece and recent_moves the latest moves as dicts with their time and rules calls.
+    Updated without locks: with the analysis thread also using the rules, a count can
+    occasionally be lost, which doesn't matter for finding where the time goes.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.functions = {}
+        self.moves = FunctionStats()
+        self.recent_moves = deque(maxlen=RECENT_MOVES)
+
+    def calls(self):
+        """Calls so far by function name."""
+        return {name: entry.calls for name, entry in self.functions.items()}
+
+    def snapshot(self):
+        """The stats as plain data, ready for JSON."""
+        return {
+            'started': self.started,
+            'elapsed_s': time.time() - self.started,
+            'functions': {name: entry.as_dict() for name, entry in self.functions.items() if entry.calls},
+            'moves': self.moves.as_dict(),
+            'recent_moves': list(self.recent_moves),
+        }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def report(self):
+        """A table of the functions, most total time first, and the slowest recent move."""
+        lines = [f"{'function':<28} {'calls':>10} {'total ms':>10} {'mean us':>9} {'max us':>9}"]
+        functions = sorted(self.functions.items(), key=lambda item: -item[1].total)
+        for name, entry in [('Board.move_piece', self.moves)] + functions:
+            if entry.calls:
+                data = entry.as_dict()
+                lines.append(f"{name:<28} {entry.calls:>10} {entry.total * 1000:>10.1f} "
+                             f"{data['mean_us']:>9.1f} {data['max_us']:>9.1f}")
+        if self.recent_moves:
+            slowest = max(self.recent_moves, key=lambda move: move['seconds'])
+            calls = ', '.join(f"{name} {count}" for name, count in
+                              sorted(slowest['calls'].items(), key=lambda item: -item[1])[:4])
+            lines.append(f"slowest of the last {len(self.recent_moves)} moves: {slowest['move']} "
+                         f"{slowest['seconds'] * 1000:.2f} ms ({calls})")
+        return '\n'.join(lines)
+
+
+_stats = None
+_originals = {}  # (class, name) -> the function the wrapper replaced
+
+
+def _timed(entry, function):
+    """function, adding the wall time of every call to entry."""
+    perf_counter = time.perf_counter
+
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            entry.add(perf_counter() - start)
+
+    return timed
+
+
+def _timed_move(stats, function):
+    """Board.move_piece, recording each move with the rules calls made while it was played."""
+    perf_counter = time.perf_counter
+
+    @functools.wraps(function)
+    def timed(board, start, end, *args, **kwargs):
+        before = stats.calls()
+        started = perf_counter()
+        try:
+            return function(board, start, end, *args, **kwargs)
+        finally:
+            seconds = perf_counter() - started
+            stats.moves.add(seconds)
+            calls = {name: count - before.get(name, 0) for name, count in stats.calls().items()
+                     if count != before.get(name, 0)}
+            stats.recent_moves.append({'move': start + end, 'seconds': seconds, 'calls': calls})
+
+    return timed
+
+
+def enable():
+    """Start counting, if not already, and return the Stats being filled in."""
+    global _stats
+    if _stats is not None:
+        return _stats
+
+    stats = Stats()
+    for cls, name in INSTRUMENTED:
+        function = cls.__dict__[name]
+        entry = stats.functions.setdefault(f"{cls.__name__}.{name}", FunctionStats())
+        _originals[cls, name] = function
+        setattr(cls, name, _timed(entry, function))
+    _originals[Board, 'move_piece'] = Board.__dict__['move_piece']
+    Board.move_piece = _timed_move(stats, Board.move_piece)
+
+    _stats = stats
+    return stats
+
+
+def disable():
+    """Put the original functions back. The Stats keep what was counted."""
+    global _stats
+    for (cls, name), function in _originals.items():
+        setattr(cls, name, function)
+    _originals.clear()
+    _stats = None
+
+
+def stats():
+    """The Stats being filled in, or None when instrumentation is off."""
+    return _stats
+
+
+def write_json(stats, path):
+    """Write a snapshot of the stats to path, replacing the file in one step so readers never see half of it."""
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as file:
+        file.write(stats.to_json())
+    os.replace(temporary, path)
+
+
+class StatsDumper:
+    """Writes the stats to a JSON file every interval seconds on a background thread, and once more on stop()."""
+
+    def __init__(self, stats, path, interval=10.0):
+        self.stats = stats
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stats-dumper', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            write_json(self.stats, self.path)
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        write_json(self.stats, self.path)
+
+
+def replay(path, limit=None):
+    """Play the games in a PGN file move by move through Board.move_piece, the way the GUI does.
+
+    Returns the number of moves played.
+    """
+    from pgn import read_games, parse_san
+    from bitboard import SQUARE_NAMES
+
+    moves = 0
+    with open(path, encoding='utf-8', errors='replace') as stream:
+        for number, game in enumerate(read_games(stream)):
+            if limit is not None and number >= limit:
+                break
+            board = Board(game.fen)
+            for san in game.moves:
+                try:
+                    move = parse_san(board, san)
+                except ValueError:
+                    break  # A bad game, pgn.py reports those
+                board.move_piece(SQUARE_NAMES[move.start], SQUARE_NAMES[move.end], move.promotion)
+                moves += 1
+
+    return moves
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay PGN games with instrumentation on and show where the time went.")
+    parser.add_argument('path', help="PGN file to replay")
+    parser.add_argument('--limit', type=int, default=200, help="stop after this many games")
+    parser.add_argument('--json', help="also write the stats to this file as JSON")
+    args = parser.parse_args(argv)
+
+    stats = enable()
+    start = time.perf_counter()
+    moves = replay(args.path, args.limit)
+    elapsed = time.perf_counter() - start
+    disable()
+
+    print(f"{moves} moves in {elapsed:.2f}s, instrumented")
+    print(stats.report())
+    if args.json:
+        write_json(stats, args.json)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
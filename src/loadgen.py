@@ -0,0 +1,169 @@
+"""Load generator for server.py: plays the games of a PGN file over many connections at once.
+
+Each connection starts a game, joins it as both colors and sends its moves one at a time,
+waiting for every reply, then goes on to the next game. The moves are worked out before the
+clock starts, so the client costs as little as possible. Reported: moves per second over all
+connections, round-trip latency percentiles and the server's own move validation latency.
+With --idle, that many games are first started and left alone, to see what they cost the server.
+
+    python loadgen.py games.pgn --start-server
+    python loadgen.py games.pgn --port 8765 --connections 200 --idle 20000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from itertools import islice
+
+from pgn import read_games, replay_game
+from server import PORT, MAX_LINE
+
+
+def game_moves(path, limit):
+    """UCI moves of the first limit games of a PGN file that replay cleanly, with the FEN they start from."""
+    games = []
+    with open(path, encoding='utf-8', errors='replace') as stream:
+        for game in islice(read_games(stream), limit):
+            try:
+                board = replay_game(game)
+            except ValueError:
+                continue
+            games.append((game.fen, [move.uci() for move in board.move_history()]))
+    return games
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port):
+        return cls(*await asyncio.open_connection(host, port, limit=MAX_LINE * 16))
+
+    async def request(self, **request):
+        """Send a request and return its reply, skipping updates pushed in between."""
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        while True:
+            message = json.loads(await self.reader.readline())
+            if 'event' not in message:
+                break
+        if not message['ok']:
+            raise RuntimeError(f"{request}: {message['error']}")
+        return message
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def play_games(client, games, latencies):
+    """Play the games one after another, adding the round trip of every move to latencies."""
+    for fen, moves in games:
+        game = (await client.request(op='new', fen=fen))['game']
+        await client.request(op='join', game=game, color='white')
+        await client.request(op='join', game=game, color='black')
+        status = 'ongoing'
+        for move in moves:
+            start = time.perf_counter()
+            status = (await client.request(op='move', game=game, move=move))['status']
+            latencies.append(time.perf_counter() - start)
+        if status == 'ongoing':
+            await client.request(op='resign', game=game, color='white')  # Most archived games end in a resignation
+
+
+async def start_idle_games(client, count, batch=1000):
+    """Start count games without playing them, sending the requests in batches."""
+    while count > 0:
+        size = min(batch, count)
+        client.writer.write(b'{"op": "new"}\n' * size)
+        for _ in range(size):
+            await client.reader.readline()
+        count -= size
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+async def run(host, port, games, connections, idle, out=sys.stdout):
+    control = await Client.connect(host, port)
+    if idle:
+        start = time.perf_counter()
+        await start_idle_games(control, idle)
+        stats = await control.request(op='stats')
+        print(f"{idle} idle games started in {time.perf_counter() - start:.2f}s, server holds {stats['games']} games "
+              f"in {stats.get('max_rss_mb', 0):.0f} MB", file=out)
+
+    clients = [await Client.connect(host, port) for _ in range(connections)]
+    shares = [games[i::connections] for i in range(connections)]
+    latencies = []
+    before = (await control.request(op='stats'))['moves']
+    start = time.perf_counter()
+    await asyncio.gather(*(play_games(client, share, latencies) for client, share in zip(clients, shares)))
+    elapsed = time.perf_counter() - start
+    stats = await control.request(op='stats')
+
+    moves = stats['moves'] - before
+    print(f"{len(games)} games, {moves} moves over {connections} connections in {elapsed:.2f}s: "
+          f"{moves / elapsed:,.0f} moves/s", file=out)
+    print(f"round trip: p50 {percentile(latencies, 0.5) * 1e3:.2f} ms, p99 {percentile(latencies, 0.99) * 1e3:.2f} ms",
+          file=out)
+    print(f"server move validation: p50 {stats['p50_us']:.0f} us, p99 {stats['p99_us']:.0f} us, "
+          f"max {stats['max_us']:.0f} us; {stats['games']} games, {stats.get('max_rss_mb', 0):.0f} MB", file=out)
+
+    for client in clients + [control]:
+        await client.close()
+    return moves / elapsed
+
+
+def _start_server(port):
+    """Run server.py in a child process and wait until it accepts connections."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+    process = subprocess.Popen([sys.executable, script, '--port', str(port)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    async def wait():
+        for _ in range(100):
+            try:
+                _, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.close()
+                return
+            except OSError:
+                await asyncio.sleep(0.05)
+        raise RuntimeError("The server didn't start")
+
+    asyncio.run(wait())
+    return process
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play PGN games against server.py over many connections and "
+                                                 "report moves/s and latency.")
+    parser.add_argument('path', help="PGN file with the games to play")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--games', type=int, default=500, help="games to take from the file")
+    parser.add_argument('--connections', type=int, default=50)
+    parser.add_argument('--idle', type=int, default=0, help="idle games to start first")
+    parser.add_argument('--start-server', action='store_true', help="run server.py in a child process for the test")
+    args = parser.parse_args(argv)
+
+    games = game_moves(args.path, args.games)
+    process = _start_server(args.port) if args.start_server else None
+    try:
+        asyncio.run(run(args.host, args.port, games, args.connections, args.idle))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""Best-move search spread over worker processes.
+
+The root moves are split between workers. Each worker rebuilds the position from its FEN and
+the game's repetition counts, plays its root move and runs an alpha-beta search to the
+remaining depth. The best score found so far lives in shared memory, and every worker uses it
+as its alpha bound, so later root moves are refuted as cheaply as in a single-process search.
+
+    python parallel_search.py --depth 4 --workers 8
+    python parallel_search.py --depth 4 --bench 1,2,4,8
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from board import Board, Move
+from engine import Engine, SearchResult, INFINITY, MATE_BOUND
+
+_shared_alpha = None  # Best root score so far, set in each worker by _init_worker
+_engine = None
+
+
+def _init_worker(shared_alpha, tt_size_mb):
+    global _shared_alpha, _engine
+    _shared_alpha = shared_alpha
+    _engine = Engine(tt_size_mb)
+
+
+def _search_root_move(fen, position_counts, uci, depth):
+    """Score one root move. Returns (uci, score, exact, nodes).
+
+    position_counts is the game's Board.position_counts, which a FEN doesn't carry, so repeating an
+    earlier position of the game is scored as the draw it is.
+    """
+    board = Board.from_fen(fen)
+    board.position_counts = position_counts
+    board.make_move(Move.from_uci(uci))
+
+    alpha = _shared_alpha.value
+    score = -_engine.search_depth(board, depth - 1, -INFINITY, -alpha)
+    if abs(score) > MATE_BOUND:
+        score -= 1 if score > 0 else -1  # Mate distances were counted from the position after the move
+
+    # A score at or below alpha only bounds the move from above; it can't be the best one
+    exact = score > alpha
+    if exact:
+        with _shared_alpha.get_lock():
+            if score > _shared_alpha.value:
+                _shared_alpha.value = score
+
+    return uci, score, exact, _engine.nodes
+
+
+def parallel_search(board, depth, workers=None, tt_size_mb=16):
+    """Search the position to a fixed depth using a pool of worker processes."""
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+
+    legal_moves = board.generate_legal_moves()
+    if not legal_moves:
+        return SearchResult(None, 0, depth, 0, 0.0, 0.0, [])
+
+    # A quick shallow search orders the root moves, so the likely best one raises alpha first
+    ordering_engine = Engine(1)
+    ordering_engine.search(board, max_depth=max(1, min(2, depth - 1)))
+    nodes = ordering_engine.nodes
+    first = ordering_engine.tt.probe(board.zobrist_key)
+    if first is not None and first.move in legal_moves:
+        legal_moves.remove(first.move)
+        legal_moves.insert(0, first.move)
+
+    fen = board.to_fen()
+    shared_alpha = multiprocessing.Value('i', -INFINITY)
+    best_move, best_score = legal_moves[0], -INFINITY
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared_alpha, tt_size_mb)) as pool:
+        futures = [pool.submit(_search_root_move, fen, board.position_counts, move.uci(), depth) for move in legal_moves]
+        for future in as_completed(futures):
+            uci, score, exact, worker_nodes = future.result()
+            nodes += worker_nodes
+            if exact and score > best_score:
+                best_move, best_score = Move.from_uci(uci), score
+
+    elapsed = time.perf_counter() - start
+    return SearchResult(best_move, best_score, depth, nodes, elapsed, nodes / elapsed if elapsed > 0 else 0.0,
+                        [best_move])
+
+
+def benchmark(board, depth, worker_counts):
+    """Time the same search with each worker count and print the speedup over the first."""
+    baseline = None
+    for workers in worker_counts:
+        result = parallel_search(board, depth, workers)
+        baseline = baseline or result.elapsed
+        print(f"{workers:3} workers: {result.elapsed:.2f}s, {result.nodes} nodes, {result.nps:,.0f} nodes/s, "
+              f"speedup {baseline / result.elapsed:.2f}x, best {result.best_move.uci()} ({result.score})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a position for the best move on several cores.")
+    parser.add_argument('--fen', help="position to search (default: start position)")
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument('--bench', help="comma separated worker counts to compare, e.g. 1,2,4,8")
+    args = parser.parse_args(argv)
+
+    board = Board.from_fen(args.fen) if args.fen else Board()
+    if args.bench:
+        benchmark(board, args.depth, [int(count) for count in args.bench.split(',')])
+        return 0
+
+    result = parallel_search(board, args.depth, args.workers)
+    print(f"depth {result.depth} score {result.score} nodes {result.nodes} nps {result.nps:,.0f} "
+          f"time {result.elapsed:.2f}s workers {args.workers}")
+    print(f"bestmove {result.best_move.uci() if result.best_move else '(none)'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
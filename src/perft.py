@@ -0,0 +1,125 @@
+"""Perft: count the leaf nodes of the legal move tree to a fixed depth.
+
+Comparing the counts with published reference numbers is the correctness check for the move
+generator, and the nodes per second it reports is the benchmark for Board performance.
+
+    python perft.py --depth 4
+    python perft.py --fen "<fen>" --depth 3 --divide
+    python perft.py --suite --depth 3
+"""
+
+import argparse
+import sys
+import time
+
+from board import Board, STARTING_FEN
+from bitboard import COLOR_INDEX
+
+START_FEN = STARTING_FEN
+
+# Standard perft positions with their node counts for depth 1, 2, 3, ...
+REFERENCE_POSITIONS = [
+    ('start position', START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862, 4085603]),
+    ('position 3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238, 674624]),
+    ('position 4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467, 422333]),
+    ('position 4 mirrored', 'r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1',
+     [6, 264, 9467, 422333]),
+    ('position 5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379, 2103487]),
+    ('position 6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def perft(board, depth):
+    """Number of legal move sequences of the given length from the position."""
+    if depth == 0:
+        return 1
+
+    color_index = COLOR_INDEX[board.turn]
+    nodes = 0
+    for move in board.generate_moves():
+        board.make_move(move)
+        king_sq = board.king_squares[color_index]
+        if king_sq is None or not board.is_square_attacked(king_sq, 1 - color_index):
+            nodes += 1 if depth == 1 else perft(board, depth - 1)
+        board.unmake_move()
+
+    return nodes
+
+
+def divide(board, depth):
+    """Perft split by root move, as {uci move: nodes}."""
+    return {move.uci(): perft_after(board, move, depth - 1) for move in board.generate_legal_moves()}
+
+
+def perft_after(board, move, depth):
+    board.make_move(move)
+    nodes = perft(board, depth)
+    board.unmake_move()
+
+    return nodes
+
+
+def run_perft(fen, depth, show_divide=False, out=sys.stdout):
+    """Run perft on a position, print the node count and speed, and return the node count."""
+    board = Board.from_fen(fen)
+    start = time.perf_counter()
+    if show_divide:
+        counts = divide(board, depth)
+        for move in sorted(counts):
+            print(f"{move}: {counts[move]}", file=out)
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(board, depth)
+    elapsed = time.perf_counter() - start
+
+    nps = nodes / elapsed if elapsed > 0 else 0.0
+    print(f"depth {depth}: {nodes} nodes in {elapsed:.3f}s ({nps:,.0f} nodes/s)", file=out)
+    return nodes
+
+
+def run_suite(max_depth, out=sys.stdout):
+    """Check every reference position up to max_depth. Returns True if all counts match."""
+    all_passed = True
+    total_nodes = 0
+    start = time.perf_counter()
+
+    for name, fen, expected in REFERENCE_POSITIONS:
+        board = Board.from_fen(fen)
+        for depth, expected_nodes in enumerate(expected[:max_depth], start=1):
+            nodes = perft(board, depth)
+            total_nodes += nodes
+            status = 'ok' if nodes == expected_nodes else 'FAIL'
+            if nodes != expected_nodes:
+                all_passed = False
+            print(f"{status:4} {name} depth {depth}: {nodes} (expected {expected_nodes})", file=out)
+
+    elapsed = time.perf_counter() - start
+    nps = total_nodes / elapsed if elapsed > 0 else 0.0
+    print(f"{total_nodes} nodes in {elapsed:.3f}s ({nps:,.0f} nodes/s)", file=out)
+    return all_passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count move tree leaf nodes to check and benchmark move generation.")
+    parser.add_argument('--fen', default=START_FEN, help="position to search (default: start position)")
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--divide', action='store_true', help="print the node count under each root move")
+    parser.add_argument('--suite', action='store_true', help="check the reference positions up to --depth")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if run_suite(args.depth) else 1
+
+    run_perft(args.fen, args.depth, args.divide)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""Reading, writing and replaying games in PGN with standard algebraic notation (SAN).
+
+read_games streams games from a file one at a time, so archives of any size are read in
+constant memory. replay_file plays every game through Board and reports how fast it went.
+
+    python pgn.py games.pgn
+    python pgn.py games.pgn --output checked.pgn --limit 10000
+"""
+
+import argparse
+import re
+import sys
+import textwrap
+import time
+from collections import namedtuple
+
+from board import Board, Move, STARTING_FEN
+from bitboard import *
+
+SAN_PATTERN = re.compile(r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?')
+CASTLING_SAN = {'O-O': 2, 'O-O-O': -2, '0-0': 2, '0-0-0': -2}  # King step from its home square
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+SEVEN_TAG_ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+
+TAG_PATTERN = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# Comments, variation brackets, NAGs and move numbers are all tokens, so they can be skipped
+TOKEN_PATTERN = re.compile(r'\{[^}]*\}?|;[^\n]*|\(|\)|\$\d+|\d+\.+|[^\s(){};]+')
+
+
+class PgnGame(namedtuple('PgnGame', ('headers', 'moves', 'result'))):
+    """headers is a dict of the tag pairs, moves the mainline in SAN and result e.g. '1-0'."""
+    __slots__ = ()
+
+    @property
+    def fen(self):
+        """The position the game starts from."""
+        return self.headers.get('FEN', STARTING_FEN)
+
+
+def _origins(board, piece_type, color_index, end):
+    """Squares of the color's pieces of a type that attack end (pawns: that stand on its file)."""
+    own = board.bitboards[color_index * 6 + piece_type]
+    if piece_type == PAWN:
+        return own & (FILE_A << (end & 7))
+    if piece_type == KNIGHT:
+        return own & KNIGHT_ATTACKS[end]
+    if piece_type == KING:
+        return own & KING_ATTACKS[end]
+
+    occupied = board.occupancy[0] | board.occupancy[1]
+    if piece_type == BISHOP:
+        return own & bishop_attacks(end, occupied)
+    if piece_type == ROOK:
+        return own & rook_attacks(end, occupied)
+    return own & queen_attacks(end, occupied)
+
+
+def _san_moves(board, san):
+    """Moves for the side to move that match the SAN, not counting whether they leave the king in check."""
+    text = san.rstrip('+#!?')
+    color_index = COLOR_INDEX[board.turn]
+
+    if text in CASTLING_SAN:
+        home = CASTLING[color_index][0]
+        king = board.board[home >> 3][home & 7]
+        end = home + CASTLING_SAN[text]
+        if king != ' ' and king.piece_type == KING and king.color_index == color_index and king.targets(board) >> end & 1:
+            return [Move(home, end)]
+        return []
+
+    match = SAN_PATTERN.fullmatch(text)
+    if match is None:
+        raise ValueError(f"Invalid SAN {san!r}")
+    symbol, from_file, from_rank, destination, promotion = match.groups()
+    end = SQUARE_INDEX[destination]
+    piece_type = PIECE_TYPES.index(symbol) if symbol else PAWN
+
+    if piece_type == PAWN:
+        # Pawn captures name the file they come from
+        origins = board.bitboards[color_index * 6 + PAWN] & (FILE_A << (ord(from_file or destination[0]) - 97))
+        if (PROMOTION_RANKS >> end & 1) != (promotion is not None):
+            return []
+    else:
+        if promotion or board.occupancy[color_index] >> end & 1:
+            return []
+        origins = _origins(board, piece_type, color_index, end)
+        if from_file:
+            origins &= FILE_A << (ord(from_file) - 97)
+    if from_rank:
+        origins &= 0xFF << ((8 - int(from_rank)) * 8)
+
+    moves = []
+    for start in iter_bits(origins):
+        # Attacks already prove a piece reaches end, only pawn pushes and captures need checking
+        if piece_type != PAWN or board.board[start >> 3][start & 7].targets(board) >> end & 1:
+            moves.append(Move(start, end, promotion))
+
+    return moves
+
+
+def parse_san(board, san):
+    """Convert a SAN move for the side to move into a Move. Raises ValueError if it is illegal or ambiguous."""
+    moves = [move for move in _san_moves(board, san) if board.is_legal(move)]
+    if not moves:
+        raise ValueError(f"Illegal move {san!r}")
+    if len(moves) > 1:
+        raise ValueError(f"Ambiguous move {san!r}")
+
+    return moves[0]
+
+
+def push_san(board, san):
+    """Play a SAN move on the board and return it. Raises ValueError, leaving the board as it was, if it is illegal."""
+    moves = _san_moves(board, san)
+    if len(moves) != 1:
+        move = parse_san(board, san)
+        board.make_move(move)
+        return move
+
+    # The usual case: a single candidate, so make it straight away and take it back if it was illegal
+    move = moves[0]
+    color_index = COLOR_INDEX[board.turn]
+    board.make_move(move)
+    king_sq = board.king_squares[color_index]
+    if king_sq is not None and board.is_square_attacked(king_sq, 1 - color_index):
+        board.unmake_move()
+        raise ValueError(f"Illegal move {san!r}")
+
+    return move
+
+
+def move_to_san(board, move):
+    """Describe a legal move of the side to move in SAN, e.g. "Nbd7", "exd6", "e8=Q+" or "O-O-O"."""
+    start, end, promotion = move
+    piece = board.board[start >> 3][start & 7]
+
+    if piece.piece_type == KING and abs(end - start) == 2:
+        san = 'O-O' if end > start else 'O-O-O'
+    elif piece.piece_type == PAWN:
+        san = SQUARE_NAMES[start][0] + 'x' if (end - start) & 7 else ''
+        san += SQUARE_NAMES[end] + ('=' + promotion if promotion else '')
+    else:
+        # Name the start file, rank or both if another piece of the same kind could also go there
+        rivals = [sq for sq in iter_bits(_origins(board, piece.piece_type, piece.color_index, end) & ~(1 << start))
+                  if board.is_legal(Move(sq, end))]
+        disambiguation = ''
+        if rivals:
+            if all(sq & 7 != start & 7 for sq in rivals):
+                disambiguation = SQUARE_NAMES[start][0]
+            elif all(sq >> 3 != start >> 3 for sq in rivals):
+                disambiguation = SQUARE_NAMES[start][1]
+            else:
+                disambiguation = SQUARE_NAMES[start]
+        capture = 'x' if board.board[end >> 3][end & 7] != ' ' else ''
+        san = piece.symbol + disambiguation + capture + SQUARE_NAMES[end]
+
+    board.make_move(move)
+    if board.is_in_check(board.turn):
+        san += '+' if board.has_legal_move() else '#'
+    board.unmake_move()
+
+    return san
+
+
+def game_result(board):
+    """The PGN result of the position: '1-0' or '0-1' after checkmate, '1/2-1/2' after a draw, '*' otherwise."""
+    return board.game_status().result
+
+
+def format_game(moves, headers=None, result='*', start_fen=STARTING_FEN):
+    """A game as PGN text: the tag pairs followed by the moves in SAN."""
+    tags = {tag: '?' for tag in SEVEN_TAG_ROSTER}
+    tags['Date'] = '????.??.??'
+    tags.update(headers or {})
+    tags['Result'] = result
+    if start_fen != STARTING_FEN:
+        tags['SetUp'] = '1'
+        tags['FEN'] = start_fen
+
+    board = Board(start_fen)
+    tokens = []
+    for move in moves:
+        if board.turn == 'white':
+            tokens.append(f"{board.fullmove_number}.")
+        elif not tokens:
+            tokens.append(f"{board.fullmove_number}...")
+        tokens.append(move_to_san(board, move))
+        board.make_move(move)
+    tokens.append(result)
+
+    lines = [f'[{tag} "{value}"]' for tag, value in
+             ((tag, value.replace('\\', '\\\\').replace('"', '\\"')) for tag, value in tags.items())]
+    movetext = textwrap.fill(' '.join(tokens), 79, break_long_words=False, break_on_hyphens=False)
+    return '\n'.join(lines) + '\n\n' + movetext + '\n'
+
+
+def write_game(out, board, headers=None):
+    """Write the game played on the board as PGN, with its result if it is over."""
+    out.write(format_game(board.move_history(), headers, game_result(board), board.start_fen))
+    out.write('\n')
+
+
+def _make_game(headers, movetext):
+    moves = []
+    result = headers.get('Result', '*')
+    depth = 0  # Nesting of variations, only depth 0 is the mainline
+    for token in TOKEN_PATTERN.findall('\n'.join(movetext)):
+        first = token[0]
+        if first == '(':
+            depth += 1
+        elif first == ')':
+            depth -= 1
+        elif depth or first in '{;$' or token[-1] == '.':
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            moves.append(token)
+
+    return PgnGame(headers, moves, result)
+
+
+def read_games(stream):
+    """Yield the games in a PGN text stream one at a time."""
+    headers = {}
+    movetext = []
+    for line in stream:
+        line = line.strip()
+        if not line or line[0] == '%':
+            continue
+        if line[0] == '[':
+            # A tag after movetext starts the next game
+            if movetext:
+                yield _make_game(headers, movetext)
+                headers = {}
+                movetext = []
+            match = TAG_PATTERN.match(line)
+            if match:
+                headers[match.group(1)] = re.sub(r'\\(.)', r'\1', match.group(2))
+            continue
+        movetext.append(line)
+
+    if headers or movetext:
+        yield _make_game(headers, movetext)
+
+
+def replay_game(game):
+    """Play a game's moves through Board and return the final position. Raises ValueError at the first bad move."""
+    board = Board(game.fen)
+    for san in game.moves:
+        number = f"{board.fullmove_number}{'.' if board.turn == 'white' else '...'}"
+        try:
+            push_san(board, san)
+        except ValueError as error:
+            raise ValueError(f"{number} {san}: {error}") from None
+
+    return board
+
+
+def replay_file(path, output=None, limit=None, out=sys.stdout):
+    """Replay every game in a PGN file, print the bad ones and the throughput, and return the number of bad games."""
+    games = moves = errors = 0
+    start = time.perf_counter()
+
+    with open(path, encoding='utf-8', errors='replace') as stream:
+        for game in read_games(stream):
+            if limit is not None and games >= limit:
+                break
+            games += 1
+            try:
+                board = replay_game(game)
+            except ValueError as error:
+                errors += 1
+                print(f"game {games} ({game.headers.get('White', '?')} - {game.headers.get('Black', '?')}): {error}",
+                      file=out)
+                continue
+            moves += len(game.moves)
+            if output is not None:
+                headers = {tag: value for tag, value in game.headers.items() if tag not in ('SetUp', 'FEN')}
+                output.write(format_game(board.move_history(), headers, game.result, board.start_fen) + '\n')
+
+    elapsed = time.perf_counter() - start
+    per_minute = games * 60 / elapsed if elapsed > 0 else 0.0
+    moves_per_second = moves / elapsed if elapsed > 0 else 0.0
+    print(f"{games} games, {moves} moves, {errors} bad in {elapsed:.2f}s "
+          f"({per_minute:,.0f} games/min, {moves_per_second:,.0f} moves/s)", file=out)
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the games in a PGN file through the rules and check every move.")
+    parser.add_argument('path', help="PGN file to read")
+    parser.add_argument('--output', help="write the replayed games back out as PGN to this file")
+    parser.add_argument('--limit', type=int, help="stop after this many games")
+    args = parser.parse_args(argv)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            errors = replay_file(args.path, output, args.limit)
+    else:
+        errors = replay_file(args.path, limit=args.limit)
+
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
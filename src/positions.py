@@ -0,0 +1,282 @@
+"""Positions packed into 32 bytes each, and a file of them that is read through a memory map.
+
+A packed position (little-endian):
+
+    bytes 0-7    occupancy: bit sq set when a piece stands on square sq (a8 = 0, see bitboard.py)
+    bytes 8-23   one 4-bit Piece.index per occupied square, lowest square first, low nibble first
+    byte 24      bit 0 set when black is to move, bits 1-4 the castling rights
+    byte 25      en passant target file + 1, 0 for none (its rank follows from the side to move)
+    byte 26      halfmove clock
+    bytes 27-28  fullmove number
+    bytes 29-31  zero, reserved
+
+A PositionStore file is a 16-byte header followed by packed positions. Records are only ever
+appended, so the file can be read by index through a memory map without loading it, while
+another process keeps adding to it.
+
+    python positions.py positions.pos --add games.pgn --limit 1000
+    python positions.py positions.pos --show 0 1 2
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+
+from board import Board, CASTLING_LETTERS
+from bitboard import *
+
+RECORD = struct.Struct('<Q16sBBBH3x')
+RECORD_SIZE = RECORD.size  # 32
+HEADER = struct.Struct('<8sII')  # magic, record size, reserved
+MAGIC = b'CHESSPOS'
+
+FEN_LETTERS = 'PNBRQKpnbrqk'  # By Piece.index
+MAX_PIECES = 32
+WRITE_BATCH = 10_000  # Records packed before each write
+
+
+PLACEMENT = struct.Struct('<Q16sB')  # The leading fields of RECORD
+
+
+def _placement_fields(board):
+    occupied = board.occupancy[0] | board.occupancy[1]
+    if occupied.bit_count() > MAX_PIECES:
+        raise ValueError(f"Can't pack more than {MAX_PIECES} pieces")
+    codes = 0
+    shift = 0
+    rows = board.board
+    for sq in iter_bits(occupied):
+        codes |= rows[sq >> 3][sq & 7].index << shift
+        shift += 4
+
+    flags = board.castling_rights << 1 | (board.turn == 'black')
+    return occupied, codes.to_bytes(16, 'little'), flags
+
+
+def encode_placement(board):
+    """The first 25 bytes of encode(board): the pieces, side to move and castling rights, which identify
+    a position whatever its move counters. Raises ValueError for more than 32 pieces."""
+    return PLACEMENT.pack(*_placement_fields(board))
+
+
+def encode(board):
+    """The position as 32 bytes. Raises ValueError for positions that don't fit: more than 32 pieces,
+    a halfmove clock over 255 or a fullmove number over 65535."""
+    occupied, codes, flags = _placement_fields(board)
+    en_passant = 0 if board.en_passant_target is None else ord(board.en_passant_target[0]) - 96
+    if not 0 <= board.halfmove_clock <= 255 or not 0 <= board.fullmove_number <= 0xFFFF:
+        raise ValueError("Move counters too large to pack")
+    return RECORD.pack(occupied, codes, flags, en_passant, board.halfmove_clock, board.fullmove_number)
+
+
+def decode_fen(data, offset=0):
+    """The FEN of a packed position at offset in data (bytes, an mmap, ...)."""
+    occupied, codes, flags, en_passant, halfmove_clock, fullmove_number = RECORD.unpack_from(data, offset)
+    codes = int.from_bytes(codes, 'little')
+
+    letters = ['1'] * 64
+    for sq in iter_bits(occupied):
+        letters[sq] = FEN_LETTERS[codes & 15]
+        codes >>= 4
+    rows = []
+    for row in range(0, 64, 8):
+        text = ''.join(letters[row:row + 8])
+        for run in range(8, 1, -1):
+            text = text.replace('1' * run, str(run))
+        rows.append(text)
+
+    black = flags & 1
+    castling = ''.join(letter for letter, right in CASTLING_LETTERS if flags >> 1 & right) or '-'
+    target = '-' if not en_passant else chr(96 + en_passant) + ('3' if black else '6')
+    return f"{'/'.join(rows)} {'b' if black else 'w'} {castling} {target} {halfmove_clock} {fullmove_number}"
+
+
+def unpack_bitboards(data, offset=0):
+    """The 12 piece bitboards (by Piece.index) of a packed position, without building a Board."""
+    occupied, codes = RECORD.unpack_from(data, offset)[:2]
+    codes = int.from_bytes(codes, 'little')
+    bitboards = [0] * 12
+    while occupied:
+        lsb = occupied & -occupied
+        bitboards[codes & 15] |= lsb
+        codes >>= 4
+        occupied ^= lsb
+    return bitboards
+
+
+def decode(data, offset=0):
+    """A Board of the packed position at offset in data."""
+    return Board(decode_fen(data, offset))
+
+
+class PositionStore:
+    """An append-only file of packed positions, read by index through a memory map.
+
+    Readers see records appended by this object at once, and those appended by other processes
+    after refresh(). A record cut short by a crash is dropped when the file is next opened for
+    writing.
+    """
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            if not writable:
+                raise FileNotFoundError(f"No position store at {path}")
+            with open(path, 'wb') as file:
+                file.write(HEADER.pack(MAGIC, RECORD_SIZE, 0))
+
+        self._file = open(path, 'r+b' if writable else 'rb')
+        magic, record_size, _ = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC or record_size != RECORD_SIZE:
+            self._file.close()
+            raise ValueError(f"{path} is not a position store")
+        if writable:
+            size = os.fstat(self._file.fileno()).st_size
+            self._file.truncate(size - (size - HEADER.size) % RECORD_SIZE)  # Drop a torn last record
+            self._file.seek(0, os.SEEK_END)
+        self._data = None
+        self._count = 0
+        self.refresh()
+
+    def refresh(self):
+        """Map the file again to see records appended since it was opened."""
+        if self._data is not None:
+            self._data.close()
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._count = (len(self._data) - HEADER.size) // RECORD_SIZE
+
+    def __len__(self):
+        return self._count
+
+    def _offset(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(f"position {index} out of range")
+        return HEADER.size + index * RECORD_SIZE
+
+    def __getitem__(self, index):
+        """The packed position with the given index, as bytes."""
+        offset = self._offset(index)
+        return self._data[offset:offset + RECORD_SIZE]
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def fen(self, index):
+        return decode_fen(self._data, self._offset(index))
+
+    def board(self, index):
+        return decode(self._data, self._offset(index))
+
+    def append(self, board):
+        """Add a position at the end and return its index."""
+        return self.extend([board])
+
+    def extend(self, boards):
+        """Add positions at the end and return the index of the first. Boards are packed as they come,
+        so an iterable that changes one Board in place between positions works."""
+        if not self.writable:
+            raise ValueError(f"{self.path} was opened read-only")
+        first = self._count
+        batch = []
+        try:
+            for board in boards:
+                batch.append(encode(board))
+                if len(batch) == WRITE_BATCH:
+                    self._file.write(b''.join(batch))
+                    batch = []
+            self._file.write(b''.join(batch))
+        except BaseException:
+            # Take back the batches already written, so the store is as it was
+            self._file.flush()
+            self.refresh()
+            self.truncate(first)
+            raise
+        self._file.flush()
+        self.refresh()
+        return first
+
+    def extend_packed(self, records):
+        """Add positions packed by encode, given as one bytes object, and return the index of the first."""
+        if not self.writable:
+            raise ValueError(f"{self.path} was opened read-only")
+        if len(records) % RECORD_SIZE:
+            raise ValueError(f"Packed positions come in multiples of {RECORD_SIZE} bytes")
+        first = self._count
+        self._file.write(records)
+        self._file.flush()
+        self.refresh()
+        return first
+
+    def truncate(self, count):
+        """Drop the positions from index count on, e.g. ones written by an update that didn't finish."""
+        if not self.writable:
+            raise ValueError(f"{self.path} was opened read-only")
+        if count < self._count:
+            self._data.close()
+            self._data = None
+            self._file.truncate(HEADER.size + count * RECORD_SIZE)
+            self._file.seek(0, os.SEEK_END)
+            self.refresh()
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _pgn_positions(path, limit=None):
+    """Every position of the games in a PGN file, as Boards that are changed in place between yields."""
+    from pgn import read_games, push_san
+
+    with open(path, encoding='utf-8', errors='replace') as stream:
+        for number, game in enumerate(read_games(stream)):
+            if limit is not None and number >= limit:
+                break
+            board = Board(game.fen)
+            yield board
+            for san in game.moves:
+                try:
+                    push_san(board, san)
+                except ValueError:
+                    break
+                yield board
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add positions to a packed position store or show some of them.")
+    parser.add_argument('path', help="position store file, created if needed")
+    parser.add_argument('--add', metavar='PGN', help="append every position of the games in this PGN file")
+    parser.add_argument('--limit', type=int, help="games to take from the PGN file")
+    parser.add_argument('--show', nargs='*', type=int, default=[], metavar='INDEX', help="print these positions")
+    args = parser.parse_args(argv)
+
+    with PositionStore(args.path, writable=bool(args.add)) as store:
+        if args.add:
+            start = time.perf_counter()
+            first = store.extend(_pgn_positions(args.add, args.limit))
+            added = len(store) - first
+            elapsed = time.perf_counter() - start
+            print(f"added {added} positions in {elapsed:.2f}s, {len(store)} in the store, "
+                  f"{os.path.getsize(args.path):,} bytes")
+        for index in args.show:
+            print(f"{index}: {store.fen(index)}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""Retrograde analysis of king and one or two pieces against a lone king, for tablebase.py.
+
+A position is indexed by the squares of the white king, the black king and every white piece
+but the last ("array" axes of a NumPy array), while the last piece's square is a bit of the
+uint64 stored there. The same bitboard shifts the rules use then move that piece for 64
+positions at a time, and only the kings and the first piece are moved square by square.
+
+Starting from the checkmates, generate alternates between the side to move: white positions
+that have a move to a black position lost in n plies are won in n + 1, and black positions
+whose every move reaches a white win are lost. White is always the side with the pieces;
+tablebase.py flips the board when it is black.
+"""
+
+from itertools import product
+
+import numpy as np
+
+from bitboard import *
+
+SLIDER_DIRECTIONS = {'B': BISHOP_DIRECTIONS, 'R': ROOK_DIRECTIONS, 'Q': QUEEN_DIRECTIONS}
+LAST_SQUARES = {'P': FULL & ~PROMOTION_RANKS}  # Where the last piece can stand, anywhere unless listed
+PROMOTIONS = ('Q', 'R')  # Knights and bishops can't mate alone, they draw like a captured pawn
+
+SECOND_RANK = 0xFF << 48
+FOURTH_RANK = 0xFF << 32
+SEVENTH_RANK = 0xFF << 8
+
+
+def _column_mask(col_step):
+    """Columns a bitboard shift by col_step can land on without wrapping around the board."""
+    return sum(FILE_A << col for col in range(8) if 0 <= col - col_step < 8)
+
+
+def _shift(bbs, row_step, col_step):
+    """Move every bit of every bitboard by (row_step, col_step), dropping the ones that leave the board."""
+    amount = row_step * 8 + col_step
+    bbs = bbs << np.uint64(amount) if amount > 0 else bbs >> np.uint64(-amount)
+    return bbs & np.uint64(_column_mask(col_step)) if col_step else bbs
+
+
+def attacks(piece_type, sq, occupied):
+    """Squares a white piece on sq attacks."""
+    if piece_type == 'N':
+        return KNIGHT_ATTACKS[sq]
+    if piece_type == 'K':
+        return KING_ATTACKS[sq]
+    if piece_type == 'P':
+        return PAWN_ATTACKS[WHITE][sq]
+    if piece_type == 'B':
+        return bishop_attacks(sq, occupied)
+    if piece_type == 'R':
+        return rook_attacks(sq, occupied)
+    return queen_attacks(sq, occupied)
+
+
+def attackers(piece_type, sq, occupied):
+    """Squares from which a white piece of the type would attack sq."""
+    if piece_type == 'P':
+        return PAWN_ATTACKS[BLACK][sq]
+    return attacks(piece_type, sq, occupied)  # The rest attack the same way in both directions
+
+
+def between(start, end):
+    """Squares strictly between two squares on a common line, 0 when they aren't on one."""
+    (start_row, start_col), (end_row, end_col) = divmod(start, 8), divmod(end, 8)
+    if start_row == end_row or start_col == end_col:
+        return rook_attacks(start, 1 << end) & rook_attacks(end, 1 << start)
+    if start_row - start_col == end_row - end_col or start_row + start_col == end_row + end_col:
+        return bishop_attacks(start, 1 << end) & bishop_attacks(end, 1 << start)
+    return 0
+
+
+def _moves(piece_type):
+    """(start, end, squares passed over) of every move of a piece on an empty board."""
+    return [(start, end, between(start, end)) for start in range(64)
+            for end in iter_bits(attacks(piece_type, start, 1 << start))]
+
+
+def _bits(bbs):
+    """Bitboard arrays as one bool per square, the square as a new last axis."""
+    as_bytes = np.ascontiguousarray(bbs, dtype='<u8').view(np.uint8)
+    return np.unpackbits(as_bytes, bitorder='little').reshape(bbs.shape + (64,)).view(bool)
+
+
+def _at(array, axis, index):
+    """The slice of array with the given axis fixed at index."""
+    return array[(slice(None),) * axis + (index,)]
+
+
+class _Ending:
+    """Everything about an ending that doesn't change while it is solved."""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.array_pieces = pieces[:-1]  # On axes 2, 3, ... after the two kings
+        self.last = pieces[-1]
+        self.shape = (64,) * (2 + len(self.array_pieces))
+        if 'P' in self.array_pieces:
+            raise ValueError("Only the last piece of an ending can be a pawn")
+
+        size = 64 ** len(self.shape)
+        occupied = np.zeros(size, dtype=np.uint64)
+        base = np.zeros(size, dtype=np.uint64)
+        check = np.zeros(size, dtype=np.uint64)
+        safe_capture = np.zeros(size, dtype=np.uint64)
+        for i, squares in enumerate(product(range(64), repeat=len(self.shape))):
+            occupied[i], base[i], check[i], safe_capture[i] = self._analyse(squares)
+
+        self.occupied = occupied.reshape(self.shape)  # Squares of the kings and array pieces
+        self.base = base.reshape(self.shape)  # Legal with black to move
+        self.check = check.reshape(self.shape)  # Black king attacked
+        self.safe_capture = safe_capture.reshape(self.shape)  # Black to move can take a piece and draw
+        self.white_valid = self.base & ~self.check  # Legal with white to move
+
+    def _analyse(self, squares):
+        white_king, black_king, *array_squares = squares
+        occupied = 0
+        for sq in squares:
+            occupied |= 1 << sq
+        if occupied.bit_count() < len(squares) or KING_ATTACKS[white_king] >> black_king & 1:
+            return occupied, 0, 0, 0
+        base = LAST_SQUARES.get(self.last, FULL) & ~occupied
+
+        check = attackers(self.last, black_king, occupied)
+        for piece_type, sq in zip(self.array_pieces, array_squares):
+            check |= self._attacks_with_last(piece_type, sq, black_king, occupied)
+        check &= base
+
+        # The black king takes a piece next to it; a draw unless something defends it
+        after = occupied & ~(1 << black_king)
+        safe_capture = 0
+        for j, (piece_type, sq) in enumerate(zip(self.array_pieces, array_squares)):
+            if not KING_ATTACKS[black_king] >> sq & 1 or KING_ATTACKS[white_king] >> sq & 1:
+                continue
+            defended = attackers(self.last, sq, after)
+            for k, (other_type, other_sq) in enumerate(zip(self.array_pieces, array_squares)):
+                if k != j:
+                    defended |= self._attacks_with_last(other_type, other_sq, sq, after)
+            safe_capture |= base & ~defended
+        for sq in iter_bits(KING_ATTACKS[black_king] & ~KING_ATTACKS[white_king] & base):
+            if not any(attacks(piece_type, piece_sq, after | 1 << sq) >> sq & 1
+                       for piece_type, piece_sq in zip(self.array_pieces, array_squares)):
+                safe_capture |= 1 << sq
+
+        return occupied, base, check, safe_capture
+
+    def _attacks_with_last(self, piece_type, sq, target, occupied):
+        """Last piece squares for which a white array piece on sq attacks target: all of them or none,
+        except that the last piece can stand in a slider's way."""
+        if not attacks(piece_type, sq, occupied) >> target & 1:
+            return 0
+        return FULL & ~between(sq, target) if piece_type in SLIDER_DIRECTIONS else FULL
+
+    def white_predecessors(self, lost):
+        """White positions (bitboard array) with a move to one of the given black positions."""
+        result = np.zeros_like(lost)
+        empty = ~self.occupied
+
+        # The last piece moves in every position at once
+        if self.last == 'N':
+            for row_step, col_step in KNIGHT_OFFSETS:
+                result |= _shift(lost, row_step, col_step)
+        elif self.last == 'P':
+            result |= lost << np.uint64(8)
+            result |= ((lost & np.uint64(FOURTH_RANK)) << np.uint64(8) & empty) << np.uint64(8)
+        else:
+            for row_step, col_step in SLIDER_DIRECTIONS[self.last]:
+                reach = lost
+                for _ in range(7):
+                    reach = _shift(reach, -row_step, -col_step)
+                    result |= reach
+                    reach &= empty
+
+        # The king and the array pieces move one square at a time
+        for axis, piece_type in [(0, 'K')] + [(2 + i, piece_type) for i, piece_type in enumerate(self.array_pieces)]:
+            for start, end, passed in _moves(piece_type):
+                targets = _at(lost, axis, end)
+                if passed:
+                    targets = np.where(self._clear(axis, passed), targets & np.uint64(FULL & ~passed), 0)
+                _at(result, axis, start)[...] |= targets
+
+        return result
+
+    def _clear(self, axis, passed):
+        """Whether the pieces on every axis but axis are off the passed squares, broadcast over those axes."""
+        axes = len(self.shape) - 1
+        clear = np.ones((64,) * axes, dtype=bool)
+        off_path = np.array([not passed >> sq & 1 for sq in range(64)])
+        for i in range(axes):
+            clear &= off_path.reshape(tuple(64 if j == i else 1 for j in range(axes)))
+        return clear
+
+    def black_escapes(self, safe):
+        """Black positions with a king move to one of the given white positions."""
+        result = np.zeros_like(safe)
+        for start, end, _ in _moves('K'):
+            _at(result, 1, start)[...] |= _at(safe, 1, end)
+        return result
+
+
+def generate(pieces, solved=None, report=None):
+    """Solve white king and pieces (e.g. 'BN') against a lone black king.
+
+    Returns (white_to_move, black_to_move) uint8 arrays of shape (64,) * (len(pieces) + 2), indexed
+    by the white king, black king and piece squares, holding 0 for a draw, 255 for an illegal
+    position and otherwise 1 + the number of plies until mate. solved holds the results of
+    endings a pawn can promote into, by their pieces.
+    """
+    ending = _Ending(pieces)
+    shape = ending.shape + (64,)
+    white_plies = np.zeros(shape, dtype=np.uint8)  # 1 + plies to mate, 0 while unknown
+    black_plies = np.zeros(shape, dtype=np.uint8)
+
+    has_move = ending.black_escapes(ending.white_valid)
+    lost = ending.base & ending.check & ~has_move & ~ending.safe_capture
+    black_plies[_bits(lost)] = 1
+    black_lost = lost
+    white_won = np.zeros_like(lost)
+    # Black can move and hasn't got a drawing capture; only these can still turn out lost
+    undecided = ending.base & (has_move & ~ending.safe_capture)
+
+    promotion_plies = _promotions(ending, solved) if ending.last == 'P' else None
+    last_promotion = int(promotion_plies[promotion_plies < 255].max(initial=0)) if promotion_plies is not None else 0
+
+    ply = 0
+    while True:
+        ply += 1
+        won = ending.white_predecessors(lost) & ending.white_valid & ~white_won
+        if promotion_plies is not None:
+            won |= _pack(promotion_plies == ply) & ending.white_valid & ~white_won
+        white_won |= won
+        white_plies[_bits(won)] = ply + 1
+
+        ply += 1
+        lost = undecided & ~black_lost & ~ending.black_escapes(ending.white_valid & ~white_won)
+        black_lost |= lost
+        black_plies[_bits(lost)] = ply + 1
+
+        if report is not None:
+            report(ply, int(_bits(white_won).sum()), int(_bits(black_lost).sum()))
+        if not lost.any() and not won.any() and ply > last_promotion:
+            break
+
+    white_plies[~_bits(ending.white_valid)] = 255
+    black_plies[~_bits(ending.base)] = 255
+    return white_plies, black_plies
+
+
+def _pack(bools):
+    """Inverse of _bits."""
+    packed = np.packbits(bools, axis=-1, bitorder='little')
+    return np.ascontiguousarray(packed).view('<u8').reshape(bools.shape[:-1]).astype(np.uint64)
+
+
+def _promotions(ending, solved):
+    """Plies to mate through the pawn's best promotion for every white position, 255 where no promotion wins."""
+    plies = np.full(ending.shape + (64,), 255, dtype=np.uint8)
+    for sq in iter_bits(SEVENTH_RANK):
+        end = sq - 8
+        for piece_type in PROMOTIONS:
+            if piece_type not in solved:
+                raise ValueError(f"Solve K{piece_type}K before the pawn ending")
+            _, black_to_move = solved[piece_type]
+            # The new piece stands on end, the last axis of the solved ending. Black is lost there in
+            # after - 1 plies, so promoting mates in after plies
+            after = black_to_move[..., end]
+            blocked = (ending.occupied >> np.uint64(end) & np.uint64(1)).astype(bool)
+            wins = (after > 0) & (after < 255) & ~blocked
+            plies[..., sq] = np.where(wins, np.minimum(plies[..., sq], after), plies[..., sq])
+
+    return plies
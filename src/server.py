@@ -0,0 +1,405 @@
+"""Game server: many independent games played over TCP, one JSON object per line.
+
+Moves are checked with the same rules as the GUI. Players draw and resign the way chess_cli.py
+lets them: either side can offer a draw, which the other side accepts or declines (or declines
+by moving), and either side can resign.
+
+An idle game is only a few hundred bytes: its FEN, the Zobrist keys since the last capture or
+pawn move (for threefold repetition) and its moves packed two bytes each. Boards, several
+kilobytes each, are only built for the games being played, and the last ACTIVE_BOARDS of them
+are kept around so a game in progress doesn't rebuild its board on every move.
+
+Requests and replies, "id" is optional and echoed back:
+
+    {"op": "new", "fen": "<fen>"}                   -> {"ok": true, "game": 1, "fen": ...}
+    {"op": "join", "game": 1, "color": "white"}     -> moves of that color are accepted from this connection
+    {"op": "move", "game": 1, "move": "e2e4"}       -> {"ok": true, "fen": ..., "status": "ongoing", ...}
+    {"op": "draw", "game": 1, "color": "white"}     -> offer a draw, or accept the opponent's offer
+    {"op": "decline", "game": 1, "color": "black"}
+    {"op": "resign", "game": 1, "color": "black"}
+    {"op": "state", "game": 1}
+    {"op": "stats"}                                 -> games, moves, validation latency percentiles
+
+Failures come back as {"ok": false, "error": "..."}. Every change to a game is also sent to its
+joined connections as {"event": "update", "game": 1, ...}.
+
+    python server.py --port 8765
+    python loadgen.py games.pgn --port 8765
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from array import array
+from collections import OrderedDict, deque
+
+try:
+    import resource
+except ImportError:  # Not on Windows
+    resource = None
+
+from board import Board, Move, ONGOING, STARTING_FEN
+from bitboard import *
+
+logger = logging.getLogger(__name__)
+
+PORT = 8765
+ACTIVE_BOARDS = 1024  # Boards kept built for the most recently played games
+LATENCY_SAMPLES = 100_000  # Validation times kept for the latency percentiles
+MAX_LINE = 4096  # Longest request accepted
+
+RESIGNED = 'resigned'
+DRAW_AGREED = 'draw agreed'
+COLORS = ('white', 'black')
+PROMOTION_CODES = ' QRBN'  # Promotion piece of a packed move, bits 12-14
+
+
+def pack_move(move):
+    return move.start | move.end << 6 | PROMOTION_CODES.index(move.promotion or ' ') << 12
+
+
+def unpack_move(packed):
+    code = packed >> 12
+    return Move(packed & 63, packed >> 6 & 63, PROMOTION_CODES[code] if code else None)
+
+
+class Game:
+    """What the server remembers about a game between moves."""
+
+    __slots__ = ('fen', 'start_fen', 'keys', 'moves', 'status', 'result', 'draw_offer', 'players')
+
+    def __init__(self, fen, key):
+        self.fen = fen  # Current position
+        self.start_fen = fen
+        self.keys = array('Q', [key])  # Zobrist keys of the positions since the last capture or pawn move
+        self.moves = array('H')  # Packed moves, see pack_move
+        self.status = ONGOING  # A Board.game_status state, RESIGNED or DRAW_AGREED
+        self.result = '*'
+        self.draw_offer = None  # Color that offered a draw
+        self.players = None  # [white connection, black connection] once someone joined
+
+    def summary(self):
+        return {'fen': self.fen, 'status': self.status, 'result': self.result, 'draw_offer': self.draw_offer}
+
+
+class GameServer:
+    """The games and the rules on them, without the networking, so it can be driven directly."""
+
+    def __init__(self, active_boards=ACTIVE_BOARDS):
+        self.games = {}
+        self._next_id = 1
+        self._boards = OrderedDict()  # game id -> Board of the position, least recently used first
+        self.active_boards = active_boards
+        self.moves_played = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # Seconds per move validated
+
+    def new_game(self, fen=None):
+        """Start a game and return its id. Raises ValueError for a bad FEN."""
+        board = Board(fen or STARTING_FEN)
+        if board.king_squares[0] is None or board.king_squares[1] is None:
+            raise ValueError("Both sides need a king")
+        game_id = self._next_id
+        self._next_id += 1
+        self.games[game_id] = Game(board.to_fen(), board.zobrist_key)
+        status = board.game_status()
+        if status.status != ONGOING:
+            self.games[game_id].status, self.games[game_id].result = status
+        return game_id  # Not one of the active boards yet: many games are started and never played
+
+    def game(self, game_id):
+        game = self.games.get(game_id) if isinstance(game_id, int) else None
+        if game is None:
+            raise ValueError(f"No game {game_id!r}")
+        return game
+
+    def _keep_board(self, game_id, board):
+        self._boards[game_id] = board
+        self._boards.move_to_end(game_id)
+        if len(self._boards) > self.active_boards:
+            self._boards.popitem(last=False)
+
+    def _board(self, game_id, game):
+        """The game's Board, rebuilt from its FEN and repetition keys if it isn't one of the active ones."""
+        board = self._boards.get(game_id)
+        if board is None:
+            board = Board(game.fen)
+            counts = {}
+            for key in game.keys:
+                counts[key] = counts.get(key, 0) + 1
+            board.position_counts = counts
+        self._keep_board(game_id, board)
+        return board
+
+    def play(self, game_id, text, color=None):
+        """Play a move given in UCI. color, when given, must be the side to move. Raises ValueError if the move
+        is refused, leaving the game as it was."""
+        started = time.perf_counter()
+        game = self.game(game_id)
+        if game.status != ONGOING:
+            raise ValueError(f"The game is over ({game.status})")
+        board = self._board(game_id, game)
+        if color is not None and color != board.turn:
+            raise ValueError(f"It's {board.turn}'s turn")
+        move = _parse_move(board, text)
+
+        board.make_move(move)
+        game.fen = board.to_fen()
+        if board.halfmove_clock == 0:
+            del game.keys[:]
+        game.keys.append(board.zobrist_key)
+        game.moves.append(pack_move(move))
+        game.draw_offer = None  # Moving declines an offer, and withdraws your own
+        status = board.game_status()
+        if status.status != ONGOING:
+            game.status, game.result = status
+            self._boards.pop(game_id, None)
+
+        self.moves_played += 1
+        self.latencies.append(time.perf_counter() - started)
+        return move
+
+    def offer_draw(self, game_id, color):
+        """Offer a draw as color, or agree to one if the opponent offered it. Returns True when the game is drawn."""
+        game = self._ongoing(game_id)
+        if game.draw_offer is not None and game.draw_offer != color:
+            self._finish(game_id, game, DRAW_AGREED, '1/2-1/2')
+            return True
+        game.draw_offer = color
+        return False
+
+    def decline_draw(self, game_id, color):
+        game = self._ongoing(game_id)
+        if game.draw_offer is None or game.draw_offer == color:
+            raise ValueError("There is no draw offer to decline")
+        game.draw_offer = None
+
+    def resign(self, game_id, color):
+        game = self._ongoing(game_id)
+        self._finish(game_id, game, RESIGNED, '0-1' if color == 'white' else '1-0')
+
+    def _ongoing(self, game_id):
+        game = self.game(game_id)
+        if game.status != ONGOING:
+            raise ValueError(f"The game is over ({game.status})")
+        return game
+
+    def _finish(self, game_id, game, status, result):
+        game.status, game.result = status, result
+        game.draw_offer = None
+        self._boards.pop(game_id, None)
+
+    def history(self, game_id):
+        """The game's moves in UCI."""
+        return [unpack_move(packed).uci() for packed in self.game(game_id).moves]
+
+    def stats(self):
+        """Games, moves played and move validation latency percentiles in microseconds."""
+        latencies = sorted(self.latencies)
+        stats = {'games': len(self.games), 'active_boards': len(self._boards), 'moves': self.moves_played}
+        if resource is not None:
+            stats['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux counts in KiB
+        for name, fraction in (('p50_us', 0.5), ('p99_us', 0.99), ('max_us', 1.0)):
+            if latencies:
+                stats[name] = latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1e6
+        return stats
+
+
+def _parse_move(board, text):
+    """The Move for a UCI string if it is legal for the side to move, else ValueError."""
+    try:
+        move = Move.from_uci(text)
+    except (KeyError, TypeError):
+        raise ValueError(f"Not a move: {text!r}") from None
+    start, end, promotion = move
+
+    piece = board.board[start >> 3][start & 7]
+    if piece == ' ' or piece.color != board.turn or not piece.targets(board) >> end & 1:
+        raise ValueError(f"Illegal move {text}")
+    if piece.piece_type == PAWN and PROMOTION_RANKS >> end & 1:
+        if promotion is None:
+            promotion = 'Q'  # Like the GUI, promote to a queen unless told otherwise
+        elif promotion not in 'QRBN':
+            raise ValueError(f"Can't promote to {promotion!r}")
+        move = Move(start, end, promotion)
+    elif promotion is not None:
+        raise ValueError(f"Illegal move {text}: not a promotion")
+    if not board.is_legal(move):
+        raise ValueError(f"Illegal move {text}: the king would be in check")
+
+    return move
+
+
+class Connection:
+    """One client: the games and colors it joined, and a way to send it lines."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.joined = {}  # game id -> set of colors
+
+    def send(self, message):
+        if not self.writer.is_closing():
+            self.writer.write(json.dumps(message).encode() + b'\n')
+
+
+class Protocol:
+    """Serves a GameServer over asyncio streams."""
+
+    def __init__(self, games=None):
+        self.games = games or GameServer()
+
+    async def handle(self, reader, writer):
+        connection = Connection(writer)
+        try:
+            while True:
+                request = None
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break  # Line too long or connection reset
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("A request is a JSON object")
+                    reply = self.dispatch(connection, request)
+                except Exception as error:
+                    if not isinstance(error, ValueError):
+                        # A bug, but one request must not cost the client its connection
+                        logger.exception("Failed to handle %r", request)
+                        error = "Internal error handling the request"
+                    reply = {'ok': False, 'error': str(error)}
+                    if isinstance(request, dict) and 'id' in request:
+                        reply['id'] = request['id']
+                connection.send(reply)
+                await writer.drain()
+        finally:
+            self._leave(connection)
+            writer.close()
+
+    def dispatch(self, connection, request):
+        """Carry out a request and return the reply. Raises ValueError for a bad one."""
+        op = request.get('op')
+        games = self.games
+        reply = {'ok': True}
+        if 'id' in request:
+            reply['id'] = request['id']
+
+        if op == 'stats':
+            reply.update(games.stats())
+            return reply
+        if op == 'new':
+            game_id = games.new_game(_text(request, 'fen', optional=True))
+            reply['game'] = game_id
+            reply.update(games.game(game_id).summary())
+            return reply
+
+        game_id = request.get('game')
+        game = games.game(game_id)
+        if op == 'state':
+            reply.update(game.summary())
+            reply['start_fen'] = game.start_fen
+            reply['moves'] = games.history(game_id)
+            return reply
+
+        if op == 'join':
+            color = _color(request)
+            if game.players is None:
+                game.players = [None, None]
+            current = game.players[COLOR_INDEX[color]]
+            if current is not None and current is not connection:
+                raise ValueError(f"{color.capitalize()} is already taken in game {game_id}")
+            game.players[COLOR_INDEX[color]] = connection
+            connection.joined.setdefault(game_id, set()).add(color)
+            reply.update(game.summary())
+            return reply
+
+        if op == 'move':
+            turn = 'white' if game.fen.split()[1] == 'w' else 'black'
+            self._check_player(connection, game_id, turn)
+            move = games.play(game_id, _text(request, 'move'), turn)
+            update = {'move': move.uci()}
+        elif op == 'draw':
+            color = self._check_player(connection, game_id, _color(request))
+            update = {'draw_offered_by': color} if not games.offer_draw(game_id, color) else {}
+        elif op == 'decline':
+            games.decline_draw(game_id, self._check_player(connection, game_id, _color(request)))
+            update = {'draw_declined': True}
+        elif op == 'resign':
+            color = self._check_player(connection, game_id, _color(request))
+            games.resign(game_id, color)
+            update = {'resigned': color}
+        else:
+            raise ValueError(f"Unknown op {op!r}")
+
+        update.update(game.summary())
+        reply.update(update)
+        self._broadcast(connection, game_id, game, update)
+        return reply
+
+    def _check_player(self, connection, game_id, color):
+        if color not in connection.joined.get(game_id, ()):
+            raise ValueError(f"Join game {game_id} as {color} first")
+        return color
+
+    def _broadcast(self, sender, game_id, game, update):
+        """Tell the other players of the game what changed."""
+        for connection in set(game.players or ()):
+            if connection is not None and connection is not sender:
+                connection.send({'event': 'update', 'game': game_id, **update})
+
+    def _leave(self, connection):
+        for game_id in connection.joined:
+            game = self.games.games.get(game_id)
+            if game is not None and game.players is not None:
+                game.players = [None if player is connection else player for player in game.players]
+                if game.players == [None, None]:
+                    game.players = None
+
+
+def _text(request, field, optional=False):
+    """A string field of a request."""
+    value = request.get(field)
+    if value is None and optional:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{field} must be a string")
+    return value
+
+
+def _color(request):
+    color = request.get('color')
+    if color not in COLORS:
+        raise ValueError("color must be 'white' or 'black'")
+    return color
+
+
+async def serve(host='127.0.0.1', port=PORT, active_boards=ACTIVE_BOARDS):
+    protocol = Protocol(GameServer(active_boards))
+    server = await asyncio.start_server(protocol.handle, host, port, limit=MAX_LINE)
+    logger.info("Serving games on %s", ', '.join(str(sock.getsockname()) for sock in server.sockets))
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host chess games for clients over TCP (JSON lines).")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--active-boards', type=int, default=ACTIVE_BOARDS,
+                        help="boards kept built for the games played most recently")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.active_boards))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import pygame
+
+from piece import PIECE_CLASSES
+
+
+PIECE_NAMES = {'K': 'king', 'Q': 'queen', 'R': 'rook', 'B': 'bishop', 'N': 'knight', 'P': 'pawn'}
+
+
+def scale_image(image, square_size, margin=5):
+    # Calculate effective size by subtracting the margin
+    effective_size = square_size - 2 * margin
+
+    # Get original image dimensions
+    original_width, original_height = image.get_size()
+
+    # Determine scaling factor to fit the image within the effective size
+    scaling_factor = min(effective_size / original_width, effective_size / original_height)
+
+    # Calculate new dimensions
+    new_width = int(original_width * scaling_factor)
+    new_height = int(original_height * scaling_factor)
+
+    # Scale the image
+    return pygame.transform.scale(image, (new_width, new_height)), margin
+
+
+class SpriteCache:
+    """Piece sprites, decoded from disk once and scaled once for each square size they are drawn at."""
+
+    def __init__(self, directory='./assets/chess-pieces', margin=10):
+        self.directory = directory
+        self.margin = margin
+        self._originals = {}  # (color, symbol) -> surface as loaded
+        self._scaled = {}  # (color, symbol, square_size) -> surface ready to blit
+
+    def _original(self, color, symbol):
+        image = self._originals.get((color, symbol))
+        if image is None:
+            image = pygame.image.load(f'{self.directory}/{color[0]}_{PIECE_NAMES[symbol]}_png_128px.png')
+            # Match the display's pixel format so blits don't convert on every frame (needs a display mode set)
+            if pygame.display.get_surface() is not None:
+                image = image.convert_alpha()
+            self._originals[(color, symbol)] = image
+
+        return image
+
+    def get(self, color, symbol, square_size):
+        """The sprite for a piece, scaled to fit a square of the given size."""
+        key = (color, symbol, square_size)
+        image = self._scaled.get(key)
+        if image is None:
+            image, _ = scale_image(self._original(color, symbol), square_size, self.margin)
+            if pygame.display.get_surface() is not None:
+                image = image.convert_alpha()
+            self._scaled[key] = image
+
+        return image
+
+    def preload(self, square_size):
+        """Decode and scale every sprite up front, so the first frames don't stall on disk reads."""
+        for color in ('white', 'black'):
+            for symbol in PIECE_CLASSES:
+                self.get(color, symbol, square_size)
+
+    def drop_sizes(self, keep=None):
+        """Forget scaled sprites of every square size except keep, e.g. after the window is resized."""
+        self._scaled = {key: image for key, image in self._scaled.items() if key[2] == keep}
@@ -0,0 +1,225 @@
+"""Endgame tablebases: exact results for king and queen, rook, pawn or bishop and knight against a lone king.
+
+Each ending is worked out once by retrograde analysis (see retrograde.py) and saved as a file
+of one byte per position, 0 for a draw, 255 for an illegal position and otherwise 1 + the
+number of plies until mate. Positions are folded onto the stronger side's king standing on
+one eighth of the board (one half with a pawn), the other placements being mirror images.
+Tablebases memory-maps the files, so probing is one lookup in the page cache, shared by every
+process on the machine that uses the same files.
+
+    python tablebase.py --generate
+    python tablebase.py --probe "8/8/8/4k3/8/8/8/KQ6 w - - 0 1"
+"""
+
+import argparse
+import mmap
+import os
+import sys
+import time
+from collections import namedtuple
+
+from board import Board
+from bitboard import *
+
+ENDINGS = {'KQK': 'Q', 'KRK': 'R', 'KPK': 'P', 'KBNK': 'BN'}  # Name -> the stronger side's pieces besides its king
+ENDING_NAMES = {pieces: name for name, pieces in ENDINGS.items()}
+PIECE_ORDER = 'QRBNP'  # Order of the pieces in ENDINGS
+DIRECTORY = 'tablebases'
+
+DRAW = 0
+ILLEGAL = 255
+
+TablebaseResult = namedtuple('TablebaseResult', ('wdl', 'dtm'))  # wdl: 1 win, 0 draw, -1 loss for the side to move
+
+
+def _transform(sq, flip_col, flip_row, transpose):
+    row, col = divmod(sq, 8)
+    if transpose:
+        row, col = col, row
+    return (7 - row if flip_row else row) * 8 + (7 - col if flip_col else col)
+
+
+# The eight symmetries of the board as square maps. Pawns only allow the first two, mirroring left and right.
+SYMMETRIES = [[_transform(sq, flip_col, flip_row, transpose) for sq in range(64)]
+              for transpose in (False, True) for flip_row in (False, True) for flip_col in (False, True)]
+
+# Squares the stronger king is moved to: a1-d1-d4 without pawns, files a-d with them
+KING_SQUARES = [sq for sq in range(64) if (sq & 7) <= 3 and 7 - (sq >> 3) <= (sq & 7)]
+PAWN_KING_SQUARES = [sq for sq in range(64) if (sq & 7) <= 3]
+
+
+def _folding(king_squares, symmetries):
+    """For every king square, the symmetry that brings it to one of king_squares and the index it gets there."""
+    folding = []
+    for sq in range(64):
+        symmetry = next(symmetry for symmetry in symmetries if symmetry[sq] in king_squares)
+        folding.append((king_squares.index(symmetry[sq]), symmetry))
+    return folding
+
+
+FOLDING = _folding(KING_SQUARES, SYMMETRIES)
+PAWN_FOLDING = _folding(PAWN_KING_SQUARES, SYMMETRIES[:2])
+
+
+def table_size(name):
+    """Positions per side to move in an ending's file."""
+    kings = PAWN_KING_SQUARES if 'P' in ENDINGS[name] else KING_SQUARES
+    return len(kings) * 64 ** (len(ENDINGS[name]) + 1)
+
+
+def material(board):
+    """The ending's name, the stronger side's color index and its pieces' squares (king, then ENDINGS order),
+    or None when the material isn't one of ENDINGS."""
+    for strong in (WHITE, BLACK):
+        weak = 1 - strong
+        if board.occupancy[weak] != board.bitboards[weak * 6 + KING]:
+            continue
+        pieces = ''
+        squares = [lsb_square(board.bitboards[strong * 6 + KING])]
+        for symbol in PIECE_ORDER:
+            for sq in iter_bits(board.bitboards[strong * 6 + PIECE_TYPES.index(symbol)]):
+                pieces += symbol
+                squares.append(sq)
+        name = ENDING_NAMES.get(pieces)
+        if name is not None:
+            return name, strong, squares
+        return None
+
+    return None
+
+
+class Tablebases:
+    def __init__(self, directory=DIRECTORY):
+        """Map every ending file found in the directory; endings without one are simply not probed."""
+        self.directory = directory
+        self._tables = {}
+        for name in ENDINGS:
+            path = os.path.join(directory, f'{name}.tb')
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as file:
+                table = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(table) != 2 * table_size(name):
+                table.close()
+                raise ValueError(f"{path} has the wrong size for {name}, regenerate it")
+            self._tables[name] = table
+
+    @property
+    def endings(self):
+        return list(self._tables)
+
+    def close(self):
+        for table in self._tables.values():
+            table.close()
+        self._tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def probe(self, board):
+        """The TablebaseResult of the position, dtm counting plies to mate, or None if no table covers it."""
+        if board.castling_rights or not self._tables:
+            return None
+        found = material(board)
+        if found is None or found[0] not in self._tables:
+            return None
+        name, strong, squares = found
+
+        black_king = lsb_square(board.bitboards[(1 - strong) * 6 + KING])
+        squares.insert(1, black_king)
+        if strong == BLACK:
+            # Tables have the stronger side playing up the board as white
+            squares = [sq ^ 56 for sq in squares]
+        slot, symmetry = (PAWN_FOLDING if 'P' in ENDINGS[name] else FOLDING)[squares[0]]
+        index = slot
+        for sq in squares[1:]:
+            index = index * 64 + symmetry[sq]
+
+        strong_to_move = COLOR_INDEX[board.turn] == strong
+        value = self._tables[name][index if strong_to_move else table_size(name) + index]
+        if value == ILLEGAL:
+            return None
+        if value == DRAW:
+            return TablebaseResult(0, 0)
+        return TablebaseResult(1 if strong_to_move else -1, value - 1)
+
+    def best_move(self, board):
+        """The fastest mate, a draw-keeping move or the longest resistance, with the TablebaseResult of the position;
+        None if the position isn't covered."""
+        result = self.probe(board)
+        if result is None:
+            return None
+
+        best, best_key = None, None
+        for move in board.generate_legal_moves():
+            board.make_move(move)
+            after = self.probe(board)
+            if after is None and board.is_insufficient_material():
+                after = TablebaseResult(0, 0)  # A capture of the last piece that could mate
+            board.unmake_move()
+            if after is None:
+                continue
+            # Our outcome is the opposite of the opponent's; win fast, lose slowly
+            key = (-after.wdl, -after.dtm if after.wdl < 0 else after.dtm)
+            if best_key is None or key > best_key:
+                best, best_key = move, key
+
+        return best, result
+
+
+def generate_files(names=tuple(ENDINGS), directory=DIRECTORY, out=sys.stdout):
+    """Work out the endings and write their files. KPK needs KQK and KRK, which are solved first if missing."""
+    import retrograde  # Generation needs NumPy, probing doesn't
+
+    os.makedirs(directory, exist_ok=True)
+    solved = {}
+    order = [name for name in ENDINGS if name in names or (name in ('KQK', 'KRK') and 'KPK' in names)]
+    for name in order:
+        start = time.perf_counter()
+        pieces = ENDINGS[name]
+        white_to_move, black_to_move = retrograde.generate(pieces, solved)
+        if len(pieces) == 1:
+            solved[pieces] = white_to_move, black_to_move
+
+        kings = PAWN_KING_SQUARES if 'P' in pieces else KING_SQUARES
+        if name in names:
+            path = os.path.join(directory, f'{name}.tb')
+            with open(path, 'wb') as file:
+                file.write(white_to_move[kings].tobytes())
+                file.write(black_to_move[kings].tobytes())
+            wins = ((white_to_move > DRAW) & (white_to_move < ILLEGAL)).sum()
+            legal = (white_to_move < ILLEGAL).sum()
+            longest = int(white_to_move[white_to_move < ILLEGAL].max()) - 1
+            print(f"{name}: {wins}/{legal} won with the stronger side to move, longest mate {longest} plies, "
+                  f"{2 * table_size(name):,} bytes in {time.perf_counter() - start:.1f}s", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate or probe the endgame tablebases.")
+    parser.add_argument('--generate', nargs='*', choices=tuple(ENDINGS), metavar='ENDING',
+                        help=f"work out these endings, all of them ({', '.join(ENDINGS)}) if none are named")
+    parser.add_argument('--probe', metavar='FEN', help="look a position up and print its result and best move")
+    parser.add_argument('--directory', default=DIRECTORY, help="where the tablebase files are")
+    args = parser.parse_args(argv)
+
+    if args.generate is not None:
+        generate_files(args.generate or tuple(ENDINGS), args.directory)
+    if args.probe:
+        board = Board(args.probe)
+        with Tablebases(args.directory) as tablebases:
+            found = tablebases.best_move(board)
+        if found is None:
+            print("Not in the tablebases")
+            return 1
+        move, result = found
+        outcome = {1: f"wins, mate in {result.dtm} plies", 0: "draw", -1: f"loses, mated in {result.dtm} plies"}
+        print(f"{board.turn.capitalize()} to move {outcome[result.wdl]}" + (f", best move {move}" if move else ""))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
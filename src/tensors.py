@@ -0,0 +1,264 @@
+"""Positions as NumPy arrays, for feeding many positions at a time to a neural network.
+
+A position is encoded as PLANES planes of 8x8, indexed [plane, row, col] like Board.board:
+
+    0-11   one plane per piece, in Piece.index order (white PNBRQK, then black pnbrqk)
+    12     all ones when white is to move
+    13-16  all ones for each castling right still held: K, Q, k, q
+    17     a one on the en passant target square
+
+encode_batch fills a preallocated (N, PLANES, 8, 8) array from Boards or FEN strings without
+looping over squares in Python, and decode_batch turns such an array back into FEN strings.
+iter_batches streams a source of any size through one reused array.
+
+    python tensors.py games.pgn --batch-size 4096
+    python tensors.py positions.txt --output features.npy
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from board import Board, CASTLING_LETTERS
+from bitboard import *
+from pgn import read_games, push_san
+
+PIECE_PLANES = 12
+SIDE_PLANE = 12
+CASTLING_PLANES = 13  # First of four, in CASTLING_LETTERS order
+EN_PASSANT_PLANE = 17
+PLANES = 18
+
+FEN_LETTERS = 'PNBRQKpnbrqk'  # FEN letter of each piece plane
+
+
+class _RowTable:
+    """The 12x8 piece planes of every FEN row seen so far, looked up by a small id.
+
+    A FEN placement is then eight ids, and a whole batch of positions is expanded to planes
+    with a single NumPy indexing operation.
+    """
+
+    LIMIT = 200_000  # Rows kept before the table starts over
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ids = {}
+        self.rows = []
+        self._array = None
+
+    def row_id(self, text):
+        row_id = self.ids.get(text)
+        if row_id is None:
+            planes = np.zeros((PIECE_PLANES, 8), dtype=np.uint8)
+            col = 0
+            for char in text:
+                if char in '12345678':
+                    col += int(char)
+                elif char in FEN_LETTERS and col < 8:
+                    planes[FEN_LETTERS.index(char), col] = 1
+                    col += 1
+                else:
+                    raise ValueError(f"Invalid FEN row {text!r}")
+            if col != 8:
+                raise ValueError(f"Invalid FEN row {text!r}")
+            row_id = self.ids[text] = len(self.rows)
+            self.rows.append(planes)
+            self._array = None
+
+        return row_id
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = np.stack(self.rows)
+        return self._array
+
+
+_row_table = _RowTable()
+
+# FEN text of each row of piece codes (0 for empty, plane + 1 for a piece), filled in as rows come up
+_decoded_rows = {}
+
+
+def _decode_row(codes):
+    text = _decoded_rows.get(codes)
+    if text is None:
+        text = ''
+        empty = 0
+        for code in codes:
+            if code == 0:
+                empty += 1
+                continue
+            if empty:
+                text += str(empty)
+                empty = 0
+            text += FEN_LETTERS[code - 1]
+        if empty:
+            text += str(empty)
+        if len(_decoded_rows) > _RowTable.LIMIT:
+            _decoded_rows.clear()
+        _decoded_rows[codes] = text
+
+    return text
+
+
+def encode_batch(positions, out=None, dtype=np.float32):
+    """Encode a sequence of Boards and/or FEN strings into an (N, PLANES, 8, 8) array.
+
+    When out is given it is filled in place (it must have room for every position) and returned.
+    """
+    count = len(positions)
+    if out is None:
+        out = np.zeros((count, PLANES, 8, 8), dtype=dtype)
+    else:
+        out = out[:count]
+        out.fill(0)
+
+    if len(_row_table.rows) > _RowTable.LIMIT:
+        _row_table.clear()
+
+    # Boards carry bitboards, FENs carry row ids; each group is expanded in one go
+    board_indices, bitboards = [], []
+    fen_indices, row_ids = [], []
+    state = np.zeros((count, 3), dtype=np.int64)  # white to move, castling rights, en passant square or -1
+    for i, position in enumerate(positions):
+        if isinstance(position, Board):
+            board_indices.append(i)
+            bitboards.append(position.bitboards)
+            ep = position.en_passant_target
+            state[i] = (position.turn == 'white', position.castling_rights, SQUARE_INDEX[ep] if ep else -1)
+        else:
+            fields = position.split()
+            if len(fields) < 4:
+                raise ValueError(f"Invalid FEN, expected at least 4 fields: {position!r}")
+            rows = fields[0].split('/')
+            if len(rows) != 8:
+                raise ValueError(f"Invalid FEN, expected 8 rows: {position!r}")
+            fen_indices.append(i)
+            row_ids.append([_row_table.row_id(text) for text in rows])
+            castling = 0
+            for letter, right in CASTLING_LETTERS:
+                if letter in fields[2]:
+                    castling |= right
+            en_passant = fields[3]
+            if en_passant != '-' and (en_passant not in SQUARE_INDEX or en_passant[1] not in '36'):
+                raise ValueError(f"Invalid FEN en passant square {en_passant!r}")
+            state[i] = (fields[1] == 'w', castling, SQUARE_INDEX[en_passant] if en_passant != '-' else -1)
+
+    if bitboards:
+        # Bit sq of each bitboard becomes square sq of its plane
+        bits = np.unpackbits(np.array(bitboards, dtype='<u8').view(np.uint8), bitorder='little')
+        out[board_indices, :PIECE_PLANES] = bits.reshape(-1, PIECE_PLANES, 8, 8)
+    if row_ids:
+        # (N, row, plane, col) -> (N, plane, row, col)
+        out[fen_indices, :PIECE_PLANES] = _row_table.array[np.array(row_ids)].transpose(0, 2, 1, 3)
+
+    out[:, SIDE_PLANE] = state[:, 0, None, None]
+    for offset, (_, right) in enumerate(CASTLING_LETTERS):
+        out[:, CASTLING_PLANES + offset] = (state[:, 1, None, None] & right) != 0
+    has_ep = np.flatnonzero(state[:, 2] >= 0)
+    ep = state[has_ep, 2]
+    out[has_ep, EN_PASSANT_PLANE, ep >> 3, ep & 7] = 1
+
+    return out
+
+
+def decode_batch(planes):
+    """Turn an (N, PLANES, 8, 8) array from encode_batch back into FEN strings.
+
+    The planes have no move counters, so every FEN ends in "0 1".
+    """
+    planes = np.asarray(planes)
+    pieces = planes[:, :PIECE_PLANES] != 0
+    # Piece code per square: 0 when empty, otherwise the plane number + 1
+    codes = np.where(pieces.any(axis=1), pieces.argmax(axis=1) + 1, 0).astype(np.uint8)
+    row_bytes = codes.reshape(len(planes), 8, 8)
+
+    turns = planes[:, SIDE_PLANE, 0, 0] != 0
+    castling = planes[:, CASTLING_PLANES:CASTLING_PLANES + 4, 0, 0] != 0
+    ep_planes = planes[:, EN_PASSANT_PLANE].reshape(len(planes), 64) != 0
+    ep_squares = np.where(ep_planes.any(axis=1), ep_planes.argmax(axis=1), -1)
+
+    fens = []
+    for i in range(len(planes)):
+        placement = '/'.join(_decode_row(row.tobytes()) for row in row_bytes[i])
+        rights = ''.join(letter for (letter, _), held in zip(CASTLING_LETTERS, castling[i]) if held) or '-'
+        ep = SQUARE_NAMES[ep_squares[i]] if ep_squares[i] >= 0 else '-'
+        fens.append(f"{placement} {'w' if turns[i] else 'b'} {rights} {ep} 0 1")
+
+    return fens
+
+
+def iter_batches(positions, batch_size=4096, dtype=np.float32):
+    """Encode an iterable of Boards and/or FENs batch by batch.
+
+    The same array is refilled for every batch, so memory stays the same however many
+    positions there are; copy a batch if it is needed after the next one is produced.
+    """
+    out = np.zeros((batch_size, PLANES, 8, 8), dtype=dtype)
+    batch = []
+    for position in positions:
+        batch.append(position)
+        if len(batch) == batch_size:
+            yield encode_batch(batch, out)
+            batch = []
+
+    if batch:
+        yield encode_batch(batch, out)
+
+
+def fens_from_file(path):
+    """Yield the FEN on each non-empty line of a text file."""
+    with open(path, encoding='utf-8') as stream:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def fens_from_pgn(path):
+    """Yield the FEN of every position in every game of a PGN file, stopping a game at its first bad move."""
+    with open(path, encoding='utf-8', errors='replace') as stream:
+        for game in read_games(stream):
+            board = Board(game.fen)
+            yield board.to_fen()
+            for san in game.moves:
+                try:
+                    push_san(board, san)
+                except ValueError:
+                    break
+                yield board.to_fen()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encode the positions of a PGN or FEN file as NumPy arrays.")
+    parser.add_argument('path', help=".pgn file, or a text file with one FEN per line")
+    parser.add_argument('--batch-size', type=int, default=4096)
+    parser.add_argument('--output', help="append every batch to this file with numpy.save")
+    args = parser.parse_args(argv)
+
+    source = fens_from_pgn(args.path) if args.path.lower().endswith('.pgn') else fens_from_file(args.path)
+    output = open(args.output, 'wb') if args.output else None
+    positions = batches = 0
+    start = time.perf_counter()
+    for batch in iter_batches(source, args.batch_size):
+        positions += len(batch)
+        batches += 1
+        if output is not None:
+            np.save(output, batch)
+    elapsed = time.perf_counter() - start
+    if output is not None:
+        output.close()
+
+    rate = positions / elapsed if elapsed > 0 else 0.0
+    print(f"{positions} positions in {batches} batches, {elapsed:.2f}s ({rate:,.0f} positions/s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
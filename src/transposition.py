@@ -0,0 +1,86 @@
+"""Fixed-size transposition table keyed by Board.zobrist_key.
+
+Entries are packed into two flat arrays of unsigned 64-bit integers, so the table never grows
+past the memory cap it was created with. Each bucket holds two entries: a depth-preferred slot
+that is only overwritten by an equal or deeper search of another position, and an always-replace
+slot that takes everything else.
+"""
+
+from array import array
+from collections import namedtuple
+
+from board import Move
+
+# Bound stored with a score
+EXACT, LOWER_BOUND, UPPER_BOUND = 1, 2, 3
+
+ENTRY_BYTES = 16  # 8 for the key, 8 for the packed data
+_PROMOTIONS = ' QRBN'
+_SCORE_OFFSET = 1 << 31  # Scores are stored unsigned in 32 bits
+
+
+TTEntry = namedtuple('TTEntry', ('depth', 'score', 'bound', 'move'))  # move is a Move or None
+
+
+def _pack(depth, score, bound, move):
+    if move is None:
+        packed_move = 0
+    else:
+        packed_move = 1 | move.start << 1 | move.end << 7 | _PROMOTIONS.index(move.promotion or ' ') << 13
+    return (score + _SCORE_OFFSET) | (depth & 0xFF) << 32 | bound << 40 | packed_move << 42
+
+
+def _unpack(data):
+    packed_move = data >> 42
+    move = None
+    if packed_move & 1:
+        promotion = _PROMOTIONS[packed_move >> 13 & 7]
+        move = Move(packed_move >> 1 & 63, packed_move >> 7 & 63, None if promotion == ' ' else promotion)
+    return TTEntry(data >> 32 & 0xFF, (data & 0xFFFFFFFF) - _SCORE_OFFSET, data >> 40 & 3, move)
+
+
+class TranspositionTable:
+    def __init__(self, size_mb=16):
+        # Round the bucket count down to a power of two so the index is a mask of the key
+        buckets = max(1, size_mb * 1024 * 1024 // (2 * ENTRY_BYTES))
+        self.bucket_count = 1 << (buckets.bit_length() - 1)
+        self._mask = self.bucket_count - 1
+        self.clear()
+
+    def probe(self, key):
+        """Return the stored entry for the position, or None."""
+        slot = (key & self._mask) << 1
+        keys = self.keys
+        if keys[slot] == key and self.data[slot]:
+            return _unpack(self.data[slot])
+        if keys[slot + 1] == key and self.data[slot + 1]:
+            return _unpack(self.data[slot + 1])
+
+        return None
+
+    def store(self, key, depth, score, bound, move=None):
+        slot = (key & self._mask) << 1
+        keys, data = self.keys, self.data
+        packed = _pack(depth, score, bound, move)
+
+        # Depth-preferred slot: take it when empty, when it holds this position, or when we searched deeper
+        if not data[slot] or keys[slot] == key or depth >= data[slot] >> 32 & 0xFF:
+            keys[slot] = key
+            data[slot] = packed
+        else:
+            keys[slot + 1] = key
+            data[slot + 1] = packed
+
+    def clear(self):
+        # Two 8-byte slots per bucket in each array
+        self.keys = array('Q', bytes(16 * self.bucket_count))
+        self.data = array('Q', bytes(16 * self.bucket_count))
+
+    def hashfull(self):
+        """Filled entries per thousand, sampled from the first thousand slots."""
+        sample = min(1000, len(self.data))
+        return sum(1 for i in range(sample) if self.data[i]) * 1000 // sample
+
+    @property
+    def size_bytes(self):
+        return len(self.keys) * 8 + len(self.data) * 8
@@ -0,0 +1,204 @@
+"""Check every game in a corpus against the rules, spread over worker processes.
+
+The corpus is either a PGN file or a text file with one game per line: a FEN (or "startpos"),
+a semicolon, then the moves in UCI or SAN separated by spaces:
+
+    startpos; e2e4 e7e5 g1f3
+    7k/8/8/8/8/8/8/R3K2R w KQ - 0 1; Ra8#
+
+The main process only cuts the file into shards of whole games. Workers parse and replay them,
+and at most two shards per worker are in flight at any time, so memory stays flat however big
+the corpus is.
+
+    python validate.py games.pgn --workers 8
+    python validate.py positions.txt --shard-size 2000 --quiet
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from board import Board, Move, STARTING_FEN
+from bitboard import COLOR_INDEX, SQUARE_NAMES
+from pgn import read_games, push_san
+
+UCI_PATTERN = re.compile(r'[a-h][1-8][a-h][1-8][qrbn]?')
+
+
+# statuses counts games per final status (one of Board.game_status's, or illegal), results games per
+# final result, e.g. '1-0', and illegal lists (game number, reason) for every game with an illegal move
+ShardReport = namedtuple('ShardReport', ('shard', 'games', 'moves', 'elapsed', 'statuses', 'results', 'illegal'))
+
+
+def push_uci(board, text):
+    """Play a move given in UCI on the board and return it. Raises ValueError if it is illegal."""
+    move = Move.from_uci(text)
+    piece = board.board[move.start >> 3][move.start & 7]
+    if piece == ' ' or piece.color != board.turn or not piece.targets(board) >> move.end & 1:
+        raise ValueError(f"Illegal move {text!r}")
+    if (move.promotion is not None) != board.is_promotion_move(SQUARE_NAMES[move.start], SQUARE_NAMES[move.end]):
+        raise ValueError(f"Illegal move {text!r}")
+
+    color_index = COLOR_INDEX[board.turn]
+    board.make_move(move)
+    king_sq = board.king_squares[color_index]
+    if king_sq is not None and board.is_square_attacked(king_sq, 1 - color_index):
+        board.unmake_move()
+        raise ValueError(f"Illegal move {text!r}")
+
+    return move
+
+
+def _replay(fen, moves):
+    """Play the moves from the position. Returns (board, moves played, error or None)."""
+    board = Board(fen)
+    for played, token in enumerate(moves):
+        number = f"{board.fullmove_number}{'.' if board.turn == 'white' else '...'}"
+        try:
+            if UCI_PATTERN.fullmatch(token):
+                push_uci(board, token)
+            else:
+                push_san(board, token)
+        except ValueError as error:
+            return board, played, f"{number} {token}: {error}"
+
+    return board, len(moves), None
+
+
+def _parse_move_list(lines):
+    """Yield (fen, moves) for each "<fen>; <moves>" line."""
+    for line in lines:
+        fen, _, moves = line.partition(';')
+        fen = fen.strip()
+        yield STARTING_FEN if fen in ('', 'startpos') else fen, moves.split()
+
+
+def validate_shard(shard, first_game, lines, is_pgn):
+    """Replay the games in a shard of corpus lines and summarise them in a ShardReport."""
+    start = time.perf_counter()
+    statuses, results = Counter(), Counter()
+    illegal = []
+    total_moves = 0
+
+    if is_pgn:
+        games = ((game.fen, game.moves) for game in read_games(lines))
+    else:
+        games = _parse_move_list(lines)
+
+    number = first_game - 1
+    for number, (fen, moves) in enumerate(games, start=first_game):
+        try:
+            board, played, error = _replay(fen, moves)
+        except ValueError as fen_error:
+            played, error = 0, str(fen_error)
+        total_moves += played
+        if error is not None:
+            statuses['illegal'] += 1
+            illegal.append((number, error))
+            continue
+        status, result = board.game_status()
+        statuses[status] += 1
+        results[result] += 1
+
+    return ShardReport(shard, number - first_game + 1, total_moves, time.perf_counter() - start, statuses,
+                       results, illegal)
+
+
+def read_shards(stream, shard_size, is_pgn):
+    """Cut a corpus into lists of lines holding shard_size whole games each. Yields (first game number, lines)."""
+    lines = []
+    games = 0
+    first_game = 1
+    in_movetext = False
+    for line in stream:
+        if is_pgn:
+            # A tag line after movetext starts the next game
+            is_tag = line.startswith('[')
+            if is_tag and in_movetext:
+                games += 1
+                if games == shard_size:
+                    yield first_game, lines
+                    lines, games, first_game = [], 0, first_game + shard_size
+            if line.strip():
+                in_movetext = not is_tag
+        elif line.strip():
+            games += 1
+        else:
+            continue
+        lines.append(line)
+        if not is_pgn and games == shard_size:
+            yield first_game, lines
+            lines, games, first_game = [], 0, first_game + shard_size
+
+    if lines:
+        yield first_game, lines
+
+
+def print_shard(report, out=sys.stdout):
+    rate = report.moves / report.elapsed if report.elapsed > 0 else 0.0
+    print(f"shard {report.shard}: {report.games} games, {report.moves} moves in {report.elapsed:.2f}s "
+          f"({rate:,.0f} moves/s), {report.statuses['illegal']} illegal", file=out)
+
+
+def validate_corpus(path, workers=None, shard_size=500, quiet=False, out=sys.stdout):
+    """Validate every game in the file and print a summary. Returns the totals as a ShardReport."""
+    workers = workers or os.cpu_count() or 1
+    is_pgn = path.lower().endswith('.pgn')
+    start = time.perf_counter()
+    games = moves = 0
+    statuses, results = Counter(), Counter()
+    illegal = []
+
+    def collect(done):
+        nonlocal games, moves
+        for future in done:
+            report = future.result()
+            games += report.games
+            moves += report.moves
+            statuses.update(report.statuses)
+            results.update(report.results)
+            illegal.extend(report.illegal)
+            if not quiet:
+                print_shard(report, out)
+                for number, reason in report.illegal:
+                    print(f"  game {number}: {reason}", file=out)
+
+    with open(path, encoding='utf-8', errors='replace') as stream, ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for shard, (first_game, lines) in enumerate(read_shards(stream, shard_size, is_pgn)):
+            # Bounded queue: wait for a shard to finish before reading more than two per worker
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(pool.submit(validate_shard, shard, first_game, lines, is_pgn))
+        collect(wait(pending).done)
+
+    elapsed = time.perf_counter() - start
+    rate = moves / elapsed if elapsed > 0 else 0.0
+    print(f"{games} games, {moves} moves in {elapsed:.2f}s ({games * 60 / elapsed if elapsed > 0 else 0:,.0f} games/min, "
+          f"{rate:,.0f} moves/s) on {workers} workers", file=out)
+    print("status: " + ', '.join(f"{status} {count}" for status, count in sorted(statuses.items())), file=out)
+    print("results: " + ', '.join(f"{result} {count}" for result, count in sorted(results.items())), file=out)
+
+    illegal.sort()
+    return ShardReport(-1, games, moves, elapsed, statuses, results, illegal)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the games in a PGN or FEN/move list corpus on several cores.")
+    parser.add_argument('path', help="corpus file (.pgn, or one '<fen>; <moves>' game per line)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument('--shard-size', type=int, default=500, help="games per shard handed to a worker")
+    parser.add_argument('--quiet', action='store_true', help="only print the totals")
+    args = parser.parse_args(argv)
+
+    report = validate_corpus(args.path, args.workers, args.shard_size, args.quiet)
+    return 1 if report.illegal else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""Zobrist keys identifying a position by a 64-bit number.
+
+Board keeps board.zobrist_key up to date as pieces are put, removed and moves are made;
+compute_hash rebuilds it from scratch.
+"""
+
+from bitboard import *
+
+_seed = 0x5EED  # Fixed so keys are the same in every process
+
+
+def _random_key():
+    # splitmix64, which saves importing the random module on every start
+    global _seed
+    _seed = (_seed + 0x9E3779B97F4A7C15) & FULL
+    z = _seed
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & FULL
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & FULL
+    return z ^ (z >> 31)
+
+
+PIECE_KEYS = [[_random_key() for _ in range(64)] for _ in range(12)]  # Indexed by Piece.index, then square
+SIDE_KEY = _random_key()  # Present when black is to move
+CASTLING_KEYS = [_random_key() for _ in range(16)]  # Indexed by the castling rights bits
+EN_PASSANT_KEYS = [_random_key() for _ in range(8)]  # Indexed by file
+CASTLING_KEYS[0] = 0
+
+
+def en_passant_key(board):
+    """Key for the en passant file, only counted when a pawn of the side to move could capture there."""
+    if board.en_passant_target is None:
+        return 0
+
+    sq = SQUARE_INDEX[board.en_passant_target]
+    color_index = COLOR_INDEX[board.turn]
+    if PAWN_ATTACKS[1 - color_index][sq] & board.bitboards[color_index * 6 + PAWN]:
+        return EN_PASSANT_KEYS[sq & 7]
+
+    return 0
+
+
+def compute_hash(board):
+    key = 0
+    for index, bb in enumerate(board.bitboards):
+        for sq in iter_bits(bb):
+            key ^= PIECE_KEYS[index][sq]
+
+    key ^= CASTLING_KEYS[board.castling_rights] ^ en_passant_key(board)
+    if board.turn == 'black':
+        key ^= SIDE_KEY
+
+    return key